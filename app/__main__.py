@@ -1,6 +1,12 @@
-import asyncio
+import time
 
-from .main import main
+started_at = time.monotonic()
+
+import asyncio  # noqa: E402
+
+from .main import main  # noqa: E402
+from .services.metrics import metrics  # noqa: E402
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    metrics.set("startup.import_seconds", time.monotonic() - started_at)
+    asyncio.run(main(started_at))
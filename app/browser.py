@@ -4,9 +4,17 @@ from selenium.webdriver.remote.webdriver import WebDriver
 from loguru import logger
 from selenium.webdriver.support.wait import WebDriverWait
 
+from typing import Optional, List, Dict, Any
+
 from app.consts import ROBLOX_HOME_URL
 from app.repos import TokenRepository
-from app.services.driver import presence_of_any_text_in_element, set_token
+from app.services.breaker import CircuitBreaker, guard
+from app.services.driver import presence_of_any_text_in_element, set_token, use_proxy
+from app.services.proxies import ProxyPool
+from app.services.sessions import SessionStore, SessionSnapshot, restore_session, login_with_tokens
+
+# keys of get_cookies() items which add_cookie accepts back
+RESTORABLE_COOKIE_KEYS = ("name", "value", "domain", "path", "secure", "httpOnly", "expiry")
 
 
 def is_authed(driver: WebDriver) -> bool:
@@ -34,23 +42,63 @@ def auth(browser: WebDriver, token: str):
 	browser.refresh()
 
 
-async def auth_browser(driver: WebDriver, token_service: TokenRepository, depth: int = 5) -> None:
-	logger.info("First token has been taken")
+def restore_cookies(browser: WebDriver, cookies: List[Dict[str, Any]]):
+	"""
+	Sets saved cookies without refresh, they are used from the next navigation
 
-	token = await token_service.fetch_token()
-	if token is None:
-		raise ValueError("Tokens are unavailable")
+	:param browser:
+	:param cookies:
+	:return:
+	"""
+	browser.get(ROBLOX_HOME_URL)
+	for cookie in cookies:
+		browser.add_cookie({k: v for k, v in cookie.items() if k in RESTORABLE_COOKIE_KEYS})
 
-	logger.info("Starting authentication to roblox.com")
 
-	logger.info("Logging in")
-	auth(driver, token)
-	if not is_authed(driver):
-		if depth == 0:
-			await token_service.mark_as_inactive(token)
+async def restore_browser(
+		driver: WebDriver,
+		token_service: TokenRepository,
+		session_store: SessionStore,
+		proxies: Optional[ProxyPool] = None,
+		db_breaker: Optional[CircuitBreaker] = None,
+) -> Optional[SessionSnapshot]:
+	"""
+	Восстанавливает сессию из последнего снимка, без логина и ожидания страницы.
+	None если снимка нет, токен уже не активен или cookies не проходят проверку.
+	"""
+	snapshot = await restore_session(token_service, session_store, proxies, db_breaker)
+	if snapshot is None:
+		return None
+
+	if proxies is not None:
+		switch_proxy(driver, proxies, snapshot.token)
+	restore_cookies(driver, snapshot.cookies)
+	with guard(db_breaker):
+		await token_service.mark_as_used(snapshot.token)
+	logger.info("Session restored from snapshot")
+
+	return snapshot
 
-		logger.warning("Login failed, trying another token!")
 
-		return await auth_browser(driver, token_service, depth - 1)
+def switch_proxy(driver: WebDriver, proxies: ProxyPool, token: str):
+	proxy = proxies.for_token(token)
+	use_proxy(driver, proxy.url if proxy else None)
+
+
+async def auth_browser(
+		driver: WebDriver,
+		token_service: TokenRepository,
+		depth: int = 5,
+		proxies: Optional[ProxyPool] = None,
+		db_breaker: Optional[CircuitBreaker] = None,
+) -> str:
+	logger.info("Starting authentication to roblox.com")
+
+	async def login(token: str) -> bool:
+		logger.info("Logging in")
+		if proxies is not None:
+			switch_proxy(driver, proxies, token)
+		auth(driver, token)
+		return is_authed(driver)
 
-	logger.info("Login complete")
+	return await login_with_tokens(token_service, login, depth, proxies, db_breaker)
@@ -0,0 +1,405 @@
+"""
+Служебные команды для обслуживания бота.
+
+    python -m app.cli import tokens.txt other.txt
+    cat tokens.txt | python -m app.cli import -
+    python -m app.cli stats
+    python -m app.cli bench --count 50000
+    python -m app.cli explain
+    python -m app.cli bench-scrape
+    python -m app.cli session-key
+    python -m app.cli bench-logging
+    python -m app.cli bench-startup
+    python -m app.cli bench-search --latency 0.05 --failure-rate 0.1
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Iterable, Iterator, TextIO, List, Tuple
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from app.consts import DEFAULT_IMPORT_CHUNK_SIZE
+from app.log import configure_logging, hot_logger, shorten
+from app.providers import get_connection
+from app.repos import TokenRepository
+from app.services.helpers import chunked
+from app.settings import get_settings, Settings
+
+
+def iter_tokens(streams: Iterable[TextIO]) -> Iterator[str]:
+    for stream in streams:
+        for line in stream:
+            token = line.strip()
+            if not token or token.startswith("#"):
+                continue
+            yield token
+
+
+def open_sources(paths: List[str]) -> Iterator[TextIO]:
+    if not paths:
+        paths = ["-"]
+
+    for path in paths:
+        if path == "-":
+            yield sys.stdin
+            continue
+        with open(path, encoding="utf8") as f:
+            yield f
+
+
+async def import_tokens(repo: TokenRepository, tokens: Iterable[str], chunk_size: int) -> Tuple[int, int]:
+    """
+    Загружает токены кусками по chunk_size, в памяти держится только один кусок
+
+    :return: amount of read and inserted tokens
+    """
+    read = 0
+    inserted = 0
+    for chunk in chunked(tokens, chunk_size):
+        # duplicates inside of a single statement batch are dropped here,
+        # duplicates against the table are skipped by the unique index
+        inserted += await repo.import_tokens(dict.fromkeys(chunk))
+        read += len(chunk)
+        logger.debug(f"Imported chunk of {len(chunk)} tokens, {read} total")
+    return read, inserted
+
+
+async def cmd_import(settings: Settings, args: argparse.Namespace) -> None:
+    connection = await get_connection(settings)
+    repo = TokenRepository(connection, settings.db_tokens_table)
+    try:
+        await repo.migrate()
+
+        start = time.perf_counter()
+        read, inserted = await import_tokens(repo, iter_tokens(open_sources(args.files)), args.chunk_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        await connection.close()
+
+    print(json.dumps({
+        "read": read,
+        "inserted": inserted,
+        "seconds": round(elapsed, 3),
+    }))
+
+
+async def cmd_stats(settings: Settings, args: argparse.Namespace) -> None:
+    connection = await get_connection(settings)
+    repo = TokenRepository(connection, settings.db_tokens_table)
+    try:
+        stats = await repo.count_tokens()
+    finally:
+        await connection.close()
+
+    print(json.dumps(stats))
+
+
+async def cmd_bench(settings: Settings, args: argparse.Namespace) -> None:
+    """
+    Меряет скорость импорта на отдельной временной таблице,
+    первый проход - новые токены, второй - те же токены (только дедупликация)
+    """
+    connection = await get_connection(settings)
+    repo = TokenRepository(connection, f"{settings.db_tokens_table}_bench")
+    tokens = [uuid.uuid4().hex for _ in range(args.count)]
+    result = {"count": args.count, "chunk_size": args.chunk_size}
+    try:
+        await repo.drop_tokens_table()
+        await repo.migrate()
+
+        for name in ("insert", "dedup"):
+            start = time.perf_counter()
+            await import_tokens(repo, iter(tokens), args.chunk_size)
+            elapsed = time.perf_counter() - start
+            result[f"{name}_tokens_per_second"] = round(args.count / elapsed, 1)
+    finally:
+        await repo.drop_tokens_table()
+        await connection.close()
+
+    print(json.dumps(result))
+
+
+def find_seq_scans(table: str, plan: List[str]) -> List[str]:
+    scans = []
+    for line in plan:
+        if f"Seq Scan on {table}" in line:
+            scans.append(line)
+        elif line.startswith(f"SCAN {table}") and "USING" not in line:
+            scans.append(line)
+    return scans
+
+
+async def cmd_explain(settings: Settings, args: argparse.Namespace) -> None:
+    """
+    Печатает планы горячих запросов к таблице токенов.
+    На почти пустой таблице postgres может выбрать Seq Scan даже с индексом.
+    """
+    connection = await get_connection(settings)
+    repo = TokenRepository(connection, settings.db_tokens_table)
+    try:
+        await repo.migrate()
+        plans = await repo.explain_hot_queries()
+    finally:
+        await connection.close()
+
+    failed = False
+    for name, plan in plans.items():
+        scans = find_seq_scans(settings.db_tokens_table, plan)
+        failed = failed or bool(scans)
+        print(json.dumps({"query": name, "plan": plan, "sequential_scan": bool(scans)}))
+
+    if failed and args.strict:
+        sys.exit(1)
+
+
+SEARCH_RESULTS_FIXTURE = Path(__file__).parent / "fixtures" / "search_results.html"
+
+
+async def cmd_bench_scrape(settings: Settings, args: argparse.Namespace) -> None:
+    """
+    Сравнивает время разбора одной страницы результатов: по элементам
+    (запрос к драйверу на каждый .text) и одним execute_script.
+    Страница - локальный статический html, сеть не участвует.
+    """
+    from app.services.driver import get_driver, close_drivers
+    from app.services.scraper import scrape_search_results, scrape_search_results_by_elements
+
+    driver = get_driver(settings)
+    result = {"iterations": args.iterations}
+    try:
+        driver.get(Path(args.fixture).resolve().as_uri())
+
+        for name, scrape in (("elements", scrape_search_results_by_elements), ("script", scrape_search_results)):
+            cards = len(scrape(driver))  # warm up
+
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                scrape(driver)
+            elapsed = time.perf_counter() - start
+
+            result[f"{name}_cards"] = cards
+            result[f"{name}_ms_per_page"] = round(elapsed / args.iterations * 1000, 2)
+    finally:
+        close_drivers([driver])
+
+    print(json.dumps(result))
+
+
+async def cmd_session_key(settings: Settings, args: argparse.Namespace) -> None:
+    from cryptography.fernet import Fernet
+
+    print(Fernet.generate_key().decode())
+
+
+async def cmd_bench_logging(settings: Settings, args: argparse.Namespace) -> None:
+    """
+    Меряет сколько логирование стоит потоку обработки на одно сообщение
+    (получение, подтверждение, отправка ответа) в dev и production профилях.
+    Логи пишутся во временную папку, stderr на время замера отключен.
+    """
+    body = json.dumps({"name": "x" * args.body_size, "limit": 50}).encode()
+    result = {"messages": args.messages, "body_size": len(body)}
+
+    with tempfile.TemporaryDirectory() as log_dir, open(os.devnull, "w") as devnull:
+        for profile in ("dev", "production"):
+            with contextlib.redirect_stderr(devnull):
+                configure_logging(
+                    [],
+                    profile=profile,
+                    sample_every=settings.log_sample_every,
+                    value_limit=settings.log_value_limit,
+                    log_dir=os.path.join(log_dir, profile),
+                )
+
+                start = time.perf_counter()
+                for tag in range(args.messages):
+                    hot_logger.info(f"Received message # {tag} from bench: {shorten(body)}")
+                    hot_logger.info(f"Acknowledging message {tag}")
+                    hot_logger.info(f"Sent message. Body: {shorten(body, 128)}")
+                elapsed = time.perf_counter() - start
+
+                start = time.perf_counter()
+                logger.remove()  # waits until background writers are done
+                drained = time.perf_counter() - start
+
+            result[f"{profile}_us_per_message"] = round(elapsed / args.messages * 1e6, 2)
+            result[f"{profile}_drain_seconds"] = round(drained, 3)
+
+    logger.add(sys.stderr)
+    print(json.dumps(result))
+
+
+HEAVY_MODULES = ("selenium", "seleniumwire", "webdriver_manager", "aiohttp", "asyncpg", "pika", "pydantic", "cryptography")
+
+# runs in a fresh interpreter, argv: backend and module names to look for in sys.modules
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+phases = {"main_import": time.perf_counter() - start}
+if sys.argv[1] == "browser":
+    start = time.perf_counter()
+    import app.handlers, seleniumwire.webdriver
+    phases["browser_import"] = time.perf_counter() - start
+print(json.dumps({"phases": phases, "loaded": [name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+
+async def cmd_bench_startup(settings: Settings, args: argparse.Namespace) -> None:
+    """
+    Меряет импорт точки входа в новом процессе для каждого бэкенда поиска
+    и показывает какие тяжелые библиотеки он тянет, берется лучший из runs запусков.
+    Инициализация (db, драйвер, auth) меряется при настоящем старте, строка Startup phases в логе.
+    """
+    root = Path(__file__).parent.parent
+    result = {"runs": args.runs}
+    for backend in ("http", "browser"):
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_PROBE, backend, *HEAVY_MODULES],
+                cwd=root, capture_output=True, text=True, check=True,
+            ).stdout
+            runs.append(json.loads(output.splitlines()[-1]))
+
+        result[backend] = {f"{phase}_ms": round(min(run["phases"][phase] for run in runs) * 1000, 1) for phase in runs[0]["phases"]}
+        result[backend]["loaded"] = runs[0]["loaded"]
+
+    print(json.dumps(result))
+
+
+async def cmd_bench_search(settings: Settings, args: argparse.Namespace) -> None:
+    """
+    Гоняет UrlHandler по страницам FixtureServer через FakeWebDriver,
+    без браузера и сети. Задержка и доля 429 / выбросов на логин задаются
+    аргументами, неудачный запрос стоит как в жизни - ожидание WebDriverWait.
+    """
+    from selenium.common import WebDriverException
+
+    from app.browser import auth, is_authed
+    from app.errors import SessionExpired
+    from app.fixtures.publisher import RecordingPublisher
+    from app.fixtures.server import FixtureServer
+    from app.fixtures.webdriver import FakeWebDriver
+    from app.handlers import UrlHandler, press_agreement_button
+    from app.schemas import SearchData
+
+    server = FixtureServer(
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        logout_rate=args.logout_rate,
+        agreement_rate=args.agreement_rate,
+        results=args.results,
+        seed=args.seed,
+    )
+    with server:
+        driver = FakeWebDriver(server.url)
+        auth(driver, "fixture-token")
+        press_agreement_button(driver)
+        if not is_authed(driver):
+            raise RuntimeError("Fixture login failed")
+
+        handler = UrlHandler()
+        await handler.setup(token_service=None)
+        publisher = RecordingPublisher()
+
+        latencies = []
+        failed = 0
+        start = time.perf_counter()
+        for number in range(args.requests):
+            search_data = SearchData(name=f"user{number}", limit=args.limit)
+            request_start = time.perf_counter()
+            try:
+                await handler(driver, search_data, settings, publisher, {})
+            except (WebDriverException, SessionExpired):
+                failed += 1
+            latencies.append(time.perf_counter() - request_start)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    results = sum(len(message["data"]) for message in publisher.messages)
+    print(json.dumps({
+        "requests": args.requests,
+        "failed": failed,
+        "results": results,
+        "page_loads": server.requests,
+        "rps": round(args.requests / elapsed, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+    }))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="import .ROBLOSECURITY tokens, one per line")
+    import_parser.add_argument("files", nargs="*", help="files to read, '-' or nothing for stdin")
+    import_parser.add_argument("--chunk-size", type=int, default=DEFAULT_IMPORT_CHUNK_SIZE)
+    import_parser.set_defaults(handler=cmd_import)
+
+    stats_parser = commands.add_parser("stats", help="print active/inactive token counts as json")
+    stats_parser.set_defaults(handler=cmd_stats)
+
+    bench_parser = commands.add_parser("bench", help="measure import throughput on a scratch table")
+    bench_parser.add_argument("--count", type=int, default=10000)
+    bench_parser.add_argument("--chunk-size", type=int, default=DEFAULT_IMPORT_CHUNK_SIZE)
+    bench_parser.set_defaults(handler=cmd_bench)
+
+    explain_parser = commands.add_parser("explain", help="print query plans of the hot token queries")
+    explain_parser.add_argument("--strict", action="store_true", help="exit with 1 if a sequential scan is found")
+    explain_parser.set_defaults(handler=cmd_explain)
+
+    scrape_parser = commands.add_parser("bench-scrape", help="compare search page extraction latency")
+    scrape_parser.add_argument("--iterations", type=int, default=50)
+    scrape_parser.add_argument("--fixture", default=str(SEARCH_RESULTS_FIXTURE))
+    scrape_parser.set_defaults(handler=cmd_bench_scrape)
+
+    key_parser = commands.add_parser("session-key", help="generate a key for encrypted session snapshots")
+    key_parser.set_defaults(handler=cmd_session_key)
+
+    logging_parser = commands.add_parser("bench-logging", help="measure logging overhead per message")
+    logging_parser.add_argument("--messages", type=int, default=10000)
+    logging_parser.add_argument("--body-size", type=int, default=2000)
+    logging_parser.set_defaults(handler=cmd_bench_logging)
+
+    startup_parser = commands.add_parser("bench-startup", help="measure entry point import time per search backend")
+    startup_parser.add_argument("--runs", type=int, default=5)
+    startup_parser.set_defaults(handler=cmd_bench_startup)
+
+    search_parser = commands.add_parser("bench-search", help="run the browser search handler against local fixtures")
+    search_parser.add_argument("--requests", type=int, default=100)
+    search_parser.add_argument("--limit", type=int, default=0, help="results per request, 0 - first page only")
+    search_parser.add_argument("--results", type=int, default=50, help="results the fixture has for every name")
+    search_parser.add_argument("--latency", type=float, default=0.0, help="seconds per page load")
+    search_parser.add_argument("--failure-rate", type=float, default=0.0, help="share of page loads answered with 429")
+    search_parser.add_argument("--logout-rate", type=float, default=0.0, help="share of page loads showing the login page")
+    search_parser.add_argument("--agreement-rate", type=float, default=0.0, help="share of pages with the agreement modal")
+    search_parser.add_argument("--seed", type=int, default=0)
+    search_parser.set_defaults(handler=cmd_bench_search)
+
+    return parser
+
+
+def main(argv: List[str] = None) -> None:
+    load_dotenv()
+
+    args = build_parser().parse_args(argv)
+    settings = get_settings()
+
+    asyncio.run(args.handler(settings, args))
+
+
+if __name__ == "__main__":
+    main()
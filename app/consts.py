@@ -1,5 +1,16 @@
 ROBLOX_TOKEN_KEY = ".ROBLOSECURITY"
+ROBLOX_COOKIE_DOMAIN = "roblox.com"
 ROBLOX_HOME_URL = "https://www.roblox.com/home"
+ROBLOX_AUTHENTICATED_URL = "https://users.roblox.com/v1/users/authenticated"
+ROBLOX_CSRF_HEADER = "x-csrf-token"
+ROBLOX_PROXY_CHECK_URL = "https://www.roblox.com/robots.txt"
+ROBLOX_CSRF_REFRESH_URL = "https://auth.roblox.com/v2/logout"  # answers 403 with a token when none is sent
+ROBLOX_SEARCH_NEXT_PAGE_SELECTOR = ".pager-next button"
+ROBLOX_SEARCH_LOGIN_SELECTOR = ".text-overflow.avatar-card-label.ng-binding"
+ROBLOX_SEARCH_NICKNAME_SELECTOR = ".avatar-name"
+ROBLOX_USER_SEARCH_URL = "https://users.roblox.com/v1/users/search"
+ROBLOX_USER_SEARCH_PAGE_SIZES = (10, 25, 50, 100)  # the only limit values the API accepts
+ROBLOX_GAME_PASS_INFO_URL = "https://apis.roblox.com/game-passes/v1/game-passes/{id}/product-info"
 
 DEFAULT_QUEUE_NAME = "url_queue"
 DEFAULT_EXCHANGE_NAME = "url"
@@ -7,6 +18,73 @@ DEFAULT_ROUTING_KEY = DEFAULT_QUEUE_NAME
 DEFAULT_SEND_NAME = DEFAULT_QUEUE_NAME + "_return"
 DEFAULT_SEND_EXCHANGE_NAME = DEFAULT_EXCHANGE_NAME + "_return"
 DEFAULT_THREADS_COUNT = 2
+DEFAULT_RECONNECT_BASE_DELAY = 1.0
+DEFAULT_RECONNECT_MAX_DELAY = 30.0
+DEFAULT_DRAIN_TIMEOUT = 30.0
+
+DEFAULT_IDEMPOTENCY_TTL = 3600.0
+DEFAULT_IDEMPOTENCY_MAX_SIZE = 10000
+DEFAULT_IDEMPOTENCY_TABLE = "processed_messages"
+
+DEFAULT_RETRY_DELAYS = "5,30,120"  # seconds before each retry, comma separated
+
+DEFAULT_LIMITER_MAX = 8
+DEFAULT_LIMITER_LATENCY_TARGET = 6.0
+DEFAULT_GLOBAL_RATE = 20.0
+DEFAULT_TOKEN_RATE = 1.0
+DEFAULT_ADMISSION_TIMEOUT = 30.0
+ADMISSION_POLL_INTERVAL = 0.05  # seconds between checks for a free concurrency slot
 
 TOKEN_RECURSIVE_CHECK = 5
+TOKEN_FAILURE_COOLDOWN = 300  # seconds token is skipped after failed login
+DEFAULT_SESSION_TTL = 7 * 24 * 3600.0  # seconds a saved session snapshot is trusted
+
+DEFAULT_DB_POOL_MIN_SIZE = 2
+DEFAULT_DB_POOL_MAX_SIZE = 10
+DEFAULT_DB_STATEMENT_CACHE_SIZE = 100
+DEFAULT_DB_COMMAND_TIMEOUT = 10.0
+DEFAULT_DB_SLOW_QUERY_MS = 200
+DEFAULT_SQLITE_COMMIT_BATCH = 64
+
+DEFAULT_HTTP_LIMIT = 100
+DEFAULT_HTTP_LIMIT_PER_HOST = 20
+DEFAULT_HTTP_DNS_TTL = 300
+DEFAULT_HTTP_KEEPALIVE_TIMEOUT = 30.0
+DEFAULT_HTTP_TIMEOUT = 15.0
+
+DEFAULT_PROXY_RATE = 2.0
+DEFAULT_PROXY_MAX_FAILURES = 3
+DEFAULT_PROXY_EJECT_TIME = 300.0
+DEFAULT_PROXY_CHECK_INTERVAL = 60.0
+
+DEFAULT_LOG_SAMPLE_EVERY = 100  # production profile keeps one of N per-message records
+DEFAULT_LOG_VALUE_LIMIT = 300
+DEFAULT_LOG_QUEUE_SIZE = 10000
+
+DEFAULT_PROFILE_DIR = "profiles"
+DEFAULT_PROFILE_INTERVAL = 0.01  # seconds between stack samples
+
+DEFAULT_SEARCH_BACKEND = "browser"
+
+DEFAULT_STATUS_HOST = "0.0.0.0"
+DEFAULT_CAPACITY_INTERVAL = 15.0  # seconds between queue depth samples
+DEFAULT_CAPACITY_WINDOW = 300.0  # seconds the service rate is averaged over
+DEFAULT_CAPACITY_TARGET_DRAIN = 120.0  # seconds a backlog should take to drain
+DEFAULT_CAPACITY_MAX_REPLICAS = 10
+DEFAULT_HEALTH_INTERVAL = 10.0  # seconds between token count / db checks
+DEFAULT_HEALTH_LIVENESS_TIMEOUT = 300.0  # event loop stalled longer than this fails /healthz
+
+DEFAULT_GAME_PASS_CACHE_TTL = 60.0  # price can be changed by the owner at any time
+DEFAULT_GAME_PASS_CACHE_SIZE = 10000
+DEFAULT_GAME_PASS_CONCURRENCY = 10
+
+DEFAULT_REPLY_BATCH_WINDOW = 0.0  # seconds a reply may wait for others, 0 publishes each one right away
+DEFAULT_REPLY_BATCH_SIZE = 50
+DEFAULT_REPLY_PUBLISH_TRIES = 5  # failed publishes of a reply batch before it is dropped
+
+DEFAULT_BREAKER_FAILURE_THRESHOLD = 5  # failures in a row that open a circuit, 0 disables breakers
+DEFAULT_BREAKER_RESET_TIMEOUT = 30.0  # seconds an open circuit waits before a probe
 
+DEFAULT_IMPORT_CHUNK_SIZE = 1000
+DEFAULT_STREAM_CHUNK_SIZE = 10
+MAX_SEARCH_LIMIT = 1000
@@ -1,2 +1,37 @@
 class GamePassAlreadyBought(Exception):
     pass
+
+
+class InvalidGamePass(Exception):
+    """
+    Link is not a game pass link or the game pass doesn't exist
+    """
+    pass
+
+
+class InvalidGamePassPrice(Exception):
+    """
+    Price in the request doesn't match the game pass or it's not for sale
+    """
+    pass
+
+
+class SessionExpired(Exception):
+    """
+    Roblox shows the login page instead of the requested one, the token no longer works
+    """
+    pass
+
+
+class LoginFailed(Exception):
+    """
+    None of the tried tokens could log in
+    """
+    pass
+
+
+class ScrapeSchemaError(Exception):
+    """
+    Page markup doesn't match what scraper expects, most likely roblox changed it
+    """
+    pass
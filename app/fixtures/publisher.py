@@ -0,0 +1,30 @@
+from typing import Dict, List, Optional
+
+from app.services.queue.publisher import Headers
+
+
+class RecordingPublisher:
+    """
+    Вместо BasicMessageSender в бенчмарках: ответы остаются в памяти
+    """
+
+    def __init__(self) -> None:
+        self.messages: List[Dict] = []
+
+    def send_message(
+        self,
+        body: Dict,
+        headers: Optional[Headers] = None,
+        exchange_name: str = None,
+        routing_key: str = None,
+    ):
+        self.messages.append(body)
+
+    def when_sent(self, callback):
+        callback(True)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,173 @@
+import html
+import random
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Tuple
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+from loguru import logger
+
+from app.consts import ROBLOX_TOKEN_KEY
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title} - Roblox</title></head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+NAVIGATION = '<div id="navigation"><span id="nav-robux-amount">1K+</span></div>'
+
+CARD = """<li class="avatar-card">
+  <div class="avatar-card-container">
+    <a class="avatar-card-link" href="/users/{user_id}/profile">
+      <div class="avatar-card-caption">
+        <div class="text-overflow avatar-name">{nickname}</div>
+        <div class="text-overflow avatar-card-label ng-binding">@{login}</div>
+      </div>
+    </a>
+  </div>
+</li>"""
+
+PAGER = '<div class="pager-next"><button{disabled} data-href="{href}">Next</button></div>'
+
+AGREEMENT_MODAL = """<div class="modal-window">
+  <div class="modal-body">Terms of Use have changed</div>
+  <div class="modal-footer"><button class="modal-button" data-dismiss="modal-window">Accept</button></div>
+</div>"""
+
+LOGGED_OUT = '<div id="login-page"><form class="login-form"><input id="login-username"></form></div>'
+
+
+class FixtureServer:
+    """
+    Локальный сервер страниц похожих на roblox.com для бенчмарков
+    и проверок без браузера и сети, в паре с FakeWebDriver.
+
+    /home и /search/users?keyword=...&page=N отдают карточки только
+    с cookie .ROBLOSECURITY, без неё - страницу логина. Задержка ответа,
+    доля 429, выбросов на логин и окон соглашения настраиваются,
+    случайность от seed, так что прогоны повторяемы.
+    """
+
+    def __init__(
+            self,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            latency: float = 0.0,
+            failure_rate: float = 0.0,
+            logout_rate: float = 0.0,
+            agreement_rate: float = 0.0,
+            results: int = 50,
+            page_size: int = 10,
+            seed: int = 0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.logout_rate = logout_rate
+        self.agreement_rate = agreement_rate
+        self.results = results
+        self.page_size = page_size
+
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def search_page(self, keyword: str, page: int) -> str:
+        start = (page - 1) * self.page_size
+        end = min(start + self.page_size, self.results)
+        cards = "\n".join(
+            CARD.format(
+                user_id=number + 1,
+                nickname=html.escape(f"{keyword}{number}"),
+                login=html.escape(f"{keyword}_{number}"),
+            )
+            for number in range(start, end)
+        )
+        href = "/search/users?" + urlencode({"keyword": keyword, "page": page + 1})
+        pager = PAGER.format(disabled="" if end < self.results else " disabled", href=html.escape(href))
+        return f'<div class="search-result"><ul class="hlist avatar-cards">\n{cards}\n</ul></div>\n{pager}'
+
+    def render(self, path: str, query: dict, token: Optional[str]) -> Tuple[int, str]:
+        if self.roll(self.failure_rate):
+            return 429, PAGE.format(title="Too Many Requests", body="<h1>Too many requests</h1>")
+        if not token or self.roll(self.logout_rate):
+            return 200, PAGE.format(title="Login", body=LOGGED_OUT)
+
+        modal = AGREEMENT_MODAL if self.roll(self.agreement_rate) else ""
+        if path == "/home":
+            return 200, PAGE.format(title="Home", body=f"{NAVIGATION}\n{modal}")
+        if path == "/search/users":
+            keyword = query.get("keyword", [""])[0]
+            page = int(query.get("page", ["1"])[0])
+            return 200, PAGE.format(title="Search", body=f"{NAVIGATION}\n{modal}\n{self.search_page(keyword, page)}")
+        return 404, PAGE.format(title="Not Found", body="<h1>Page not found</h1>")
+
+    def _handler(self):
+        fixture = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with fixture._lock:
+                    fixture.requests += 1
+                if fixture.latency:
+                    time.sleep(fixture.latency)
+
+                url = urlsplit(self.path)
+                cookies = SimpleCookie(self.headers.get("Cookie", ""))
+                token = cookies[ROBLOX_TOKEN_KEY].value if ROBLOX_TOKEN_KEY in cookies else None
+                status, body = fixture.render(url.path, parse_qs(url.query), token)
+
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return _Handler
+
+    def start(self) -> None:
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fixture-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Fixture server listening on {self.url}")
+
+    def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self) -> "FixtureServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
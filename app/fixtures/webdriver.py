@@ -0,0 +1,287 @@
+import re
+from html.parser import HTMLParser
+from types import SimpleNamespace
+from typing import Optional, List, Dict, Any, Union
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit, urljoin
+from urllib.request import Request, build_opener, ProxyHandler
+
+from selenium.common import NoSuchElementException, StaleElementReferenceException, WebDriverException
+from selenium.webdriver.common.by import By
+
+from app.services.scraper import SEARCH_RESULTS_SCRIPT
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"}
+
+_COMPOUND_RE = re.compile(r"^([a-zA-Z][\w-]*)?((?:[.#][\w-]+)*)$")
+
+
+class Node:
+    def __init__(self, tag: str, attrs: Dict[str, Optional[str]], parent: Optional["Node"]) -> None:
+        self.tag = tag
+        self.attrs = attrs
+        self.parent = parent
+        self.children: List[Union["Node", str]] = []
+
+    @property
+    def classes(self) -> List[str]:
+        return (self.attrs.get("class") or "").split()
+
+    @property
+    def text(self) -> str:
+        parts = []
+        for child in self.children:
+            parts.append(child if isinstance(child, str) else child.text)
+        return " ".join(" ".join(parts).split())
+
+    def iter(self):
+        for child in self.children:
+            if isinstance(child, Node):
+                yield child
+                yield from child.iter()
+
+
+class _TreeBuilder(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.root = Node("#document", {}, None)
+        self._current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        node = Node(tag, dict(attrs), self._current)
+        self._current.children.append(node)
+        if tag not in VOID_TAGS:
+            self._current = node
+
+    def handle_endtag(self, tag):
+        node = self._current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self._current = node.parent
+
+    def handle_data(self, data):
+        self._current.children.append(data)
+
+
+def parse_html(source: str) -> Node:
+    builder = _TreeBuilder()
+    builder.feed(source)
+    builder.close()
+    return builder.root
+
+
+def _parse_compound(compound: str) -> tuple:
+    match = _COMPOUND_RE.match(compound)
+    if match is None:
+        raise WebDriverException(f"Unsupported selector part: {compound}")
+    tag, rest = match.groups()
+    classes = re.findall(r"\.([\w-]+)", rest)
+    ids = re.findall(r"#([\w-]+)", rest)
+    return tag, classes, ids
+
+
+def _matches_compound(node: Node, compound: tuple) -> bool:
+    tag, classes, ids = compound
+    if tag and node.tag != tag:
+        return False
+    if any(name not in node.classes for name in classes):
+        return False
+    return all(node.attrs.get("id") == value for value in ids)
+
+
+def select(root: Node, selector: str) -> List[Node]:
+    """
+    Подмножество CSS: теги, .class, #id и потомки через пробел,
+    этого хватает селекторам из app.consts
+    """
+    compounds = [_parse_compound(part) for part in selector.split()]
+    result = []
+    for node in root.iter():
+        if not _matches_compound(node, compounds[-1]):
+            continue
+        remaining = compounds[:-1]
+        ancestor = node.parent
+        while remaining and ancestor is not None:
+            if _matches_compound(ancestor, remaining[-1]):
+                remaining = remaining[:-1]
+            ancestor = ancestor.parent
+        if not remaining:
+            result.append(node)
+    return result
+
+
+def to_css(by: str, value: str) -> str:
+    if by == By.CSS_SELECTOR:
+        return value
+    if by == By.ID:
+        return f"#{value}"
+    if by == By.CLASS_NAME:
+        return f".{value}"
+    if by == By.TAG_NAME:
+        return value
+    raise WebDriverException(f"FakeWebDriver doesn't support {by} locators")
+
+
+class FakeElement:
+    def __init__(self, driver: "FakeWebDriver", node: Node, generation: int) -> None:
+        self._driver = driver
+        self._node = node
+        self._generation = generation
+
+    def _check(self) -> Node:
+        if self._generation != self._driver.generation or not self._driver.is_attached(self._node):
+            raise StaleElementReferenceException("element is not attached to the page document")
+        return self._node
+
+    @property
+    def tag_name(self) -> str:
+        return self._check().tag
+
+    @property
+    def text(self) -> str:
+        return self._check().text
+
+    def get_attribute(self, name: str) -> Optional[str]:
+        return self._check().attrs.get(name)
+
+    def is_enabled(self) -> bool:
+        return "disabled" not in self._check().attrs
+
+    def is_displayed(self) -> bool:
+        return self._check() is not None
+
+    def click(self) -> None:
+        node = self._check()
+        if "disabled" in node.attrs:
+            return
+        if node.attrs.get("data-href"):
+            self._driver.get(urljoin(self._driver.current_url, node.attrs["data-href"]))
+        elif node.attrs.get("data-dismiss"):
+            self._driver.dismiss(node, node.attrs["data-dismiss"])
+
+    def find_element(self, by: str = By.ID, value: str = None) -> "FakeElement":
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"Unable to locate element: {value}")
+        return elements[0]
+
+    def find_elements(self, by: str = By.ID, value: str = None) -> List["FakeElement"]:
+        node = self._check()
+        return [FakeElement(self._driver, found, self._generation) for found in select(node, to_css(by, value))]
+
+
+class FakeWebDriver:
+    """
+    WebDriver без браузера для FixtureServer: любые адреса (https://www.roblox.com/...)
+    открываются на base_url с тем же путем, cookies отправляются заголовком.
+
+    Поддерживает то, чем пользуются хендлеры: get/refresh, cookies,
+    find_element(s) с простыми CSS селекторами, клики по кнопкам
+    страниц фикстур, execute_script скрипта скрапера и requests
+    как у selenium-wire, чтобы лимитер видел 429.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 10.0) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.proxy = None  # set by use_proxy, requests don't go through it
+
+        self.current_url = "about:blank"
+        self.page_source = ""
+        self.generation = 0
+
+        self._root = parse_html("")
+        self._cookies: Dict[str, Dict[str, Any]] = {}
+        self._requests: List[SimpleNamespace] = []
+        self._opener = build_opener(ProxyHandler({}))
+        self._closed = False
+
+    def _target(self, url: str) -> str:
+        parts = urlsplit(url)
+        return self.base_url + (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+    def get(self, url: str) -> None:
+        if self._closed:
+            raise WebDriverException("driver is closed")
+
+        request = Request(self._target(url))
+        if self._cookies:
+            request.add_header("Cookie", "; ".join(f"{c['name']}={c['value']}" for c in self._cookies.values()))
+        try:
+            with self._opener.open(request, timeout=self.timeout) as response:
+                status, source = response.status, response.read().decode()
+        except HTTPError as e:
+            status, source = e.code, e.read().decode()
+        except (URLError, OSError) as e:
+            raise WebDriverException(f"net::ERR_CONNECTION_FAILED {url}: {e!r}") from e
+
+        self._requests.append(SimpleNamespace(url=url, response=SimpleNamespace(status_code=status)))
+        self.current_url = url
+        self.page_source = source
+        self._root = parse_html(source)
+        self.generation += 1
+
+    def refresh(self) -> None:
+        self.get(self.current_url)
+
+    def is_attached(self, node: Node) -> bool:
+        while node.parent is not None:
+            node = node.parent
+        return node is self._root
+
+    def dismiss(self, node: Node, class_name: str) -> None:
+        # closes the nearest ancestor with the class, like a modal close button
+        while node is not None and class_name not in node.classes:
+            node = node.parent
+        if node is not None and node.parent is not None:
+            node.parent.children.remove(node)
+            node.parent = None
+
+    def find_element(self, by: str = By.ID, value: str = None) -> FakeElement:
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"Unable to locate element: {value}")
+        return elements[0]
+
+    def find_elements(self, by: str = By.ID, value: str = None) -> List[FakeElement]:
+        return [FakeElement(self, node, self.generation) for node in select(self._root, to_css(by, value))]
+
+    def execute_script(self, script: str, *args):
+        if script == SEARCH_RESULTS_SCRIPT:
+            logins, nicknames = select(self._root, args[0]), select(self._root, args[1])
+            return [
+                {"login": login.text, "nickname": nickname.text}
+                for login, nickname in zip(logins, nicknames)
+            ]
+        raise WebDriverException("FakeWebDriver runs only the search results script")
+
+    def add_cookie(self, cookie: Dict[str, Any]) -> None:
+        self._cookies[cookie["name"]] = dict(cookie)
+
+    def get_cookie(self, name: str) -> Optional[Dict[str, Any]]:
+        cookie = self._cookies.get(name)
+        return dict(cookie) if cookie else None
+
+    def get_cookies(self) -> List[Dict[str, Any]]:
+        return [dict(cookie) for cookie in self._cookies.values()]
+
+    def delete_cookie(self, name: str) -> None:
+        self._cookies.pop(name, None)
+
+    def delete_all_cookies(self) -> None:
+        self._cookies.clear()
+
+    @property
+    def requests(self) -> List[SimpleNamespace]:
+        return list(self._requests)
+
+    @requests.deleter
+    def requests(self) -> None:
+        self._requests.clear()
+
+    def save_screenshot(self, filename: str) -> bool:
+        return True
+
+    def quit(self) -> None:
+        self._closed = True
@@ -1,25 +1,37 @@
 import asyncio
-import json
-from typing import Optional
+from contextlib import nullcontext
+from typing import Optional, List, Iterator
 
-import pydantic
-from aiohttp import ClientSession
 from loguru import logger
-from selenium.common import NoSuchElementException
+from selenium.common import NoSuchElementException, TimeoutException, WebDriverException
 from selenium.webdriver import Chrome
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.support.expected_conditions import staleness_of
 from selenium.webdriver.support.wait import WebDriverWait
 
 from app.browser import is_authed
+from app.errors import ScrapeSchemaError, SessionExpired
+from app.listeners import DataHandler, ResultStream, report_first_result, guard_search  # noqa: F401, DataHandler is re-exported
+from app.log import hot_logger
 from app.settings import Settings
+from app.services.breaker import CircuitBreaker, guard
 from app.services.interfaces import IListener
-from app.services.driver import set_token, presence_of_any_text_in_element
+from app.services.driver import set_token, presence_of_any_text_in_element, count_throttled_responses
+from app.services.driver import convert_browser_cookies_to_aiohttp, use_proxy
+from app.services.http import HTTPClientPool
+from app.services.csrf import CSRFTokenManager
+from app.services.health import HealthState
+from app.services.idempotency import get_message_key
+from app.services.limiter import AdaptiveLimiter, Slot
+from app.services.proxies import ProxyPool, Proxy
+from app.services.sessions import SessionStore, SessionSnapshot
 from app.repos import TokenRepository
-from app.consts import ROBLOX_TOKEN_KEY, TOKEN_RECURSIVE_CHECK
-from app.services.exceptions import CancelException
+from app.consts import ROBLOX_TOKEN_KEY, TOKEN_RECURSIVE_CHECK, ROBLOX_SEARCH_NEXT_PAGE_SELECTOR
+from app.consts import ROBLOX_SEARCH_LOGIN_SELECTOR
+from app.services.scraper import scrape_search_results
 from app.services.queue.publisher import BasicMessageSender
-from app.schemas import ReturnSignal, StatusCodes, SendError, SearchResponse
+from app.schemas import ReturnSignal, StatusCodes, SearchResponse
 from app.schemas import SearchData
 
 
@@ -40,31 +52,91 @@ class UrlHandler(IListener):
 
     Очень грязный код
     """
+    failures = (WebDriverException, ScrapeSchemaError)
+
     def __init__(self) -> None:
         self.token_service: Optional[TokenRepository] = None
-
-    async def setup(self, token_service: TokenRepository):
+        self.session_store: Optional[SessionStore] = None
+        self.csrf: Optional[CSRFTokenManager] = None
+        self.http: Optional[HTTPClientPool] = None
+        self.proxies: Optional[ProxyPool] = None
+        self.health: Optional[HealthState] = None
+        self.search_breaker: Optional[CircuitBreaker] = None
+        self.auth_breaker: Optional[CircuitBreaker] = None
+        self.db_breaker: Optional[CircuitBreaker] = None
+        self._proxy_url: Optional[str] = None
+        self._token: Optional[str] = None
+        self._first_result_reported = False
+
+    async def setup(
+            self,
+            token_service: TokenRepository,
+            session_store: Optional[SessionStore] = None,
+            csrf: Optional[CSRFTokenManager] = None,
+            http: Optional[HTTPClientPool] = None,
+            proxies: Optional[ProxyPool] = None,
+            health: Optional[HealthState] = None,
+            search_breaker: Optional[CircuitBreaker] = None,
+            auth_breaker: Optional[CircuitBreaker] = None,
+            db_breaker: Optional[CircuitBreaker] = None,
+    ):
         self.token_service = token_service
+        self.session_store = session_store
+        self.csrf = csrf
+        self.http = http
+        self.proxies = proxies
+        self.health = health
+        self.search_breaker = search_breaker
+        self.auth_breaker = auth_breaker
+        self.db_breaker = db_breaker
 
     def close(self):
         pass
 
+    def current_token(self, driver: WebDriver) -> Optional[str]:
+        # cached, reading a cookie is a WebDriver round trip
+        if self._token is None:
+            cookie = driver.get_cookie(ROBLOX_TOKEN_KEY)
+            self._token = cookie["value"] if cookie else None
+        return self._token
+
     async def mark_as_spent(self, driver: WebDriver) -> None:
-        token = driver.get_cookie(ROBLOX_TOKEN_KEY)
-        await self.token_service.mark_as_inactive(str(token))
+        token = self.current_token(driver)
+        if token:
+            with guard(self.db_breaker):
+                await self.token_service.mark_as_inactive(token)
+            if self.csrf is not None:
+                self.csrf.invalidate(token)
+            if self.http is not None:
+                await self.http.forget(token)
+            if self.proxies is not None:
+                self.proxies.release(token)
 
     async def change_token(self, driver: WebDriver) -> None:
         # marks the current token as spent
         await self.mark_as_spent(driver)
         driver.delete_cookie(name=ROBLOX_TOKEN_KEY)
-        token = await self.token_service.fetch_token()
+        self._token = None
+        with guard(self.db_breaker):
+            token = await self.token_service.fetch_token()
         logger.info("Changing tokens")
         if not token:
             logger.info("OUT OF TOKENS")
+            if self.health is not None:
+                self.health.report("tokens", False, "out of tokens")
             return
+        self._token = token
+        self.route(driver)
         set_token(driver, token)
         driver.refresh()
 
+        cookies = driver.get_cookies()
+        if self.http is not None:
+            self.http.set_active(token, convert_browser_cookies_to_aiohttp(cookies))
+        if self.session_store is not None:
+            # old snapshot holds a spent token, restart has to pick up the new one
+            self.session_store.save(SessionSnapshot(token=token, cookies=cookies))
+
     async def change_token_recursive(self, driver: Chrome, depth: int = TOKEN_RECURSIVE_CHECK):
         if depth == 0:
             raise RuntimeError("TOKENS CORRUPTED, WAITING FOR ACTIONS")
@@ -73,9 +145,149 @@ class UrlHandler(IListener):
             await self.change_token(driver)
         await self.change_token_recursive(driver, depth - 1)
 
+    def route(self, driver: WebDriver) -> Optional[Proxy]:
+        """
+        Переключает браузер на прокси текущего токена,
+        пара меняется если прокси выключили из-за ошибок
+        """
+        token = self.current_token(driver)
+        if self.proxies is None or not token:
+            return None
+
+        proxy = self.proxies.for_token(token)
+        url = proxy.url if proxy else None
+        if url != self._proxy_url:
+            use_proxy(driver, url)
+            self._proxy_url = url
+        return proxy
+
+    def report_first_result(self, started_at: Optional[float]) -> None:
+        if self._first_result_reported or started_at is None:
+            return
+        self._first_result_reported = True
+
+        report_first_result(started_at)
+
     def form_url(self, name: str):
         return f"https://www.roblox.com/search/users?keyword={name}"
 
+    def wait_for_results(self, driver: Chrome, slot: Optional[Slot] = None) -> None:
+        """
+        Ждет результаты поиска, и если передан slot лимитера,
+        сообщает ему о 429 и выбросе на страницу логина.
+        Состояние браузера заодно отмечается для /readyz
+
+        :raises SessionExpired: when roblox shows the login page, if anyone needs to know
+        """
+        throttled = 0
+        try:
+            WebDriverWait(driver, 5).until(
+                presence_of_any_text_in_element((By.CSS_SELECTOR, ROBLOX_SEARCH_LOGIN_SELECTOR))
+            )
+        except TimeoutException as e:
+            throttled = count_throttled_responses(driver)
+            # the 429 page has no navigation either, it is not a logout
+            check_session = slot is not None or self.health is not None or self.auth_breaker is not None
+            logged_out = check_session and not throttled and not is_authed(driver)
+            if logged_out and slot is not None:
+                slot.mark_overloaded("login_page")
+            if logged_out and self.health is not None:
+                self.health.report("browser", False, "logged out")
+            if logged_out:
+                raise SessionExpired("Search shows the login page") from e
+            raise
+        else:
+            throttled = count_throttled_responses(driver)
+            if self.health is not None:
+                self.health.report("browser", True)
+        finally:
+            if slot is not None and throttled:
+                slot.mark_overloaded("http_429")
+
+    def admit(self, driver: Chrome, limiter: Optional[AdaptiveLimiter]):
+        if limiter is None:
+            return nullcontext()
+        return limiter.admit(self.current_token(driver))
+
+    def scrape_page(self, driver: Chrome) -> List[SearchResponse]:
+        return scrape_search_results(driver)
+
+    def next_page(self, driver: Chrome, limiter: Optional[AdaptiveLimiter]) -> bool:
+        """
+        Переходит на следующую страницу результатов, False если её нет
+        """
+        try:
+            button = driver.find_element(By.CSS_SELECTOR, ROBLOX_SEARCH_NEXT_PAGE_SELECTOR)
+        except NoSuchElementException:
+            return False
+        if not button.is_enabled():
+            return False
+
+        first_card = driver.find_element(By.CSS_SELECTOR, ROBLOX_SEARCH_LOGIN_SELECTOR)
+        with self.admit(driver, limiter) as slot:
+            button.click()
+            WebDriverWait(driver, 5).until(staleness_of(first_card))
+            self.wait_for_results(driver, slot)
+        return True
+
+    def iter_pages(
+            self,
+            driver: Chrome,
+            search_data: SearchData,
+            limiter: Optional[AdaptiveLimiter] = None,
+    ) -> Iterator[List[SearchResponse]]:
+        """
+        Отдает результаты постранично, пока не наберется search_data.limit
+        (0 - только первая страница) или не кончатся страницы
+        """
+        url = self.form_url(search_data.name)
+
+        proxy = self.route(driver)
+        with self.admit(driver, limiter) as slot:
+            try:
+                driver.get(url)
+            except WebDriverException:
+                if self.proxies is not None:
+                    self.proxies.report(proxy, ok=False)
+                raise
+            self.wait_for_results(driver, slot)
+        if self.proxies is not None:
+            self.proxies.report(proxy, ok=True)
+
+        collected = 0
+        while True:
+            page = self.scrape_page(driver)
+            if search_data.limit:
+                page = page[:search_data.limit - collected]
+            collected += len(page)
+            yield page
+
+            if not search_data.limit or collected >= search_data.limit:
+                return
+            if not self.next_page(driver, limiter):
+                return
+
+    def stream_results(
+            self,
+            driver: Chrome,
+            search_data: SearchData,
+            publisher: BasicMessageSender,
+            limiter: Optional[AdaptiveLimiter] = None,
+            job_id: Optional[str] = None,
+    ) -> None:
+        """
+        Отправляет результаты кусками по мере их появления,
+        последним идет сообщение с final=True
+        """
+        stream = ResultStream(publisher, job_id, search_data.chunk_size)
+        try:
+            for page in self.iter_pages(driver, search_data, limiter):
+                stream.send(page)
+        except Exception as e:
+            stream.fail(e)
+            raise
+        stream.finish()
+
     async def __call__(
             self,
             driver: Chrome,
@@ -83,30 +295,33 @@ class UrlHandler(IListener):
             settings: Settings,
             publisher: BasicMessageSender,
             data: dict,
-            session: ClientSession
+            limiter: Optional[AdaptiveLimiter] = None,
+            started_at: Optional[float] = None,
+            properties=None,
     ) -> None:
-        url = self.form_url(search_data.name)
-        driver.get(url)
-
-        WebDriverWait(driver, 5).until(
-            presence_of_any_text_in_element((By.CSS_SELECTOR, ".text-overflow.avatar-card-label.ng-binding"))
-        )
+        with guard_search(publisher, self.search_breaker, self.auth_breaker, self.failures):
+            await self.search(driver, search_data, settings, publisher, limiter, started_at, get_message_key(properties))
 
-        logins = driver.find_elements(by=By.CSS_SELECTOR, value=".text-overflow.avatar-card-label.ng-binding")
-        nicknames = driver.find_elements(by=By.CSS_SELECTOR, value=".avatar-name")
+    async def search(
+            self,
+            driver: Chrome,
+            search_data: SearchData,
+            settings: Settings,
+            publisher: BasicMessageSender,
+            limiter: Optional[AdaptiveLimiter] = None,
+            started_at: Optional[float] = None,
+            job_id: Optional[str] = None,
+    ) -> None:
+        if search_data.stream:
+            self.stream_results(driver, search_data, publisher, limiter, job_id)
+            self.report_first_result(started_at)
+            return
 
         response = []
-        logger.info(logins + nicknames)
-
-        for login, nickname in zip(logins, nicknames):
-            response.append(
-                SearchResponse(
-                    login=login.text,
-                    nickname=nickname.text,
-                )
-            )
+        for page in self.iter_pages(driver, search_data, limiter):
+            response.extend(page)
 
-        logger.info(f"collected response up: {response}")
+        hot_logger.info(f"Collected {len(response)} results")
 
         if settings.debug:
             driver.save_screenshot("screenshot.png")
@@ -128,33 +343,6 @@ class UrlHandler(IListener):
         )
 
         publisher.send_message(result.dict())
+        self.report_first_result(started_at)
 
         logger.info("Sending result to consumer")
-
-
-class DataHandler(IListener):
-    def setup(self, *args, **kwargs):
-        pass
-
-    def close(self, *args, **kwargs):
-        pass
-
-    def __call__(self, data: dict, body: bytes, publisher: BasicMessageSender):
-        try:
-            _temp = json.loads(body)
-            pur_data = SearchData(**_temp)
-        except json.JSONDecodeError:
-            logger.error("NOT HELLO")
-
-            raise CancelException
-        except pydantic.ValidationError as e:
-            logger.info(f"Invalid data: {body}")
-
-            errors = [SendError(name="validation error", info=str(e.errors()))]
-
-            data = ReturnSignal(status_code=StatusCodes.invalid_data, errors=errors)
-
-            publisher.send_message(data.dict())
-            raise CancelException
-
-        data.update(search_data=pur_data)
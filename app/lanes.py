@@ -0,0 +1,89 @@
+"""
+Очереди (lanes) помимо основной очереди поиска, см. LaneRouter.
+Фабрика вызывается в потоке воркера и собирает ему собственные
+соединения к БД и брокеру, листенеры у каждого воркера свои.
+"""
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+from app.listeners import TokenCheckHandler, GamePassHandler
+from app.providers import get_connection, get_publisher, get_idempotency_store, get_http_pool, get_game_pass_resolver
+from app.providers import get_retry_topology
+from app.repos import TokenRepository
+from app.services.breaker import CircuitBreaker
+from app.services.gamepass import GamePassResolver
+from app.services.interfaces import IListener
+from app.services.queue.consumers import URLConsumer, ReconnectingURLConsumer, JOB_TIMING
+from app.services.queue.router import LaneRouter, lane_queue, parse_lanes
+from app.settings import Settings
+
+# lane name -> new listener chain for one worker
+LANES: Dict[str, Callable[[], List[IListener]]] = {
+    "auth": lambda: [TokenCheckHandler()],
+    # no purchase stage yet, the checker answers on its own
+    "gamepass": lambda: [GamePassHandler(reply=True)],
+}
+
+
+async def build_worker(
+        settings: Settings,
+        lane: str,
+        db_breaker: Optional[CircuitBreaker] = None,
+        game_pass_resolver: Optional[GamePassResolver] = None,
+):
+    connection = await get_connection(settings)
+    token_service = TokenRepository(connection, settings.db_tokens_table)
+    idempotency_store = await get_idempotency_store(settings, connection)
+    publisher = get_publisher(settings)
+    # anonymous, lane workers don't hold a token
+    http = get_http_pool(settings)
+
+    workflow_data = {
+        "settings": settings,
+        "connection": connection,
+        "token_service": token_service,
+        "publisher": publisher,
+        "http": http,
+        # one per process, shared by workers so they share its cache and requests in flight
+        "game_pass_resolver": game_pass_resolver or get_game_pass_resolver(settings),
+        "lane": lane,
+        # shared with the main queue, it's the same database
+        "db_breaker": db_breaker,
+    }
+    queue = lane_queue(settings.queue_name, lane)
+    consumer = URLConsumer(
+        amqp_url=settings.queue_dsn,
+        queue=queue,
+        exchange=settings.exchange_name,
+        routing=queue,
+        workflow_data=workflow_data,
+        idempotency_store=idempotency_store,
+        # own retry queues and DLQ, failed lane messages aren't dropped
+        retry_topology=get_retry_topology(settings, queue),
+        # kept apart from the main queue timing the capacity reporter reads
+        job_timing=f"{JOB_TIMING}.{lane}",
+    )
+    for listener in LANES[lane]():
+        consumer.add_listener(listener)
+
+    async def cleanup():
+        publisher.flush()
+        publisher.close()
+        await http.close()
+        await connection.close()
+
+    supervisor = ReconnectingURLConsumer(
+        consumer=consumer,
+        base_delay=settings.reconnect_base_delay,
+        max_delay=settings.reconnect_max_delay,
+        max_tries=settings.reconnect_max_tries,
+    )
+    return supervisor, cleanup
+
+
+def add_lanes(router: LaneRouter, settings: Settings, db_breaker: Optional[CircuitBreaker] = None) -> None:
+    game_pass_resolver = get_game_pass_resolver(settings)
+    for lane, workers in parse_lanes(settings.lanes).items():
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane: {lane}, available: {', '.join(LANES)}")
+        router.add_lane(lane, partial(build_worker, settings, lane, db_breaker, game_pass_resolver), workers)
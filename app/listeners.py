@@ -0,0 +1,393 @@
+"""
+Листенеры без браузера, модуль не импортирует selenium,
+поэтому http режим поиска стартует без него
+"""
+import asyncio
+import json
+import time
+from contextlib import contextmanager
+from typing import Optional, List, AsyncIterator, Tuple, Type
+
+import aiohttp
+import pydantic
+from loguru import logger
+
+from app.consts import ROBLOX_USER_SEARCH_URL, ROBLOX_USER_SEARCH_PAGE_SIZES, ROBLOX_TOKEN_KEY
+from app.errors import InvalidGamePass, InvalidGamePassPrice, SessionExpired
+from app.log import hot_logger, shorten
+from app.services.breaker import CircuitBreaker, CircuitOpenError, guard
+from app.services.exceptions import CancelException
+from app.services.gamepass import GamePassResolver
+from app.services.health import HealthState
+from app.services.helpers import chunked
+from app.services.http import HTTPClientPool
+from app.services.idempotency import get_message_key
+from app.services.interfaces import IListener
+from app.services.limiter import AdaptiveLimiter, unlimited
+from app.services.metrics import metrics
+from app.services.queue.publisher import BasicMessageSender
+from app.services.sessions import probe_session
+from app.services.validators import parse_game_pass_urls
+from app.repos import TokenRepository
+from app.schemas import ReturnSignal, StatusCodes, SendError, SearchResponse
+from app.schemas import SearchData, GamePassData
+
+
+def report_first_result(started_at: Optional[float]) -> None:
+    elapsed = time.monotonic() - started_at
+    metrics.set("startup.time_to_first_result", elapsed)
+    logger.info(f"First result sent {elapsed:.2f}s after start")
+
+
+class ResultStream:
+    """
+    Отправляет результаты кусками: в каждом job_id сообщения и seq,
+    последний с final=True, а если поиск упал - final=True со статусом fail,
+    что бы клиент не ждал конца потока который начнется заново при повторе
+    """
+
+    def __init__(self, publisher: BasicMessageSender, job_id: Optional[str], chunk_size: int) -> None:
+        self.publisher = publisher
+        self.job_id = job_id
+        self.chunk_size = chunk_size
+        self.seq = 0
+        self.total = 0
+
+    def send(self, page: List[SearchResponse]) -> None:
+        for chunk in chunked(page, self.chunk_size):
+            self.publisher.send_message(
+                ReturnSignal(
+                    status_code=StatusCodes.success, data=chunk, job_id=self.job_id, seq=self.seq, final=False,
+                ).dict()
+            )
+            self.seq += 1
+            self.total += len(chunk)
+
+    def finish(self) -> None:
+        self.publisher.send_message(
+            ReturnSignal(
+                status_code=StatusCodes.success, job_id=self.job_id, seq=self.seq, final=True,
+                info=f"{self.total} results",
+            ).dict()
+        )
+        logger.info(f"Streamed {self.total} results in {self.seq} chunks")
+
+    def fail(self, e: Exception) -> None:
+        self.publisher.send_message(
+            ReturnSignal(
+                status_code=StatusCodes.fail, job_id=self.job_id, seq=self.seq, final=True,
+                errors=[e], info=f"stream failed after {self.total} results",
+            ).dict()
+        )
+        logger.warning(f"Stream {self.job_id} failed after {self.seq} chunks: {e!r}")
+
+
+def reply_circuit_open(publisher: BasicMessageSender, e: CircuitOpenError) -> None:
+    """
+    Быстрый отказ вместо ожидания таймаутов, без токенов - no_tokens_available
+    """
+    status_code = StatusCodes.no_tokens_available if e.name == "auth" else StatusCodes.fail
+    hot_logger.info(f"Rejected with {status_code.value}: {e}")
+    publisher.send_message(ReturnSignal(status_code=status_code, info=str(e)).dict())
+    raise CancelException
+
+
+@contextmanager
+def guard_search(
+        publisher: BasicMessageSender,
+        search_breaker: Optional[CircuitBreaker],
+        auth_breaker: Optional[CircuitBreaker],
+        failures: Tuple[Type[BaseException], ...],
+):
+    """
+    Поиск под размыкателями: выброс на логин считается ошибкой авторизации,
+    failures - ошибками поиска. Разомкнутая цепь сразу отвечает отказом
+    """
+    try:
+        with guard(auth_breaker, (SessionExpired,)), guard(search_breaker, failures):
+            yield
+    except CircuitOpenError as e:
+        reply_circuit_open(publisher, e)
+
+
+class DataHandler(IListener):
+    def setup(self, *args, **kwargs):
+        pass
+
+    def close(self, *args, **kwargs):
+        pass
+
+    def __call__(self, data: dict, body: bytes, publisher: BasicMessageSender):
+        try:
+            _temp = json.loads(body)
+            pur_data = SearchData(**_temp)
+        except json.JSONDecodeError:
+            logger.error("NOT HELLO")
+
+            raise CancelException
+        except pydantic.ValidationError as e:
+            logger.info(f"Invalid data: {shorten(body)}")
+
+            errors = [SendError(name="validation error", info=str(e.errors()))]
+
+            data = ReturnSignal(status_code=StatusCodes.invalid_data, errors=errors)
+
+            publisher.send_message(data.dict())
+            raise CancelException
+
+        data.update(search_data=pur_data)
+
+
+class HttpSearchHandler(IListener):
+    """
+    Поиск через users.roblox.com вместо страницы поиска в браузере.
+    Ответы те же что у UrlHandler, login с @ как на карточке.
+    """
+
+    failures = (aiohttp.ClientError, asyncio.TimeoutError)
+
+    def __init__(self) -> None:
+        self.health: Optional[HealthState] = None
+        self.search_breaker: Optional[CircuitBreaker] = None
+        self.auth_breaker: Optional[CircuitBreaker] = None
+        self._first_result_reported = False
+
+    def setup(
+            self,
+            health: Optional[HealthState] = None,
+            search_breaker: Optional[CircuitBreaker] = None,
+            auth_breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.health = health
+        self.search_breaker = search_breaker
+        self.auth_breaker = auth_breaker
+
+    def close(self, *args, **kwargs):
+        pass
+
+    def page_size(self, search_data: SearchData) -> int:
+        wanted = search_data.limit or ROBLOX_USER_SEARCH_PAGE_SIZES[0]
+        for size in ROBLOX_USER_SEARCH_PAGE_SIZES:
+            if size >= wanted:
+                return size
+        return ROBLOX_USER_SEARCH_PAGE_SIZES[-1]
+
+    def admit(self, http: HTTPClientPool, limiter: Optional[AdaptiveLimiter]):
+        if limiter is None:
+            return unlimited()
+        return limiter.admit_async(http.active_token)
+
+    async def fetch_page(
+            self,
+            http: HTTPClientPool,
+            search_data: SearchData,
+            cursor: Optional[str],
+            limiter: Optional[AdaptiveLimiter] = None,
+    ) -> Tuple[List[SearchResponse], Optional[str]]:
+        params = {"keyword": search_data.name, "limit": self.page_size(search_data)}
+        if cursor:
+            params["cursor"] = cursor
+
+        async with self.admit(http, limiter) as slot:
+            response = await http.request("GET", ROBLOX_USER_SEARCH_URL, params=params)
+            async with response:
+                if response.status == 429 and slot is not None:
+                    slot.mark_overloaded("http_429")
+                if self.health is not None and response.status in (200, 401):
+                    self.health.report("session", response.status == 200, f"search answered {response.status}")
+                if response.status == 401:
+                    raise SessionExpired("Search answered 401, token is logged out")
+                response.raise_for_status()
+                payload = await response.json()
+
+        page = [
+            SearchResponse(login=f"@{user['name']}", nickname=user["displayName"])
+            for user in payload.get("data") or []
+        ]
+        return page, payload.get("nextPageCursor")
+
+    async def iter_pages(
+            self,
+            http: HTTPClientPool,
+            search_data: SearchData,
+            limiter: Optional[AdaptiveLimiter] = None,
+    ) -> AsyncIterator[List[SearchResponse]]:
+        """
+        Отдает результаты постранично, пока не наберется search_data.limit
+        (0 - только первая страница) или не кончатся страницы
+        """
+        cursor = None
+        collected = 0
+        while True:
+            page, cursor = await self.fetch_page(http, search_data, cursor, limiter)
+            if search_data.limit:
+                page = page[:search_data.limit - collected]
+            collected += len(page)
+            yield page
+
+            if not search_data.limit or collected >= search_data.limit or not cursor:
+                return
+
+    async def stream_results(
+            self,
+            http: HTTPClientPool,
+            search_data: SearchData,
+            publisher: BasicMessageSender,
+            limiter: Optional[AdaptiveLimiter] = None,
+            job_id: Optional[str] = None,
+    ) -> None:
+        stream = ResultStream(publisher, job_id, search_data.chunk_size)
+        try:
+            async for page in self.iter_pages(http, search_data, limiter):
+                stream.send(page)
+        except Exception as e:
+            stream.fail(e)
+            raise
+        stream.finish()
+
+    async def __call__(
+            self,
+            http: HTTPClientPool,
+            search_data: SearchData,
+            publisher: BasicMessageSender,
+            limiter: Optional[AdaptiveLimiter] = None,
+            started_at: Optional[float] = None,
+            properties=None,
+    ) -> None:
+        with guard_search(publisher, self.search_breaker, self.auth_breaker, self.failures):
+            if search_data.stream:
+                await self.stream_results(http, search_data, publisher, limiter, get_message_key(properties))
+            else:
+                response = []
+                async for page in self.iter_pages(http, search_data, limiter):
+                    response.extend(page)
+
+                hot_logger.info(f"Collected {len(response)} results")
+                publisher.send_message(ReturnSignal(status_code=StatusCodes.success, data=response).dict())
+
+        if not self._first_result_reported and started_at is not None:
+            self._first_result_reported = True
+            report_first_result(started_at)
+
+
+class TokenCheckHandler(IListener):
+    """
+    Листенер auth очереди: {"token": "..."} проверяется одним запросом,
+    не прошедший проверку токен выключается
+    """
+
+    def setup(self, *args, **kwargs):
+        pass
+
+    def close(self, *args, **kwargs):
+        pass
+
+    async def __call__(
+            self,
+            body: bytes,
+            publisher: BasicMessageSender,
+            token_service: TokenRepository,
+            db_breaker: Optional[CircuitBreaker] = None,
+    ):
+        try:
+            token = json.loads(body)["token"]
+            if not isinstance(token, str) or not token:
+                raise ValueError("token must be a non empty string")
+        except (ValueError, KeyError, TypeError) as e:
+            logger.info(f"Invalid token check: {shorten(body)}")
+            errors = [SendError(name="validation error", info=str(e))]
+            publisher.send_message(ReturnSignal(status_code=StatusCodes.invalid_data, errors=errors).dict())
+            raise CancelException
+
+        try:
+            if db_breaker is not None:
+                # the answer would be lost anyway, so the probe isn't made
+                db_breaker.check()
+            valid = await probe_session([{"name": ROBLOX_TOKEN_KEY, "value": token}])
+            if not valid:
+                with guard(db_breaker):
+                    await token_service.mark_as_inactive(token)
+        except CircuitOpenError as e:
+            reply_circuit_open(publisher, e)
+
+        publisher.send_message(ReturnSignal(
+            status_code=StatusCodes.success if valid else StatusCodes.fail,
+            info="token is valid" if valid else "token is invalid and has been disabled",
+        ).dict())
+
+
+class GamePassHandler(IListener):
+    """
+    Проверка запросов на покупку геймпассов до любой работы браузера.
+    Тело {"url": ..., "price": ...} или список таких объектов, все ссылки
+    разбираются разом, цены запрашиваются параллельно через кэш.
+    Битая ссылка или несуществующий геймпасс - 400, цена не совпадает
+    или геймпасс не продается - 403. Проверенные геймпассы кладутся
+    в data["game_passes"] для следующих листенеров.
+
+    reply=True отвечает успехом сам, пока за ним нет листенера покупки.
+    """
+
+    def __init__(self, reply: bool = False) -> None:
+        self.reply = reply
+
+    def setup(self, *args, **kwargs):
+        pass
+
+    def close(self, *args, **kwargs):
+        pass
+
+    @staticmethod
+    def reject(publisher: BasicMessageSender, status_code: StatusCodes, errors: List[Exception]):
+        logger.info(f"Game pass request rejected with {status_code.value}: {errors}")
+        publisher.send_message(ReturnSignal(status_code=status_code, errors=errors).dict())
+        raise CancelException
+
+    async def __call__(
+            self,
+            data: dict,
+            body: bytes,
+            publisher: BasicMessageSender,
+            http: HTTPClientPool,
+            game_pass_resolver: GamePassResolver,
+    ):
+        try:
+            payload = json.loads(body)
+            items = [GamePassData.parse_obj(item) for item in (payload if isinstance(payload, list) else [payload])]
+        except (json.JSONDecodeError, pydantic.ValidationError) as e:
+            logger.info(f"Invalid data: {shorten(body)}")
+            publisher.send_message(ReturnSignal(
+                status_code=StatusCodes.invalid_data,
+                errors=[SendError(name="validation error", info=str(e))],
+            ).dict())
+            raise CancelException
+
+        refs, invalid = parse_game_pass_urls(item.url for item in items)
+        if invalid:
+            self.reject(publisher, StatusCodes.invalid_data, [
+                InvalidGamePass(f"Not a game pass link: {shorten(url, 100)}") for url in invalid
+            ])
+
+        resolved = await game_pass_resolver.resolve_many(http, refs)
+        missing = [ref.id for ref in refs if resolved[ref.id] is None]
+        if missing:
+            self.reject(publisher, StatusCodes.invalid_data, [
+                InvalidGamePass(f"Game pass {game_pass_id} doesn't exist") for game_pass_id in missing
+            ])
+
+        errors = []
+        for item, ref in zip(items, refs):
+            game_pass = resolved[ref.id]
+            if not game_pass.is_for_sale:
+                errors.append(InvalidGamePassPrice(f"Game pass {game_pass.id} is not for sale"))
+            elif game_pass.price != item.price:
+                errors.append(InvalidGamePassPrice(f"Game pass {game_pass.id} costs {game_pass.price}, not {item.price}"))
+        if errors:
+            self.reject(publisher, StatusCodes.invalid_price, errors)
+
+        data.update(game_passes=[resolved[ref.id] for ref in refs])
+        if self.reply:
+            publisher.send_message(ReturnSignal(
+                status_code=StatusCodes.success,
+                info=f"{len(refs)} game passes checked",
+            ).dict())
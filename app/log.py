@@ -1,10 +1,40 @@
-from typing import cast, List
+from typing import cast, List, Optional, TextIO, Any
 from types import FrameType
+import itertools
+import json
+import os
+import queue
 import sys
 import logging
+import threading
+import time
+import traceback
 
 from loguru import logger
 
+from app.consts import DEFAULT_LOG_SAMPLE_EVERY, DEFAULT_LOG_VALUE_LIMIT, DEFAULT_LOG_QUEUE_SIZE
+from app.services.metrics import metrics
+
+# third party loggers which flood debug/info records, production profile drops them
+# at the stdlib level, before a LogRecord is even created
+NOISY_LOGGERS = ("seleniumwire", "selenium", "urllib3", "hpack", "pika", "asyncio", "WDM", "aiohttp.access")
+
+# messages on the per-message path, sampled in production profile
+hot_logger = logger.bind(hot=True)
+
+
+def shorten(value: Any, limit: int = DEFAULT_LOG_VALUE_LIMIT) -> str:
+    """
+    repr() of value capped to limit chars, bytes and str are cut before repr
+    so a large message body is never copied as a whole
+    """
+    if isinstance(value, (bytes, str)) and len(value) > limit:
+        return f"{value[:limit]!r}... ({len(value)} total)"
+    text = repr(value)
+    if len(text) > limit:
+        return f"{text[:limit]}... ({len(text)} total)"
+    return text
+
 
 class InterceptHandler(logging.Handler):
     def emit(self, record: logging.LogRecord) -> None:  # pragma: no cover
@@ -26,15 +56,167 @@ class InterceptHandler(logging.Handler):
         )
 
 
-def configure_logging(loggers: List[str], logging_level: int = logging.INFO) -> None:
+class HotPathFilter:
+    """
+    Пропускает одну из sample_every записей с hot=True, остальные записи без изменений.
+
+    Решение принимается один раз на запись в patch (patcher loguru) и хранится
+    в record["extra"], фильтр у всех sink-ов один и только читает его,
+    так что stderr и json файл оставляют одни и те же записи.
+    """
+
+    def __init__(self, sample_every: int) -> None:
+        self.sample_every = max(sample_every, 1)
+        self._counter = itertools.count()
+
+    def patch(self, record) -> None:
+        if record["extra"].get("hot"):
+            record["extra"]["sampled"] = not next(self._counter) % self.sample_every
+
+    def __call__(self, record) -> bool:
+        return record["extra"].get("sampled", True)
+
+
+class BackgroundSink:
+    """
+    Sink для loguru: вызывающий поток только кладет record в очередь,
+    форматирование, json и запись в файл делает отдельный поток.
+    Если очередь переполнена, запись выбрасывается, а не блокирует обработку сообщения.
+
+    path - шаблон файла с {time}, новый файл начинается после rotation байт,
+    без path пишет в stream. Текст записи обрезается до max_length.
+    """
+
+    def __init__(
+            self,
+            stream: Optional[TextIO] = None,
+            path: Optional[str] = None,
+            serialize: bool = False,
+            max_length: int = DEFAULT_LOG_VALUE_LIMIT,
+            rotation: int = 20 * 1024 * 1024,
+            max_queue: int = DEFAULT_LOG_QUEUE_SIZE,
+    ) -> None:
+        self.path = path
+        self.serialize = serialize
+        self.max_length = max_length
+        self.rotation = rotation
+        self.dropped = 0
+
+        self._stream = stream
+        self._written = 0
+        self._queue: "queue.Queue" = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, message) -> None:
+        try:
+            self._queue.put_nowait(message.record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc("log.dropped")
+
+    def _open(self) -> TextIO:
+        if self._stream is None or (self.path and self._written >= self.rotation):
+            if self._stream is not None:
+                self._stream.close()
+            path = self.path.format(time=time.strftime("%Y-%m-%d_%H-%M-%S"))
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._stream = open(path, "a", encoding="utf8")
+            self._written = 0
+        return self._stream
+
+    def format(self, record) -> str:
+        message = record["message"]
+        if len(message) > self.max_length:
+            message = f"{message[:self.max_length]}... ({len(message)} total)"
+
+        exception = ""
+        if record["exception"] is not None:
+            exception = "".join(traceback.format_exception(*record["exception"]))
+
+        if self.serialize:
+            return json.dumps({
+                "time": record["time"].isoformat(),
+                "level": record["level"].name,
+                "name": record["name"],
+                "function": record["function"],
+                "line": record["line"],
+                "message": message,
+                "extra": {k: str(v) for k, v in record["extra"].items()},
+                "exception": exception or None,
+            }) + "\n"
+
+        line = (
+            f"{record['time']:%Y-%m-%d %H:%M:%S.%f} | {record['level'].name:<8} | "
+            f"{record['name']}:{record['function']}:{record['line']} - {message}\n"
+        )
+        return line + exception
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            try:
+                stream = self._open()
+                text = self.format(record)
+                stream.write(text)
+                self._written += len(text)
+                if self._queue.empty():
+                    stream.flush()
+            except Exception as e:  # pragma: no cover
+                # logging must never take the process down
+                print(f"Log writer failed: {e!r}", file=sys.stderr)
+
+        if self._stream is not None:
+            self._stream.flush()
+
+    def stop(self) -> None:
+        # called by loguru on logger.remove()
+        self._queue.put(None)
+        self._thread.join()
+        if self.path and self._stream is not None:
+            self._stream.close()
+
+
+def configure_logging(
+        loggers: List[str],
+        logging_level: int = logging.INFO,
+        profile: str = "dev",
+        sample_every: int = DEFAULT_LOG_SAMPLE_EVERY,
+        value_limit: int = DEFAULT_LOG_VALUE_LIMIT,
+        log_dir: str = "logs",
+) -> None:
     logging.getLogger().handlers = [InterceptHandler()]
     for logger_name in loggers:
         logging_logger = logging.getLogger(logger_name)
         logging_logger.handlers = [InterceptHandler(level=logging_level)]
 
+    if profile == "dev":
+        logger.configure(
+            handlers=[
+                dict(sink=sys.stderr, level=logging_level),
+                dict(sink=f"{log_dir}/log_{{time}}.log", enqueue=True, serialize=True, rotation="20 MB"),
+            ],
+        )
+        return
+
+    if profile != "production":
+        raise ValueError(f"Unknown logging profile: {profile}")
+
+    for logger_name in NOISY_LOGGERS:
+        logging.getLogger(logger_name).setLevel(logging.WARNING)
+
+    # loguru only renders "{message}" here, the real formatting is done by the writer thread
+    sampler = HotPathFilter(sample_every)
+    common = dict(level=logging_level, format="{message}", backtrace=False, diagnose=False, filter=sampler)
     logger.configure(
         handlers=[
-            dict(sink=sys.stderr, level=logging_level),
-            dict(sink="logs/log_{time}.log", enqueue=True, serialize=True, rotation="20 MB"),
+            dict(sink=BackgroundSink(stream=sys.stderr, max_length=value_limit), **common),
+            dict(
+                sink=BackgroundSink(path=f"{log_dir}/log_{{time}}.log", serialize=True, max_length=value_limit),
+                **common,
+            ),
         ],
+        patcher=sampler.patch,
     )
@@ -1,45 +1,210 @@
-from aiohttp import ClientSession
+import asyncio
+import signal
+import time
+from contextlib import contextmanager
+from typing import Optional
+
 from dotenv import load_dotenv
 from loguru import logger
 
-from app.browser import auth_browser
-from app.providers import get_token_service, get_publisher
-from app.services.db import get_db_conn
-from app.services.driver import get_driver, convert_browser_cookies_to_aiohttp
+from app.lanes import add_lanes
+from app.listeners import DataHandler, HttpSearchHandler
+from app.providers import get_token_service, get_publisher, get_connection, get_idempotency_store
+from app.providers import get_retry_topology, get_limiter, get_session_store, get_http_pool, get_proxy_pool
+from app.providers import get_status_server, get_capacity_reporter, get_circuit_breaker
+from app.services.breaker import CircuitBreaker, breakers_check, guard
+from app.services.driver import convert_browser_cookies_to_aiohttp, close_drivers
+from app.services.csrf import CSRFTokenManager
+from app.services.health import HealthState, channel_probe, consumer_probe
+from app.services.metrics import metrics
+from app.services.profiler import profiler, SamplingProfiler
 from app.services.queue.consumers import URLConsumer
+from app.services.status import check_route
+from app.services.proxies import ProxyPool
+from app.services.sessions import SessionSnapshot, SessionStore, save_csrf_token, restore_session, auth_session
 from app.log import configure_logging
-from app.settings import get_settings
-from app import handlers
+from app.settings import get_settings, Settings
+from app.repos import TokenRepository
 from app.services.queue.consumers import ReconnectingURLConsumer
+from app.services.queue.router import LaneRouter
 
 import nest_asyncio
 
 nest_asyncio.apply()
 
 
-async def main():
+def install_drain_handler(consumer: LaneRouter, timeout: float) -> None:
+    """
+    SIGTERM/SIGINT переводят консьюмер в режим drain: новые сообщения
+    не принимаются, текущие дорабатываются за timeout секунд.
+    Повторный сигнал сразу возвращает недоделанные сообщения в очередь.
+    """
+    loop = asyncio.get_event_loop()
+
+    def _on_signal(signame: str):
+        logger.info(f"Received {signame}, draining")
+        consumer.drain(timeout)
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, _on_signal, sig.name)
+        except NotImplementedError:
+            # windows event loop does not support signal handlers
+            logger.warning(f"Can't install {sig.name} handler, drain on signal is disabled")
+
+
+def install_profiler_handler(sampling_profiler: SamplingProfiler) -> None:
+    """
+    SIGUSR1 включает профайлер, повторный SIGUSR1 выключает и пишет результат
+    """
+    sig = getattr(signal, "SIGUSR1", None)
+    if sig is None:
+        logger.warning("SIGUSR1 is not available, profiler can be toggled by control messages only")
+        return
+
+    try:
+        asyncio.get_event_loop().add_signal_handler(sig, sampling_profiler.toggle)
+    except NotImplementedError:
+        logger.warning("Can't install SIGUSR1 handler, profiler can be toggled by control messages only")
+
+
+@contextmanager
+def startup_phase(name: str):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        metrics.set(f"startup.{name}_seconds", time.monotonic() - start)
+
+
+def log_startup_phases() -> None:
+    gauges = metrics.snapshot()["gauges"]
+    phases = ", ".join(
+        f"{name[len('startup.'):-len('_seconds')]} {value:.2f}s"
+        for name, value in gauges.items()
+        if name.startswith("startup.") and name.endswith("_seconds")
+    )
+    logger.info(f"Startup phases: {phases}")
+
+
+async def start_browser(
+        settings: Settings,
+        token_service: TokenRepository,
+        session_store: Optional[SessionStore],
+        proxies: Optional[ProxyPool],
+        db_breaker: Optional[CircuitBreaker] = None,
+):
+    """
+    Браузер с авторизованной сессией, selenium импортируется только здесь
+    """
+    with startup_phase("browser_import"):
+        from app.browser import auth_browser, restore_browser
+        from app.services.driver import get_driver
+
+    with startup_phase("driver"):
+        first_proxy = proxies.pick() if proxies is not None else None
+        driver = get_driver(settings, first_proxy.url if first_proxy else None)
+
+    with startup_phase("auth"):
+        snapshot = None
+        if session_store is not None:
+            snapshot = await restore_browser(driver, token_service, session_store, proxies, db_breaker)
+        if snapshot is None:
+            token = await auth_browser(driver, token_service, proxies=proxies, db_breaker=db_breaker)
+            snapshot = SessionSnapshot(token=token, cookies=driver.get_cookies())
+            if session_store is not None:
+                session_store.save(snapshot)
+        else:
+            metrics.inc("startup.session_restored")
+
+    return driver, snapshot
+
+
+async def start_http(
+        token_service: TokenRepository,
+        session_store: Optional[SessionStore],
+        proxies: Optional[ProxyPool],
+        db_breaker: Optional[CircuitBreaker] = None,
+) -> SessionSnapshot:
+    with startup_phase("auth"):
+        snapshot = None
+        if session_store is not None:
+            snapshot = await restore_session(token_service, session_store, proxies, db_breaker)
+        if snapshot is None:
+            snapshot = await auth_session(token_service, proxies=proxies, db_breaker=db_breaker)
+            if session_store is not None:
+                session_store.save(snapshot)
+        else:
+            with guard(db_breaker):
+                await token_service.mark_as_used(snapshot.token)
+            metrics.inc("startup.session_restored")
+
+    return snapshot
+
+
+async def main(started_at: Optional[float] = None):
+    started_at = started_at or time.monotonic()
     load_dotenv()
 
     settings = get_settings()
+    if settings.search_backend not in ("browser", "http"):
+        raise ValueError(f"Unknown search backend: {settings.search_backend}")
 
-    configure_logging(settings.loggers)
-    connection = await get_db_conn(settings.db_dsn)
-    token_service = await get_token_service(settings, connection)
+    configure_logging(
+        settings.loggers,
+        profile=settings.log_profile,
+        sample_every=settings.log_sample_every,
+        value_limit=settings.log_value_limit,
+    )
+    with startup_phase("db"):
+        connection = await get_connection(settings)
+        token_service = await get_token_service(settings, connection)
+        idempotency_store = await get_idempotency_store(settings, connection)
     publisher = get_publisher(settings)
-    driver = get_driver(settings)
+    retry_topology = get_retry_topology(settings)
+    proxies = get_proxy_pool(settings)
+    session_store = get_session_store(settings)
+
+    health = HealthState(settings.health_liveness_timeout)
+    search_breaker = get_circuit_breaker(settings, "search")
+    auth_breaker = get_circuit_breaker(settings, "auth")
+    db_breaker = get_circuit_breaker(settings, "db")
+    driver = None
+    if settings.search_backend == "browser":
+        limiter = get_limiter(settings, proxies)
+        driver, snapshot = await start_browser(settings, token_service, session_store, proxies, db_breaker)
+        health.report("browser", True, "logged in")
+    else:
+        # proxy budget is taken by the HTTP pool itself, limiter must not reserve it twice
+        limiter = get_limiter(settings)
+        snapshot = await start_http(token_service, session_store, proxies, db_breaker)
+        health.report("session", True, "token probe passed")
 
-    await auth_browser(driver, token_service)
+    csrf = CSRFTokenManager()
+    if snapshot.csrf_token:
+        csrf.set(snapshot.token, snapshot.csrf_token)
 
-    cookies = convert_browser_cookies_to_aiohttp(driver.get_cookies())
-    session = ClientSession(cookies=cookies)
+    http = get_http_pool(settings, csrf, proxies)
+    if proxies is not None and settings.proxy_check_interval:
+        asyncio.ensure_future(proxies.run_checks(settings.proxy_check_interval))
+    http.set_active(snapshot.token, convert_browser_cookies_to_aiohttp(snapshot.cookies))
 
     workflow_data = {
         "settings": settings,
         "connection": connection,
         "driver": driver,
         "token_service": token_service,
-        "session": session,
+        "http": http,
+        "proxies": proxies,
+        "csrf": csrf,
         "publisher": publisher,
+        "limiter": limiter,
+        "session_store": session_store,
+        "started_at": started_at,
+        "health": health,
+        "search_breaker": search_breaker,
+        "auth_breaker": auth_breaker,
+        "db_breaker": db_breaker,
     }
     # ссанина
     kw = {
@@ -49,20 +214,63 @@ async def main():
         "routing": settings.queue_name,
         "workflow_data": workflow_data
     }
-    root_consumer = URLConsumer(**kw)
+    root_consumer = URLConsumer(idempotency_store=idempotency_store, retry_topology=retry_topology, **kw)
     consumer = ReconnectingURLConsumer(
         consumer=root_consumer,
-        **kw,
+        base_delay=settings.reconnect_base_delay,
+        max_delay=settings.reconnect_max_delay,
+        max_tries=settings.reconnect_max_tries,
     )
 
-    root_consumer.add_listener(handlers.DataHandler())
-    root_consumer.add_listener(handlers.UrlHandler())
+    root_consumer.add_listener(DataHandler())
+    if driver is not None:
+        from app import handlers
+
+        root_consumer.add_listener(handlers.UrlHandler())
+    else:
+        root_consumer.add_listener(HttpSearchHandler())
+
+    router = LaneRouter(consumer, settings.drain_timeout)
+    add_lanes(router, settings, db_breaker)
+
+    install_drain_handler(router, settings.drain_timeout)
+
+    capacity = get_capacity_reporter(settings, root_consumer)
+    if capacity is not None:
+        capacity.start()
+    status_server = get_status_server(settings)
+    if status_server is not None:
+        health.add_probe("amqp_consumer", consumer_probe(root_consumer))
+        health.add_probe("amqp_publisher", channel_probe(publisher))
+        asyncio.ensure_future(health.run_checks(token_service, settings.health_interval))
+        status_server.add_route("/healthz", check_route(health.liveness))
+        status_server.add_route("/readyz", check_route(health.readiness))
+        status_server.add_route("/breakers", check_route(breakers_check(search_breaker, auth_breaker, db_breaker)))
+        status_server.start()
+
+    profiler.output_dir = settings.profile_dir
+    profiler.interval = settings.profile_interval
+    install_profiler_handler(profiler)
 
-    logger.info("Starting application")
+    metrics.set("startup.ready_seconds", time.monotonic() - started_at)
+    log_startup_phases()
+    logger.info(f"Starting application, search backend: {settings.search_backend}")
 
     try:
-        consumer.run()
-    except:
-        driver.close()
+        router.run()
+    finally:
+        logger.info("Shutting down")
+        if status_server is not None:
+            status_server.stop()
+        if capacity is not None:
+            capacity.stop()
+        profiler.stop()
+        publisher.flush()
+        publisher.close()
+        if driver is not None:
+            close_drivers([driver])
+        if session_store is not None:
+            save_csrf_token(session_store, csrf)
         await connection.close()
-        await session.close()
+        logger.info(f"HTTP pool stats: {http.stats()}")
+        await http.close()
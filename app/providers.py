@@ -1,30 +1,225 @@
+from typing import Optional
+
 from loguru import logger
 
 from app.settings import Settings
 from app.repos import TokenRepository
+from app.services.capacity import CapacityReporter
+from app.services.csrf import CSRFTokenManager
+from app.services.breaker import CircuitBreaker
+from app.services.db import get_db_conn
+from app.services.gamepass import GamePassResolver
+from app.services.http import HTTPClientPool
+from app.services.idempotency import IdempotencyStore, MemoryIdempotencyStore, DBIdempotencyStore
 from app.services.interfaces import BasicDBConnector
-from app.services.queue.publisher import BasicMessageSender
+from app.services.limiter import AdaptiveLimiter, AIMDLimiter
+from app.services.proxies import ProxyPool, parse_proxies
+from app.services.queue.publisher import BasicMessageSender, BatchingMessageSender, QueueInspector
+from app.services.queue.retry import RetryTopology, parse_delays
+from app.services.sessions import SessionStore
+from app.services.status import StatusServer
+
+
+async def get_connection(settings: Settings) -> BasicDBConnector:
+	return await get_db_conn(
+		settings.db_dsn,
+		settings.db_type,
+		min_size=settings.db_pool_min_size,
+		max_size=settings.db_pool_max_size,
+		statement_cache_size=settings.db_statement_cache_size,
+		command_timeout=settings.db_command_timeout,
+		slow_query_ms=settings.db_slow_query_ms,
+		commit_batch=settings.db_commit_batch,
+	)
 
 
 async def get_token_service(settings: Settings, connection: BasicDBConnector) -> TokenRepository:
 	token_service = TokenRepository(connection, settings.db_tokens_table)
 
-	await token_service.create_tokens_table()
+	await token_service.migrate()
 
 	return token_service
 
 
-def get_publisher(settings: Settings):
-	logger.info("Setting up basicMessageSender")
+async def get_idempotency_store(settings: Settings, connection: BasicDBConnector) -> Optional[IdempotencyStore]:
+	if not settings.idempotency_store:
+		return None
+
+	if settings.idempotency_store == "memory":
+		store = MemoryIdempotencyStore(settings.idempotency_ttl, settings.idempotency_max_size)
+	elif settings.idempotency_store == "db":
+		store = DBIdempotencyStore(connection, settings.idempotency_table, settings.idempotency_ttl)
+	else:
+		raise ValueError(f"Unknown idempotency store: {settings.idempotency_store}")
+
+	await store.setup()
+	logger.info(f"Using {settings.idempotency_store} idempotency store")
+
+	return store
+
+
+def get_proxy_pool(settings: Settings) -> Optional[ProxyPool]:
+	proxies = parse_proxies(settings.proxies)
+	if not proxies:
+		return None
+
+	logger.info(f"Using {len(proxies)} proxies")
+
+	return ProxyPool(
+		proxies,
+		rate=settings.proxy_rate,
+		max_failures=settings.proxy_max_failures,
+		eject_time=settings.proxy_eject_time,
+		check_url=settings.proxy_check_url,
+	)
 
-	publisher = BasicMessageSender(
+
+def get_limiter(settings: Settings, proxies: Optional[ProxyPool] = None) -> Optional[AdaptiveLimiter]:
+	if not settings.limiter_enabled:
+		return None
+
+	concurrency = AIMDLimiter(
+		initial=settings.limiter_initial,
+		min_limit=settings.limiter_min,
+		max_limit=settings.limiter_max,
+		latency_target=settings.limiter_latency_target,
+	)
+
+	return AdaptiveLimiter(
+		concurrency,
+		global_rate=settings.global_rate,
+		token_rate=settings.token_rate,
+		admission_timeout=settings.admission_timeout,
+		proxies=proxies,
+	)
+
+
+def get_session_store(settings: Settings) -> Optional[SessionStore]:
+	if not settings.session_dir:
+		return None
+
+	if not settings.session_key:
+		raise ValueError("session_key is required to store session snapshots, see python -m app.cli session-key")
+
+	logger.info(f"Using session snapshots in {settings.session_dir}")
+
+	return SessionStore(settings.session_dir, settings.session_key, settings.session_ttl)
+
+
+def get_http_pool(
+		settings: Settings,
+		csrf: Optional[CSRFTokenManager] = None,
+		proxies: Optional[ProxyPool] = None,
+) -> HTTPClientPool:
+	return HTTPClientPool(
+		limit=settings.http_limit,
+		limit_per_host=settings.http_limit_per_host,
+		dns_ttl=settings.http_dns_ttl,
+		keepalive_timeout=settings.http_keepalive_timeout,
+		timeout=settings.http_timeout,
+		proxies=proxies,
+		csrf=csrf,
+	)
+
+
+def get_retry_topology(settings: Settings, queue: Optional[str] = None) -> Optional[RetryTopology]:
+	"""
+	Retry and DLQ queues of queue, the main search queue by default
+	"""
+	delays = parse_delays(settings.retry_delays)
+	if not delays:
+		return None
+
+	queue = queue or settings.queue_name
+	topology = RetryTopology(
 		settings.queue_dsn,
-		queue=settings.send_queue_name,
-		exchange=settings.send_queue_exchange_name,
-		routing=settings.send_queue_name,
+		queue=queue,
+		exchange=settings.exchange_name,
+		routing=queue,
+		delays=delays,
 	)
 
+	# declaration only, failed messages are republished through the consumer channel
+	topology.connect()
+	topology.close()
+
+	return topology
+
+
+def get_publisher(settings: Settings):
+	logger.info("Setting up basicMessageSender")
+
+	if settings.reply_batch_window > 0:
+		publisher = BatchingMessageSender(
+			settings.queue_dsn,
+			queue=settings.send_queue_name,
+			exchange=settings.send_queue_exchange_name,
+			routing=settings.send_queue_name,
+			batch_window=settings.reply_batch_window,
+			batch_size=settings.reply_batch_size,
+			confirms=settings.reply_confirms,
+			max_tries=settings.reply_publish_tries,
+		)
+	else:
+		publisher = BasicMessageSender(
+			settings.queue_dsn,
+			queue=settings.send_queue_name,
+			exchange=settings.send_queue_exchange_name,
+			routing=settings.send_queue_name,
+		)
+
 	publisher.connect()
 	logger.info("Connection to publisher has been established")
 
 	return publisher
+
+
+def get_status_server(settings: Settings) -> Optional[StatusServer]:
+	if not settings.status_port:
+		return None
+
+	return StatusServer(settings.status_host, settings.status_port)
+
+
+def get_capacity_reporter(settings: Settings, consumer) -> Optional[CapacityReporter]:
+	if not settings.capacity_interval:
+		return None
+	# nobody reads the samples, don't open one more broker connection for them
+	if not settings.status_port and not settings.capacity_status_path:
+		return None
+
+	inspector = QueueInspector(
+		settings.queue_dsn,
+		queue=settings.queue_name,
+		exchange=settings.exchange_name,
+		routing=settings.queue_name,
+	)
+
+	return CapacityReporter(
+		inspector,
+		consumer,
+		interval=settings.capacity_interval,
+		window=settings.capacity_window,
+		target_drain_time=settings.capacity_target_drain,
+		min_replicas=settings.capacity_min_replicas,
+		max_replicas=settings.capacity_max_replicas,
+		status_path=settings.capacity_status_path,
+	)
+
+
+def get_game_pass_resolver(settings: Settings) -> GamePassResolver:
+	return GamePassResolver(
+		ttl=settings.game_pass_cache_ttl,
+		max_size=settings.game_pass_cache_size,
+		concurrency=settings.game_pass_concurrency,
+	)
+
+
+def get_circuit_breaker(settings: Settings, name: str) -> Optional[CircuitBreaker]:
+	if not settings.breaker_failure_threshold:
+		return None
+	return CircuitBreaker(
+		name,
+		failure_threshold=settings.breaker_failure_threshold,
+		reset_timeout=settings.breaker_reset_timeout,
+	)
@@ -1,6 +1,7 @@
-from typing import Sequence, Union, Optional
+from typing import Sequence, Union, Optional, Iterable, Dict, List
 
 from app.services.interfaces import BasicDBConnector
+from app.services.migrations import Migration, Migrator
 
 
 class TokenRepository:
@@ -8,14 +9,40 @@ class TokenRepository:
         self.conn = conn
 
         self._model_name = model_name
+        self._migrator = Migrator(conn, scope=model_name)
+
+        if conn.dialect == "sqlite":
+            cooldown_expr = "datetime('now', '+' || $2 || ' seconds')"
+        else:
+            cooldown_expr = "CURRENT_TIMESTAMP + make_interval(secs => $2)"
+
+        # текст запросов не меняется, поэтому драйвер переиспользует
+        # подготовленные (prepared) запросы вместо парсинга на каждый вызов
+        self._fetch_active_sql = (
+            f"SELECT token FROM {model_name} WHERE is_active = true "
+            f"AND (cooldown_until IS NULL OR cooldown_until <= CURRENT_TIMESTAMP) LIMIT $1"
+        )
+        self._mark_inactive_sql = f"UPDATE {model_name} SET is_active = false WHERE token = $1"
+        self._mark_used_sql = (
+            f"UPDATE {model_name} SET last_used = CURRENT_TIMESTAMP, failure_count = 0 WHERE token = $1"
+        )
+        self._register_failure_sql = (
+            f"UPDATE {model_name} SET failure_count = failure_count + 1, "
+            f"cooldown_until = {cooldown_expr} WHERE token = $1"
+        )
+        self._is_active_sql = f"SELECT token FROM {model_name} WHERE token = $1 AND is_active = true"
+        self._import_sql = f"INSERT INTO {model_name} (token) VALUES ($1) ON CONFLICT (token) DO NOTHING"
+        # asyncpg executemany doesn't report row counts, one statement per chunk returns inserted rows
+        self._import_returning_sql = (
+            f"INSERT INTO {model_name} (token) SELECT unnest($1::text[]) "
+            f"ON CONFLICT (token) DO NOTHING RETURNING id"
+        )
+        self._stats_sql = f"SELECT is_active, count(*) AS amount FROM {model_name} GROUP BY is_active"
 
     async def fetch_active_tokens(self, limit: int = 10) -> Union[Sequence[str], str]:
         conn = self.conn
-        model_name = self._model_name
-
-        sql = f"SELECT token FROM {model_name} WHERE is_active = true LIMIT {limit}"
 
-        results: Sequence[dict] = await conn.fetchmany(sql)
+        results: Sequence[dict] = await conn.fetchmany(self._fetch_active_sql, limit)
         tokens = []
         for record in results:
             tokens.append(record.get("token"))
@@ -23,24 +50,157 @@ class TokenRepository:
 
     async def fetch_token(self) -> Optional[str]:
         """
-        Выбирает рандомный свободный токен
+        Выбирает рандомный свободный токен, токены на cooldown пропускаются
 
         :return:
         """
-        tokens = await self.fetch_active_tokens()
+        tokens = await self.fetch_active_tokens(limit=1)
         if not tokens:
             return ""
         return tokens[0]
 
+    async def is_active(self, token: str) -> bool:
+        conn = self.conn
+
+        return await conn.fetch(self._is_active_sql, token) is not None
+
     async def mark_as_inactive(self, token: str) -> None:
         conn = self.conn
+
+        await conn.execute(self._mark_inactive_sql, token)
+
+    async def mark_as_used(self, token: str) -> None:
+        conn = self.conn
+
+        await conn.execute(self._mark_used_sql, token)
+
+    async def register_failure(self, token: str, cooldown: float) -> None:
+        """
+        Увеличивает счетчик ошибок токена и убирает его из выдачи на cooldown секунд
+
+        :param token:
+        :param cooldown:
+        :return:
+        """
+        conn = self.conn
+
+        await conn.execute(self._register_failure_sql, token, float(cooldown))
+
+    async def add_tokens(self, tokens: Iterable[str]) -> None:
+        """
+        Массовая загрузка токенов, через COPY если коннектор это умеет
+
+        :param tokens:
+        :return:
+        """
+        conn = self.conn
+
+        await conn.copy_records(self._model_name, ((token,) for token in tokens), columns=("token",))
+
+    async def import_tokens(self, tokens: Iterable[str]) -> int:
+        """
+        Загружает пачку токенов, пропуская уже существующие.
+        Требует уникальный индекс по token, см. migrate
+
+        :param tokens:
+        :return: amount of inserted tokens
+        """
+        conn = self.conn
+
+        if conn.dialect == "sqlite":
+            return await conn.executemany(self._import_sql, ((token,) for token in tokens)) or 0
+        records = await conn.fetchmany(self._import_returning_sql, list(tokens))
+        return len(records)
+
+    async def count_tokens(self) -> Dict[str, int]:
+        conn = self.conn
+
+        stats = {"active": 0, "inactive": 0}
+        for record in await conn.fetchmany(self._stats_sql):
+            key = "active" if record.get("is_active") else "inactive"
+            stats[key] += record.get("amount")
+        stats["total"] = stats["active"] + stats["inactive"]
+        return stats
+
+    async def explain_hot_queries(self) -> Dict[str, List[str]]:
+        """
+        Планы запросов, которые выполняются на каждое сообщение
+
+        :return: query name -> plan lines
+        """
+        conn = self.conn
+
+        if conn.dialect == "sqlite":
+            prefix, column = "EXPLAIN QUERY PLAN", "detail"
+        else:
+            prefix, column = "EXPLAIN", "QUERY PLAN"
+
+        queries = {
+            "fetch_active_tokens": (self._fetch_active_sql, 1),
+            "mark_as_inactive": (self._mark_inactive_sql, ""),
+            "mark_as_used": (self._mark_used_sql, ""),
+        }
+        plans = {}
+        for name, (sql, *args) in queries.items():
+            records = await conn.fetchmany(f"{prefix} {sql}", *args)
+            plans[name] = [record.get(column) for record in records]
+        return plans
+
+    def migrations(self) -> List[Migration]:
         model_name = self._model_name
 
-        await conn.execute(f"UPDATE {model_name} SET is_active = false WHERE token = $1", token)
+        if self.conn.dialect == "sqlite":
+            timestamp = "TIMESTAMP"
+            add_column = "ADD COLUMN"
+        else:
+            timestamp = "TIMESTAMPTZ"
+            add_column = "ADD COLUMN IF NOT EXISTS"
+
+        return [
+            Migration(1, "create tokens table", [self._create_table_sql()]),
+            Migration(2, "unique token index", [
+                # the index can't be built while duplicates exist, keeps an active row of each token
+                f"DELETE FROM {model_name} WHERE EXISTS (SELECT 1 FROM {model_name} AS kept "
+                f"WHERE kept.token = {model_name}.token AND kept.id <> {model_name}.id "
+                f"AND (COALESCE(kept.is_active, false) > COALESCE({model_name}.is_active, false) "
+                f"OR (COALESCE(kept.is_active, false) = COALESCE({model_name}.is_active, false) "
+                f"AND kept.id < {model_name}.id)))",
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {model_name}_token_uidx ON {model_name} (token)",
+            ]),
+            Migration(3, "partial index on active tokens", [
+                f"CREATE INDEX IF NOT EXISTS {model_name}_active_idx ON {model_name} (id) WHERE is_active = true",
+            ]),
+            Migration(4, "token usage statistics", [
+                f"ALTER TABLE {model_name} {add_column} last_used {timestamp}",
+                f"ALTER TABLE {model_name} {add_column} failure_count INTEGER NOT NULL DEFAULT 0",
+                f"ALTER TABLE {model_name} {add_column} cooldown_until {timestamp}",
+            ]),
+        ]
+
+    async def migrate(self) -> List[int]:
+        """
+        Создает или обновляет таблицу токенов до последней версии схемы
+
+        :return: versions applied now
+        """
+        return await self._migrator.migrate(self.migrations())
+
+    async def drop_tokens_table(self) -> None:
+        conn = self.conn
+
+        await conn.execute(f"DROP TABLE IF EXISTS {self._model_name}")
+        await self._migrator.reset()
+
+    def _create_table_sql(self) -> str:
+        if self.conn.dialect == "sqlite":
+            id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+        else:
+            id_column = "id SERIAL PRIMARY KEY"
+
+        return (f"CREATE TABLE IF NOT EXISTS {self._model_name} ("
+                f"{id_column}, token TEXT, is_active BOOLEAN DEFAULT true);")
 
     async def create_tokens_table(self) -> None:
         conn = self.conn
-        model_name = self._model_name
 
-        await conn.execute(f"CREATE TABLE IF NOT EXISTS {model_name} ("
-                           f"id SERIAL PRIMARY KEY, token TEXT, is_active BOOLEAN DEFAULT true);")
+        await conn.execute(self._create_table_sql())
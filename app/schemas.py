@@ -1,12 +1,25 @@
 from enum import IntEnum
 from typing import List, Optional
 
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, validator, conint
+
+from app.consts import DEFAULT_STREAM_CHUNK_SIZE, MAX_SEARCH_LIMIT
 
 
 class SearchData(BaseModel):
     # anemic model
     name: str
+    # how many results to collect across pages, 0 is the first page only
+    limit: conint(ge=0, le=MAX_SEARCH_LIMIT) = 0
+    # send results in chunks as soon as they are scraped
+    stream: bool = False
+    chunk_size: conint(ge=1) = DEFAULT_STREAM_CHUNK_SIZE
+
+
+class GamePassData(BaseModel):
+    url: str
+    # robux the buyer expects to pay, has to match the current price
+    price: conint(ge=0)
 
 
 class StatusCodes(IntEnum):
@@ -33,11 +46,20 @@ class ReturnSignal(BaseModel):
     status_code: StatusCodes
     info: Optional[str] = ""
     data: list[SearchResponse] = []
+    # set for streamed replies: id of the request message, chunk number
+    # and whether it's the last one
+    job_id: Optional[str] = None
+    seq: Optional[int] = None
+    final: bool = True
 
-    @validator("errors")
+    @validator("errors", pre=True)
     def validate_error(cls, value: List[Exception]):
         result = []
-        for v in value:
+        for v in value or []:
+            if not isinstance(v, Exception):
+                # already a SendError or its dict
+                result.append(v)
+                continue
             result.append(SendError(
                 name=v.__class__.__name__,
                 info=v.__str__()
@@ -0,0 +1,144 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Optional, Tuple, Type, Dict, Any
+
+from loguru import logger
+
+from app.services.metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# exported as breaker.{name}.state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"{name} circuit is open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Размыкатель для бэкенда (поиск, авторизация, БД).
+
+    После failure_threshold ошибок подряд размыкается, и все вызовы
+    сразу получают CircuitOpenError вместо ожидания таймаутов.
+    Через reset_timeout секунд пропускает один пробный вызов (half open):
+    успех замыкает, ошибка размыкает снова. Остальные вызовы пока идет
+    проба тоже отклоняются. Исключения не из failures на счетчик не влияют.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        metrics.set(f"breaker.{name}.state", STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def _set_state(self, state: str) -> None:
+        if state == self._state:
+            return
+        log = logger.info if state == CLOSED else logger.warning
+        log(f"Circuit {self.name}: {self._state} -> {state}")
+        self._state = state
+        metrics.set(f"breaker.{self.name}.state", STATE_VALUES[state])
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._state == CLOSED:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def check(self) -> None:
+        """
+        Отклоняет сразу если цепь разомкнута, пробу не занимает
+        """
+        if self.state == OPEN:
+            metrics.inc(f"breaker.{self.name}.rejected")
+            raise CircuitOpenError(self.name, self.retry_after())
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._set_state(HALF_OPEN)
+            self._probing = True
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(CLOSED)
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    metrics.inc(f"breaker.{self.name}.opened")
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def release(self) -> None:
+        # call ended without telling anything about the backend, next message probes again
+        with self._lock:
+            self._probing = False
+
+    @contextmanager
+    def guard(self, failures: Tuple[Type[BaseException], ...] = (Exception,)):
+        if not self.allow():
+            metrics.inc(f"breaker.{self.name}.rejected")
+            raise CircuitOpenError(self.name, self.retry_after())
+        try:
+            yield
+        except failures:
+            self.failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        else:
+            self.success()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures, "retry_after": round(self.retry_after(), 1)}
+
+
+def guard(breaker: Optional[CircuitBreaker], failures: Tuple[Type[BaseException], ...] = (Exception,)):
+    if breaker is None:
+        return nullcontext()
+    return breaker.guard(failures)
+
+
+def breakers_check(*breakers: Optional[CircuitBreaker]):
+    """
+    Проверка для check_route, не ок пока какая то цепь не замкнута
+    """
+    breakers = [breaker for breaker in breakers if breaker is not None]
+
+    def _check() -> Tuple[bool, Dict[str, Any]]:
+        stats = {breaker.name: breaker.stats() for breaker in breakers}
+        return all(item["state"] == CLOSED for item in stats.values()), stats
+
+    return _check
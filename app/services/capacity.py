@@ -0,0 +1,162 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional, Deque, Tuple
+
+from loguru import logger
+
+from app.services.metrics import metrics
+from app.services.queue.consumers import JOB_TIMING
+from app.services.queue.publisher import QueueInspector
+
+# JOB_TIMING is recorded by process_message for the main queue only,
+# count - finished jobs, sum - busy seconds
+
+
+class CapacityReporter:
+    """
+    Сигнал для автоскейлинга: раз в interval секунд снимает длину очереди,
+    загрузку воркеров и скорость обработки за последние window секунд,
+    считает за сколько разберется очередь и сколько реплик нужно,
+    что бы очередь разбиралась за target_drain_time секунд.
+
+    Результат в метриках capacity.* и в json файле status_path.
+    Работает в своем потоке со своим соединением к брокеру.
+    """
+
+    def __init__(
+            self,
+            inspector: QueueInspector,
+            consumer,
+            interval: float,
+            window: float,
+            target_drain_time: float,
+            min_replicas: int,
+            max_replicas: int,
+            workers: int = 1,
+            status_path: str = "",
+    ) -> None:
+        self.inspector = inspector
+        # ExampleConsumer, in-flight and prefetch are read from it
+        self.consumer = consumer
+        self.interval = interval
+        self.window = window
+        self.target_drain_time = target_drain_time
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+        self.workers = workers
+        self.status_path = status_path
+
+        self.status: Dict[str, Any] = {}
+
+        # (monotonic time, finished jobs, busy seconds, queue depth)
+        self._samples: Deque[Tuple[float, float, float, Optional[int]]] = deque()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _clamp(self, replicas: int) -> int:
+        return max(self.min_replicas, min(self.max_replicas, replicas))
+
+    def sample(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        timing = metrics.snapshot()["timings"].get(JOB_TIMING, {})
+        queue = self.inspector.queue_depth()
+        depth, consumers = queue if queue is not None else (None, None)
+
+        self._samples.append((now, timing.get("count", 0), timing.get("sum", 0.0), depth))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+            self._samples.popleft()
+
+        first_time, first_jobs, first_busy, _ = self._samples[0]
+        elapsed = now - first_time
+        jobs = timing.get("count", 0) - first_jobs
+        busy = timing.get("sum", 0.0) - first_busy
+
+        service_rate = jobs / elapsed if elapsed else 0.0
+        utilization = min(busy / (elapsed * self.workers), 1.0) if elapsed else 0.0
+        job_seconds = busy / jobs if jobs else None
+        # jobs per second of a single replica kept busy all the time
+        replica_capacity = self.workers / job_seconds if job_seconds else None
+
+        status = {
+            "time": time.time(),
+            "queue": self.inspector.queue,
+            "queue_depth": depth,
+            "queue_consumers": consumers,
+            "inflight": self.consumer.inflight_count,
+            "prefetch": self.consumer.prefetch_count,
+            "workers": self.workers,
+            "utilization": round(utilization, 3),
+            "service_rate": round(service_rate, 3),
+            "job_seconds": round(job_seconds, 3) if job_seconds else None,
+            "arrival_rate": None,
+            "drain_eta_seconds": None,
+            "recommended_replicas": self._clamp(consumers or 1),
+        }
+
+        # oldest sample where the broker answered
+        first_depth = next(((t, d) for t, _, _, d in self._samples if d is not None), None)
+        if depth is not None and first_depth is not None and now > first_depth[0]:
+            # broker doesn't count arrivals, they are what the whole fleet processed plus queue growth
+            depth_rate = (depth - first_depth[1]) / (now - first_depth[0])
+            arrival_rate = max(service_rate * max(consumers, 1) + depth_rate, 0.0)
+            status["arrival_rate"] = round(arrival_rate, 3)
+
+            if depth == 0:
+                status["drain_eta_seconds"] = 0.0
+            elif depth_rate < 0:
+                status["drain_eta_seconds"] = round(depth / -depth_rate, 1)
+
+            if replica_capacity:
+                needed = (arrival_rate + depth / self.target_drain_time) / replica_capacity
+                status["recommended_replicas"] = self._clamp(math.ceil(needed))
+
+        for name, value in status.items():
+            if isinstance(value, (int, float)) and name != "time":
+                metrics.set(f"capacity.{name}", value)
+
+        self.status = status
+        if self.status_path:
+            self._write(status)
+        return status
+
+    def _write(self, status: Dict[str, Any]) -> None:
+        directory = os.path.dirname(self.status_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # orchestrator must never read a half written file
+        tmp = f"{self.status_path}.tmp"
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(status, f)
+        os.replace(tmp, self.status_path)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.exception(f"Capacity sample failed: {e!r}")
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="capacity", daemon=True)
+        self._thread.start()
+        logger.info(f"Capacity reporter started, queue {self.inspector.queue}, every {self.interval}s")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        # may be stuck reconnecting to the broker, it's a daemon thread anyway
+        self._thread.join(timeout=5)
+        alive = self._thread.is_alive()
+        self._thread = None
+        if not alive and getattr(self.inspector, "connection", None) is not None:
+            self.inspector.close()
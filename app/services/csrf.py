@@ -0,0 +1,111 @@
+import asyncio
+from typing import Dict, Optional
+
+from aiohttp import ClientSession, ClientResponse
+from loguru import logger
+
+from app.consts import ROBLOX_CSRF_HEADER, ROBLOX_CSRF_REFRESH_URL
+from app.services.metrics import metrics
+
+# roblox checks the token only on state changing requests
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+class CSRFTokenManager:
+    """
+    Кэш X-CSRF-TOKEN для каждой .ROBLOSECURITY сессии.
+
+    Токен берется из заголовка x-csrf-token ответов и подставляется
+    во все небезопасные запросы этой сессии. Roblox отвечает 403 с новым токеном
+    в заголовке, если токен устарел - тогда запрос один раз повторяется.
+    И первый токен, и замену устаревшего получает только один запрос (single-flight),
+    остальные одновременные запросы ждут его результат.
+
+        response = await csrf.request(session, "POST", url, roblox_token, json=payload)
+    """
+
+    def __init__(self, refresh_url: str = ROBLOX_CSRF_REFRESH_URL) -> None:
+        self.refresh_url = refresh_url
+
+        self._tokens: Dict[str, str] = {}
+        self._refreshing: Dict[str, asyncio.Future] = {}
+
+    def get(self, roblox_token: str) -> Optional[str]:
+        return self._tokens.get(roblox_token)
+
+    def set(self, roblox_token: str, csrf_token: str) -> None:
+        self._tokens[roblox_token] = csrf_token
+
+    def invalidate(self, roblox_token: str) -> None:
+        self._tokens.pop(roblox_token, None)
+
+    def capture(self, roblox_token: str, response: ClientResponse) -> Optional[str]:
+        csrf_token = response.headers.get(ROBLOX_CSRF_HEADER)
+        if csrf_token and csrf_token != self._tokens.get(roblox_token):
+            logger.debug("Captured new CSRF token")
+            metrics.inc("csrf.captured")
+            self._tokens[roblox_token] = csrf_token
+        return self._tokens.get(roblox_token)
+
+    async def _fetch(self, session: ClientSession, roblox_token: str, offered: Optional[str]) -> Optional[str]:
+        metrics.inc("csrf.refreshes")
+        if offered:
+            # the 403 answer already carries the new token
+            self._tokens[roblox_token] = offered
+            return offered
+        # sent without a token on purpose, so roblox only answers 403 with a fresh one
+        async with session.post(self.refresh_url, allow_redirects=False) as response:
+            return self.capture(roblox_token, response)
+
+    async def refresh(self, session: ClientSession, roblox_token: str,
+                      stale: Optional[str] = None, offered: Optional[str] = None) -> Optional[str]:
+        """
+        Single-flight: concurrent callers share one refresh.
+        stale is the rejected token, if another one is cached already it's
+        returned as is; offered is the token from the 403 answer, used instead
+        of a refresh request
+        """
+        cached = self._tokens.get(roblox_token)
+        if cached and cached != stale:
+            return cached
+
+        future = self._refreshing.get(roblox_token)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(session, roblox_token, offered))
+            self._refreshing[roblox_token] = future
+            future.add_done_callback(lambda _: self._refreshing.pop(roblox_token, None))
+        return await asyncio.shield(future)
+
+    async def _send(self, session: ClientSession, method: str, url: str,
+                    csrf_token: Optional[str], **kwargs) -> ClientResponse:
+        headers = dict(kwargs.pop("headers", None) or {})
+        if csrf_token:
+            headers["X-CSRF-TOKEN"] = csrf_token
+        return await session.request(method, url, headers=headers, **kwargs)
+
+    async def request(self, session: ClientSession, method: str, url: str,
+                      roblox_token: str, **kwargs) -> ClientResponse:
+        """
+        session.request() with the CSRF token of roblox_token attached,
+        the caller has to release the response
+        """
+        method = method.upper()
+        if method in SAFE_METHODS:
+            return await session.request(method, url, **kwargs)
+
+        csrf_token = self._tokens.get(roblox_token) or await self.refresh(session, roblox_token)
+
+        response = await self._send(session, method, url, csrf_token, **kwargs)
+        offered = response.headers.get(ROBLOX_CSRF_HEADER)
+        if response.status != 403:
+            self.capture(roblox_token, response)
+            return response
+        if not offered or offered == csrf_token:
+            # forbidden for another reason
+            return response
+
+        logger.debug("CSRF token was rejected, retrying with a fresh one")
+        metrics.inc("csrf.retries")
+        response.release()
+        fresh = await self.refresh(session, roblox_token, stale=csrf_token, offered=offered)
+        return await self._send(session, method, url, fresh, **kwargs)
@@ -1,94 +1,405 @@
-from typing import Optional, Dict, Any, List, TYPE_CHECKING
+import abc
+import asyncio
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Iterable, Sequence, TYPE_CHECKING
 
 import sqlite3
-from asyncpg import Pool, Connection, Record
+from loguru import logger
 
+from app.consts import (
+    DEFAULT_DB_POOL_MIN_SIZE,
+    DEFAULT_DB_POOL_MAX_SIZE,
+    DEFAULT_DB_STATEMENT_CACHE_SIZE,
+    DEFAULT_DB_COMMAND_TIMEOUT,
+    DEFAULT_DB_SLOW_QUERY_MS,
+    DEFAULT_SQLITE_COMMIT_BATCH,
+)
 from app.services.interfaces import BasicDBConnector
+from app.services.metrics import metrics
+
+if TYPE_CHECKING:
+    # asyncpg is imported by get_db_conn, sqlite setups never load it
+    from asyncpg import Pool, Connection, Record
+
+_PG_PLACEHOLDER_RE = re.compile(r"\$(\d+)")
 
 
 class AsyncpgDBConnector(BasicDBConnector):
-    __slots__ = ("pool",)
+    """
+    Коннектор поверх пула asyncpg.
+
+    Одиночные запросы выполняются без явной транзакции, asyncpg сам
+    кеширует prepared statement-ы по тексту запроса на каждом соединении,
+    поэтому текст запросов должен быть стабильным (параметры только через $n).
+    """
+    __slots__ = ("pool", "slow_query_ms")
+    dialect = "postgres"
 
-    def __init__(self, pool: Pool) -> None:
+    def __init__(self, pool: "Pool", slow_query_ms: int = DEFAULT_DB_SLOW_QUERY_MS) -> None:
         self.pool = pool
+        self.slow_query_ms = slow_query_ms
+
+    @contextmanager
+    def _timed(self, operation: str, sql: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe(f"db.{operation}", elapsed)
+            if elapsed * 1000 >= self.slow_query_ms:
+                logger.warning(f"Slow query ({operation}, {elapsed * 1000:.1f} ms): {sql}")
 
     # noinspection PyTypeChecker
     async def execute(self, sql, *args, **kwargs) -> Optional[str]:
         pool = self.pool
 
-        async with pool.acquire() as conn:
-            conn: Connection
-            async with conn.transaction():
-                await conn.execute(sql, *args, **kwargs)
+        with self._timed("execute", sql):
+            async with pool.acquire() as conn:
+                conn: Connection
+                return await conn.execute(sql, *args, **kwargs)
 
-    async def fetch(self, sql, *args, **kwargs) -> Dict[str, Any]:
+    async def executemany(self, sql, args: Iterable[Sequence[Any]], **kwargs) -> None:
         pool = self.pool
 
-        async with pool.acquire() as conn:
-            conn: Connection
-            record: Record = await conn.fetchrow(sql, *args, **kwargs)
-            return record.items()
+        with self._timed("executemany", sql):
+            async with pool.acquire() as conn:
+                conn: Connection
+                await conn.executemany(sql, args, **kwargs)
+
+    async def copy_records(self, table: str, records: Iterable[Sequence[Any]], columns: Sequence[str]) -> None:
+        pool = self.pool
+
+        with self._timed("copy", f"COPY {table} ({', '.join(columns)})"):
+            async with pool.acquire() as conn:
+                conn: Connection
+                await conn.copy_records_to_table(table, records=records, columns=list(columns))
+
+    async def fetch(self, sql, *args, **kwargs) -> Optional[Dict[str, Any]]:
+        pool = self.pool
+
+        with self._timed("fetch", sql):
+            async with pool.acquire() as conn:
+                conn: Connection
+                record: Optional[Record] = await conn.fetchrow(sql, *args, **kwargs)
+
+        if record is None:
+            return None
+        return dict(record)
 
     async def fetchmany(self, sql, *args, **kwargs) -> List[Dict[str, Any]]:
         pool = self.pool
 
-        async with pool.acquire() as conn:
-            conn: Connection
-            records: List[dict] = await conn.fetch(sql, *args, **kwargs)
+        with self._timed("fetchmany", sql):
+            async with pool.acquire() as conn:
+                conn: Connection
+                records: List[Record] = await conn.fetch(sql, *args, **kwargs)
+
+        return [dict(record) for record in records]
 
-        return records
+    @asynccontextmanager
+    async def transaction(self, lock_key: Optional[int] = None):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if lock_key is not None:
+                    # released on commit or rollback
+                    await conn.execute("SELECT pg_advisory_xact_lock($1)", lock_key)
+                yield AsyncpgTransaction(conn)
 
     async def close(self):
         await self.pool.close()
 
 
-# noinspection PyArgumentList
-class SQLiteDBConnector(BasicDBConnector):
-    def __init__(self, conn: sqlite3.Connection) -> None:
+class AsyncpgTransaction:
+    """
+    Запросы на одном соединении внутри транзакции, см. AsyncpgDBConnector.transaction
+    """
+    __slots__ = ("conn",)
+    dialect = "postgres"
+
+    def __init__(self, conn: "Connection") -> None:
         self.conn = conn
-        self.conn.row_factory = self.dict_factory
-        self._cursor = None
+
+    async def execute(self, sql, *args, **kwargs) -> Optional[str]:
+        return await self.conn.execute(sql, *args, **kwargs)
+
+    async def executemany(self, sql, args: Iterable[Sequence[Any]], **kwargs) -> None:
+        await self.conn.executemany(sql, args, **kwargs)
+
+    async def fetch(self, sql, *args, **kwargs) -> Optional[Dict[str, Any]]:
+        record = await self.conn.fetchrow(sql, *args, **kwargs)
+        return dict(record) if record is not None else None
+
+    async def fetchmany(self, sql, *args, **kwargs) -> List[Dict[str, Any]]:
+        return [dict(record) for record in await self.conn.fetch(sql, *args, **kwargs)]
+
+
+# markers which end a SQLiteTransaction in the I/O thread
+_COMMIT = object()
+_ROLLBACK = object()
+
+
+class _SQLiteStatements(abc.ABC):
+    """
+    Запросы поверх _submit, общие для коннектора и транзакции
+    """
+    dialect = "sqlite"
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def translate(sql: str) -> str:
+        """
+        Переводит плейсхолдеры postgres ($1, $2) в нумерованные sqlite (?1, ?2)
+        """
+        return _PG_PLACEHOLDER_RE.sub(r"?\1", sql)
+
+    @abc.abstractmethod
+    async def _submit(self, func, is_write: bool = False):
+        pass
+
+    async def execute(self, sql, *args, **kwargs) -> None:
+        sql = self.translate(sql)
+
+        def _execute(conn: sqlite3.Connection):
+            conn.execute(sql, args)
+
+        await self._submit(_execute, is_write=True)
+
+    async def executemany(self, sql, args: Iterable[Sequence[Any]], **kwargs) -> Optional[int]:
+        sql = self.translate(sql)
+
+        def _executemany(conn: sqlite3.Connection):
+            return conn.executemany(sql, args).rowcount
+
+        return await self._submit(_executemany, is_write=True)
+
+    async def copy_records(self, table: str, records: Iterable[Sequence[Any]], columns: Sequence[str]) -> None:
+        placeholders = ", ".join("?" for _ in columns)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        await self.executemany(sql, records)
+
+    async def fetch(self, sql, *args, **kwargs) -> Optional[Dict[str, Any]]:
+        sql = self.translate(sql)
+
+        def _fetch(conn: sqlite3.Connection):
+            return conn.execute(sql, args).fetchone()
+
+        return await self._submit(_fetch)
+
+    async def fetchmany(self, sql, *args, **kwargs) -> List[Dict[str, Any]]:
+        sql = self.translate(sql)
+
+        def _fetchmany(conn: sqlite3.Connection):
+            return conn.execute(sql, args).fetchall()
+
+        return await self._submit(_fetchmany)
+
+
+class SQLiteTransaction(_SQLiteStatements):
+    """
+    Пока транзакция открыта, I/O поток выполняет только её запросы
+    """
+
+    def __init__(self) -> None:
+        self.jobs: "queue.Queue[tuple]" = queue.Queue()
+
+    async def _submit(self, func, is_write: bool = False):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.jobs.put((loop, future, func))
+        return await future
+
+
+class SQLiteDBConnector(_SQLiteStatements, BasicDBConnector):
+    """
+    Встраиваемая БД для одиночных инсталляций.
+
+    Все обращения к sqlite3 идут через отдельный I/O поток с одним соединением,
+    поэтому event loop не блокируется. Записи коммитятся группами: коммит
+    делается когда очередь запросов опустела или набралось commit_batch записей,
+    и только после него ожидающие записи получают результат.
+    """
+
+    def __init__(self, path: str, commit_batch: int = DEFAULT_SQLITE_COMMIT_BATCH) -> None:
+        self.path = path
+        self.commit_batch = commit_batch
+
+        self._jobs: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._ready = threading.Event()
+        self._open_error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._worker, name="sqlite-io", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._open_error is not None:
+            raise self._open_error
 
     @staticmethod
     def dict_factory(cursor, row):
         fields = [column[0] for column in cursor.description]
         return {key: value for key, value in zip(fields, row)}
 
-    @property
-    def cursor(self) -> sqlite3.Cursor:
-        if not self._cursor:
-            self._cursor = self.conn.cursor()
-        return self._cursor
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = self.dict_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
 
-    async def execute(self, sql, *args, **kwargs) -> None :
-        self.cursor.execute(sql, args)
-        self.conn.commit()
+    @staticmethod
+    def _resolve(loop: asyncio.AbstractEventLoop, future: asyncio.Future, result=None, exc=None):
+        def _set():
+            if future.done():
+                return
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
 
-    async def fetch(self, sql, *args, **kwargs) -> Dict[str, Any]:
-        self.cursor.execute(sql, args)
-        result: dict = self.cursor.fetchone()
-        return result
+        loop.call_soon_threadsafe(_set)
 
-    async def fetchmany(self, sql, *args, **kwargs) -> List[Dict[str, Any]]:
-        self.cursor.execute(sql, args)
-        return self.cursor.fetchmany()
+    def _worker(self):
+        try:
+            conn = self._open()
+        except Exception as e:
+            # re-raised by __init__, otherwise it would wait for the event forever
+            self._open_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        # (loop, future, result) записей, которые ждут коммита
+        pending = []
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            loop, future, func, is_write = job
+            if isinstance(func, SQLiteTransaction):
+                if pending:
+                    self._commit(conn, pending)
+                    pending = []
+                self._run_transaction(conn, loop, future, func)
+                continue
+
+            try:
+                result = func(conn)
+            except Exception as e:
+                self._resolve(loop, future, exc=e)
+            else:
+                if is_write:
+                    pending.append((loop, future, result))
+                else:
+                    self._resolve(loop, future, result)
+
+            if pending and (self._jobs.empty() or len(pending) >= self.commit_batch):
+                self._commit(conn, pending)
+                pending = []
+
+        if pending:
+            self._commit(conn, pending)
+        conn.close()
+
+    def _run_transaction(self, conn: sqlite3.Connection, loop, future, transaction: SQLiteTransaction):
+        try:
+            # takes the write lock of the database file right away, other processes wait for it
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            self._resolve(loop, future, exc=e)
+            return
+        self._resolve(loop, future)
+
+        while True:
+            loop, future, func = transaction.jobs.get()
+            if func is _ROLLBACK:
+                conn.rollback()
+                self._resolve(loop, future)
+                return
+            if func is _COMMIT:
+                try:
+                    conn.commit()
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    self._resolve(loop, future, exc=e)
+                else:
+                    self._resolve(loop, future)
+                return
+
+            try:
+                self._resolve(loop, future, func(conn))
+            except Exception as e:
+                self._resolve(loop, future, exc=e)
+
+    def _commit(self, conn: sqlite3.Connection, pending: list):
+        try:
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            for loop, future, _ in pending:
+                self._resolve(loop, future, exc=e)
+            return
+
+        for loop, future, result in pending:
+            self._resolve(loop, future, result)
+
+    async def _submit(self, func, is_write: bool = False):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put((loop, future, func, is_write))
+        return await future
+
+    @asynccontextmanager
+    async def transaction(self, lock_key: Optional[int] = None):
+        """
+        lock_key is not needed, BEGIN IMMEDIATE locks the whole database
+        """
+        transaction = SQLiteTransaction()
+        await self._submit(transaction)
+        try:
+            yield transaction
+        except BaseException:
+            await transaction._submit(_ROLLBACK)
+            raise
+        else:
+            await transaction._submit(_COMMIT)
 
     async def close(self):
-        self.conn.close()
+        self._jobs.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
 
 
-async def get_db_conn(dsn: str, type_: str = "postgresql") -> BasicDBConnector:
-    if type_ == "sqlite3":
-        import sqlite3
+async def get_db_conn(
+        dsn: str,
+        type_: str = "postgresql",
+        min_size: int = DEFAULT_DB_POOL_MIN_SIZE,
+        max_size: int = DEFAULT_DB_POOL_MAX_SIZE,
+        statement_cache_size: int = DEFAULT_DB_STATEMENT_CACHE_SIZE,
+        command_timeout: float = DEFAULT_DB_COMMAND_TIMEOUT,
+        slow_query_ms: int = DEFAULT_DB_SLOW_QUERY_MS,
+        commit_batch: int = DEFAULT_SQLITE_COMMIT_BATCH,
+) -> BasicDBConnector:
+    if type_ == "sqlite3" or type_ == "sqlite":
+        if dsn.startswith("sqlite://"):
+            dsn = dsn[len("sqlite://"):]
 
-        conn = sqlite3.connect(dsn)
-        conn = SQLiteDBConnector(conn)
+        conn = SQLiteDBConnector(dsn, commit_batch=commit_batch)
     elif type_ == "postgresql" or type_ == "postgres":
         import asyncpg
 
-        pool = await asyncpg.create_pool(dsn)
-        conn = AsyncpgDBConnector(pool)
+        pool = await asyncpg.create_pool(
+            dsn,
+            min_size=min_size,
+            max_size=max_size,
+            statement_cache_size=statement_cache_size,
+            command_timeout=command_timeout,
+        )
+        conn = AsyncpgDBConnector(pool, slow_query_ms=slow_query_ms)
     else:
         raise ValueError("Db does not support, or DSN empty, dsn: %s" % dsn)
     return conn
-
@@ -1,15 +1,12 @@
-from typing import List, Dict, Any, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, TYPE_CHECKING, Iterable, Optional
 from urllib.parse import urlparse
 
 from loguru import logger
-from selenium.common import StaleElementReferenceException
-from selenium.webdriver.firefox.service import Service as GeckoService
-from selenium.webdriver.remote.webdriver import WebDriver
-from seleniumwire import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.firefox import GeckoDriverManager
 
 if TYPE_CHECKING:
+    # selenium and selenium-wire are loaded by get_driver, http search backend never imports them
+    from selenium.webdriver.remote.webdriver import WebDriver
     from app.settings import Settings
 
 
@@ -21,13 +18,38 @@ def csrf_token_to_request(csrf_token: str, roblox_token: str):
     return interceptor
 
 
-def set_token(driver: WebDriver, token: str) -> None:
+def set_token(driver: "WebDriver", token: str) -> None:
     driver.add_cookie({"name": ".ROBLOSECURITY", "value": token, "domain": ".roblox.com", "secure": True, "httponly": True})
 
 
-def get_driver(settings: "Settings") -> WebDriver:
+def proxy_options(proxy: Optional[str]) -> Dict[str, Any]:
+    """
+    selenium-wire upstream proxy config, empty dict means direct connection
+    """
+    if not proxy:
+        return {}
+    return {"http": proxy, "https": proxy, "no_proxy": "localhost,127.0.0.1"}
+
+
+def use_proxy(driver: "WebDriver", proxy: Optional[str]) -> None:
+    """
+    Switches upstream proxy of a running selenium-wire driver,
+    plain selenium drivers are left as is
+    """
+    if not hasattr(driver, "backend"):
+        return
+    driver.proxy = proxy_options(proxy)
+
+
+def get_driver(settings: "Settings", proxy: Optional[str] = None) -> "WebDriver":
+    from seleniumwire import webdriver
+    from selenium.webdriver.chrome.service import Service as ChromeService
+    from selenium.webdriver.firefox.service import Service as GeckoService
+
     logger.info("Setting up driver")
 
+    seleniumwire_options = {"proxy": proxy_options(proxy)} if proxy else {}
+
     if settings.browser.lower() == "chrome":
         opts = webdriver.ChromeOptions()
         agent = settings.user_agent
@@ -44,7 +66,7 @@ def get_driver(settings: "Settings") -> WebDriver:
 
         service = ChromeService(executable_path="./drivers/chromedriver.exe")
 
-        driver = webdriver.Chrome(service=service, options=opts)
+        driver = webdriver.Chrome(service=service, options=opts, seleniumwire_options=seleniumwire_options)
 
     elif settings.browser.lower() == "remote":
         logger.info("Setting up remote chrome browser")
@@ -62,7 +84,11 @@ def get_driver(settings: "Settings") -> WebDriver:
 
         logger.info(f"Connecting to {settings.browser_dsn} Remote browser")
 
-        driver = webdriver.Remote(command_executor=settings.browser_dsn, options=opts)
+        driver = webdriver.Remote(
+            command_executor=settings.browser_dsn,
+            options=opts,
+            seleniumwire_options=seleniumwire_options,
+        )
     elif settings.browser.lower() == "firefox" or settings.browser.lower() == "gecko":
         logger.info("Setting up remote firefox browser")
 
@@ -70,14 +96,49 @@ def get_driver(settings: "Settings") -> WebDriver:
         agent = settings.user_agent
         opts.add_argument(agent)
 
+        from webdriver_manager.firefox import GeckoDriverManager
+
         service = GeckoService(GeckoDriverManager(path="./drivers/").install())
-        driver = webdriver.Firefox(service=service, options=opts)
+        driver = webdriver.Firefox(service=service, options=opts, seleniumwire_options=seleniumwire_options)
     else:
         raise NotImplementedError(f"{settings.browser} is not yet implemented")
 
     return driver
 
 
+def count_throttled_responses(driver: "WebDriver") -> int:
+    """
+    Counts HTTP 429 responses captured by selenium-wire since the last call
+    and clears captured requests, plain selenium drivers always give 0
+    """
+    try:
+        requests = driver.requests
+    except AttributeError:
+        return 0
+
+    throttled = sum(1 for request in requests if request.response and request.response.status_code == 429)
+    del driver.requests
+    return throttled
+
+
+def close_drivers(drivers: Iterable["WebDriver"]) -> None:
+    """
+    Closes browsers in parallel, quit() of each one may take seconds
+    """
+    drivers = list(drivers)
+    if not drivers:
+        return
+
+    def _quit(driver: "WebDriver"):
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Failed to close driver: {e!r}")
+
+    with ThreadPoolExecutor(max_workers=len(drivers)) as executor:
+        list(executor.map(_quit, drivers))
+
+
 def convert_browser_cookies_to_aiohttp(cookies: List[Dict[str, Any]]) -> Dict[str, Any]:
     result = {}
     for cookie in cookies:
@@ -100,6 +161,8 @@ def presence_of_any_text_in_element(locator):
     :param locator:
     :return:
     """
+    from selenium.common import StaleElementReferenceException
+
     def _predicate(driver):
         try:
             element = driver.find_element(*locator)
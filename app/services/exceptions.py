@@ -5,3 +5,17 @@ class SkipException(Exception):
 
 class CancelException(Exception):
     pass
+
+
+class RepliesNotSent(Exception):
+    """
+    Publisher gave up on the replies of a message, it is retried or dead lettered
+    """
+    pass
+
+
+class PoisonMessageException(Exception):
+    """
+    Message can never be processed, it goes straight to the dead letter queue
+    """
+    pass
@@ -0,0 +1,130 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Iterable, Tuple
+
+import aiohttp
+from loguru import logger
+from pydantic import BaseModel
+
+from app.consts import ROBLOX_GAME_PASS_INFO_URL
+from app.services.http import HTTPClientPool
+from app.services.metrics import metrics
+from app.services.validators import GamePassRef
+
+
+class GamePass(BaseModel):
+    id: int
+    name: str
+    price: Optional[int] = None
+    is_for_sale: bool = False
+    product_id: Optional[int] = None
+
+
+class GamePassResolver:
+    """
+    Метаданные геймпассов (цена, продается ли) с LRU+TTL кэшем.
+
+    resolve_many() запрашивает только то, чего нет в кэше, не больше
+    concurrency запросов одновременно. Несуществующие геймпассы
+    тоже кэшируются, как None.
+
+    Один резолвер общий для всех воркеров lane (у каждого свой поток и loop),
+    поэтому запрос идет через http вызывающего воркера, а одновременные
+    запросы одного геймпасса из разных воркеров ждут один HTTP запрос.
+    """
+
+    def __init__(self, ttl: float, max_size: int, concurrency: int) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.concurrency = concurrency
+
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[int, Tuple[float, Optional[GamePass]]]" = OrderedDict()
+        # thread safe futures, awaited from the loops of other workers
+        self._pending: Dict[int, concurrent.futures.Future] = {}
+
+    def cached(self, game_pass_id: int) -> Tuple[bool, Optional[GamePass]]:
+        """
+        :return: (found, game pass), game pass is None for cached misses
+        """
+        with self._lock:
+            item = self._cache.get(game_pass_id)
+            if item is None:
+                return False, None
+            expires_at, game_pass = item
+            if expires_at <= time.monotonic():
+                del self._cache[game_pass_id]
+                return False, None
+            self._cache.move_to_end(game_pass_id)
+            return True, game_pass
+
+    def _store(self, game_pass_id: int, game_pass: Optional[GamePass]) -> None:
+        with self._lock:
+            self._cache[game_pass_id] = (time.monotonic() + self.ttl, game_pass)
+            self._cache.move_to_end(game_pass_id)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    async def fetch(self, http: HTTPClientPool, ref: GamePassRef) -> Optional[GamePass]:
+        response = await http.request("GET", ROBLOX_GAME_PASS_INFO_URL.format(id=ref.id))
+        async with response:
+            if response.status in (400, 404):
+                return None
+            response.raise_for_status()
+            info = await response.json()
+
+        return GamePass(
+            id=ref.id,
+            name=info.get("Name") or ref.name,
+            price=info.get("PriceInRobux"),
+            is_for_sale=bool(info.get("IsForSale")),
+            product_id=info.get("ProductId"),
+        )
+
+    async def resolve(self, http: HTTPClientPool, ref: GamePassRef) -> Optional[GamePass]:
+        found, game_pass = self.cached(ref.id)
+        if found:
+            metrics.inc("gamepass.cache.hits")
+            return game_pass
+        metrics.inc("gamepass.cache.misses")
+
+        with self._lock:
+            pending = self._pending.get(ref.id)
+            if pending is None:
+                future = self._pending[ref.id] = concurrent.futures.Future()
+        if pending is not None:
+            # shield, a cancelled waiter must not cancel the shared request
+            return await asyncio.shield(asyncio.wrap_future(pending))
+
+        try:
+            game_pass = await self.fetch(http, ref)
+        except BaseException as e:
+            # any failure, bad json or a cancellation included, must reach the waiters
+            if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+                logger.warning(f"Failed to resolve game pass {ref.id}: {e!r}")
+            future.set_exception(e)
+            raise
+        else:
+            self._store(ref.id, game_pass)
+            future.set_result(game_pass)
+            return game_pass
+        finally:
+            with self._lock:
+                self._pending.pop(ref.id, None)
+
+    async def resolve_many(self, http: HTTPClientPool, refs: Iterable[GamePassRef]) -> Dict[int, Optional[GamePass]]:
+        """
+        :return: game pass id -> game pass, None if it doesn't exist
+        """
+        unique = {ref.id: ref for ref in refs}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _resolve(ref: GamePassRef) -> Optional[GamePass]:
+            async with semaphore:
+                return await self.resolve(http, ref)
+
+        results = await asyncio.gather(*(_resolve(ref) for ref in unique.values()))
+        return dict(zip(unique, results))
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Tuple, Callable, Any
+
+from loguru import logger
+
+from app.services.metrics import metrics
+
+# probe is called by the status server thread, must not touch the event loop
+Probe = Callable[[], Tuple[bool, str]]
+
+
+class HealthState:
+    """
+    Состояние компонентов для /healthz и /readyz.
+
+    Браузер, токены и БД отмечаются через report() теми, кто их и так
+    использует, или фоновой проверкой run_checks() на event loop,
+    поэтому ответ не делает запросов к БД и не грузит страниц.
+    Пробы (add_probe) вызываются на каждый запрос, это дешевые проверки
+    вроде открыт ли канал AMQP.
+    """
+
+    def __init__(self, liveness_timeout: float) -> None:
+        self.liveness_timeout = liveness_timeout
+        self.started_at = time.monotonic()
+        # last time the event loop got to run_checks
+        self.heartbeat = time.monotonic()
+
+        self._checks: Dict[str, Tuple[bool, str]] = {}
+        self._probes: Dict[str, Probe] = {}
+        self._lock = threading.Lock()
+
+    def report(self, name: str, ok: bool, detail: str = "") -> None:
+        with self._lock:
+            previous = self._checks.get(name)
+            self._checks[name] = (ok, detail)
+        if previous is None or previous[0] != ok:
+            log = logger.info if ok else logger.warning
+            log(f"Health check {name}: {'ok' if ok else 'failing'} {detail}".rstrip())
+        metrics.set(f"health.{name}", int(ok))
+
+    def add_probe(self, name: str, probe: Probe) -> None:
+        self._probes[name] = probe
+
+    def liveness(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Жив ли процесс: event loop не завис дольше liveness_timeout,
+        долгая обработка одного сообщения сюда укладывается
+        """
+        stalled = time.monotonic() - self.heartbeat
+        return stalled < self.liveness_timeout, {
+            "uptime": round(time.monotonic() - self.started_at, 1),
+            "loop_stalled_seconds": round(stalled, 1),
+        }
+
+    def readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Может ли реплика обрабатывать сообщения на полной скорости,
+        пока какая то проверка не отчиталась, реплика не готова
+        """
+        with self._lock:
+            checks = dict(self._checks)
+        for name, probe in self._probes.items():
+            try:
+                checks[name] = probe()
+            except Exception as e:
+                checks[name] = (False, repr(e))
+
+        ready = bool(checks) and all(ok for ok, _ in checks.values())
+        return ready, {name: {"ok": ok, "detail": detail} for name, (ok, detail) in checks.items()}
+
+    async def run_checks(self, token_service, interval: float) -> None:
+        """
+        Раз в interval секунд считает активные токены, заодно это проверка пула БД
+        """
+        while True:
+            self.heartbeat = time.monotonic()
+            try:
+                stats = await token_service.count_tokens()
+            except Exception as e:
+                self.report("db", False, repr(e))
+            else:
+                self.report("db", True)
+                self.report("tokens", stats["active"] > 0, f"{stats['active']} active")
+            await asyncio.sleep(interval)
+
+
+def channel_probe(client) -> Probe:
+    """
+    Проба для BasicPikaClient, например publisher-а ответов
+    """
+    def _probe() -> Tuple[bool, str]:
+        return client.is_connected(), ""
+
+    return _probe
+
+
+def consumer_probe(consumer) -> Probe:
+    def _probe() -> Tuple[bool, str]:
+        if consumer.draining:
+            return False, "draining"
+        return consumer.consuming, ""
+
+    return _probe
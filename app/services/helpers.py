@@ -1,12 +1,17 @@
 import asyncio
 import inspect
 import threading
+from itertools import islice
 from platform import uname
+from typing import Iterable, Iterator, List, TypeVar
 from urllib.parse import urlparse
 
 from loguru import logger
 
 from .exceptions import SkipException, CancelException
+from .profiler import profiler
+
+T = TypeVar("T")
 
 
 def _get_spec(func: callable):
@@ -22,25 +27,34 @@ def _check_spec(spec: inspect.FullArgSpec, kwargs: dict):
     return {k: v for k, v in kwargs.items() if k in set(spec.args + spec.kwonlyargs)}
 
 
+def run_coroutine(coro):
+    """
+    Runs coroutine to completion from synchronous consumer code,
+    on the event loop of the current thread
+    """
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
 def run_listeners(data, listeners, key: str = '__call__'):
     for listener in listeners:
         try:
             func = getattr(listener, key)
             spec = _get_spec(func)
             workflow = _check_spec(spec, data)
-            if asyncio.iscoroutinefunction(func):
-                loop = asyncio.get_event_loop()
-
-                if threading.current_thread().name != "MainThread":
-                    logger.debug("Executing in thread")
-                    task = func(**workflow)
-                    loop.run_until_complete(task)
-
-                    logger.debug("Task in thread has been completed")
+            with profiler.stage(f"{type(listener).__name__}.{key}"):
+                if asyncio.iscoroutinefunction(func):
+                    loop = asyncio.get_event_loop()
+
+                    if threading.current_thread().name != "MainThread":
+                        logger.debug("Executing in thread")
+                        task = func(**workflow)
+                        loop.run_until_complete(task)
+
+                        logger.debug("Task in thread has been completed")
+                    else:
+                        loop.run_until_complete(func(**workflow))
                 else:
-                    loop.run_until_complete(func(**workflow))
-            else:
-                func(**workflow)
+                    func(**workflow)
 
         except SkipException:
             pass
@@ -55,3 +69,15 @@ def in_wsl() -> bool:
 def validate_url(url: str):
     parsed_url = urlparse(url)
     return bool(parsed_url.scheme and parsed_url.netloc)
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Lazily splits iterable into lists of at most size items
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,195 @@
+import asyncio
+from http.cookies import SimpleCookie
+from typing import Dict, Optional, Any
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig, CookieJar, ClientResponse
+from aiohttp import ClientProxyConnectionError, ClientHttpProxyError
+from loguru import logger
+
+from app.consts import ROBLOX_TOKEN_KEY, ROBLOX_COOKIE_DOMAIN
+from app.services.csrf import CSRFTokenManager
+from app.services.limiter import LimiterRejected
+from app.services.metrics import metrics
+from app.services.proxies import ProxyPool
+
+
+def _count(name: str):
+    async def _on_event(session, context, params):
+        metrics.inc(name)
+
+    return _on_event
+
+
+def get_trace_config() -> TraceConfig:
+    """
+    Counters of new/reused connections and DNS cache hits,
+    a lot of created connections compared to reused ones means socket churn
+    """
+    trace_config = TraceConfig()
+    trace_config.on_connection_create_end.append(_count("http.connections.created"))
+    trace_config.on_connection_reuseconn.append(_count("http.connections.reused"))
+    trace_config.on_connection_queued_start.append(_count("http.connections.queued"))
+    trace_config.on_dns_cache_hit.append(_count("http.dns.hits"))
+    trace_config.on_dns_cache_miss.append(_count("http.dns.misses"))
+    trace_config.on_request_exception.append(_count("http.errors"))
+    return trace_config
+
+
+def roblox_cookies(cookies: Dict[str, Any]) -> SimpleCookie:
+    """
+    Cookies limited to roblox.com and its subdomains,
+    so .ROBLOSECURITY is never sent to other hosts
+    """
+    result = SimpleCookie()
+    for name, value in cookies.items():
+        result[name] = value
+        result[name]["domain"] = ROBLOX_COOKIE_DOMAIN
+        result[name]["path"] = "/"
+    return result
+
+
+class HTTPClientPool:
+    """
+    Общий на процесс TCPConnector (keep-alive, кэш DNS, лимиты на хост)
+    и по ClientSession с отдельным cookie jar на каждый токен.
+    Сессии не владеют коннектором, поэтому соединения переиспользуются между токенами.
+
+    Активный токен переключается через set_active() вместе с браузером,
+    request() без token ходит от имени активного токена,
+    а если активного нет - анонимно, без cookies и прокси.
+    """
+
+    def __init__(
+            self,
+            limit: int,
+            limit_per_host: int,
+            dns_ttl: int,
+            keepalive_timeout: float,
+            timeout: float,
+            proxies: Optional[ProxyPool] = None,
+            csrf: Optional[CSRFTokenManager] = None,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = ClientTimeout(total=timeout)
+        self.csrf = csrf
+        self.proxies = proxies
+
+        self.active_token: Optional[str] = None
+
+        self._sessions: Dict[str, ClientSession] = {}
+        self._connector: Optional[TCPConnector] = None
+        self._trace_config = get_trace_config()
+
+    @property
+    def connector(self) -> TCPConnector:
+        # created lazily, connector binds to the running event loop
+        if self._connector is None:
+            self._connector = TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+                enable_cleanup_closed=True,
+            )
+        return self._connector
+
+    def session(self, token: Optional[str] = None) -> ClientSession:
+        # anonymous session is stored under an empty token
+        token = token or self.active_token or ""
+
+        session = self._sessions.get(token)
+        if session is None:
+            session = ClientSession(
+                connector=self.connector,
+                connector_owner=False,
+                cookie_jar=CookieJar(),
+                timeout=self.timeout,
+                trace_configs=[self._trace_config],
+            )
+            if token:
+                session.cookie_jar.update_cookies(roblox_cookies({ROBLOX_TOKEN_KEY: token}))
+            self._sessions[token] = session
+        return session
+
+    def set_active(self, token: str, cookies: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Делает token активным, cookies - текущие cookies браузера для этого токена
+        """
+        self.active_token = token
+        session = self.session(token)
+        if cookies:
+            session.cookie_jar.update_cookies(roblox_cookies(cookies))
+
+    async def forget(self, token: str) -> None:
+        """
+        Закрывает сессию токена, например когда он потрачен
+        """
+        session = self._sessions.pop(token, None)
+        if token == self.active_token:
+            self.active_token = None
+        if session is not None:
+            await session.close()
+
+    async def request(self, method: str, url: str, token: Optional[str] = None, **kwargs) -> ClientResponse:
+        """
+        Запрос от имени token (по умолчанию активного),
+        с CSRF токеном и прокси этого токена если они есть
+        """
+        token = token or self.active_token
+        session = self.session(token)
+
+        proxy = self.proxies.for_token(token) if self.proxies is not None and token else None
+        if proxy is not None:
+            wait = proxy.bucket.reserve(self.timeout.total)
+            if wait is None:
+                metrics.inc("limiter.rejected")
+                raise LimiterRejected(f"Rate budget of proxy {proxy.name} exhausted")
+            if wait > 0:
+                await asyncio.sleep(wait)
+            kwargs["proxy"] = proxy.url
+
+        try:
+            if self.csrf is not None and token:
+                response = await self.csrf.request(session, method, url, token, **kwargs)
+            else:
+                response = await session.request(method, url, **kwargs)
+        except (ClientProxyConnectionError, ClientHttpProxyError, asyncio.TimeoutError):
+            if proxy is not None:
+                self.proxies.report(proxy, ok=False)
+            raise
+
+        if proxy is not None:
+            self.proxies.report(proxy, ok=True)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        connector = self._connector
+        # aiohttp doesn't expose pool occupancy, private attributes are read defensively
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values()) if connector else 0
+        acquired = len(getattr(connector, "_acquired", ())) if connector else 0
+
+        stats = {
+            "sessions": len(self._sessions),
+            "connections_idle": idle,
+            "connections_acquired": acquired,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+        }
+        for name, value in stats.items():
+            metrics.set(f"http.pool.{name}", value)
+        return stats
+
+    async def close(self) -> None:
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+
+        logger.info("HTTP client pool has been closed")
@@ -0,0 +1,170 @@
+import abc
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Tuple
+
+from loguru import logger
+
+from app.services.interfaces import BasicDBConnector
+from app.services.metrics import metrics
+from app.services.queue.publisher import Headers
+
+Replies = List[Dict[str, Any]]
+
+
+def get_message_key(properties) -> Optional[str]:
+    """
+    Ключ идемпотентности: message_id из свойств сообщения, иначе job_id из заголовков
+    """
+    if properties is None:
+        return None
+    if getattr(properties, "message_id", None):
+        return str(properties.message_id)
+    headers = getattr(properties, "headers", None) or {}
+    job_id = headers.get("job_id")
+    return str(job_id) if job_id else None
+
+
+class ReplyRecorder:
+    """
+    Прокси над BasicMessageSender, запоминает отправленные ответы,
+    что бы их можно было повторить при повторной доставке сообщения
+    """
+
+    def __init__(self, publisher) -> None:
+        self.publisher = publisher
+        self.replies: Replies = []
+
+    def send_message(self, body: Dict, headers: Optional[Headers] = None,
+                     exchange_name: str = None, routing_key: str = None):
+        self.replies.append({
+            "body": body,
+            "headers": {
+                "job_id": headers.job_id,
+                "priority": headers.priority.name,
+                "task_type": headers.task_type,
+            } if headers else None,
+            "exchange_name": exchange_name,
+            "routing_key": routing_key,
+        })
+        return self.publisher.send_message(body, headers, exchange_name, routing_key)
+
+    def __getattr__(self, item):
+        return getattr(self.publisher, item)
+
+
+def replay(publisher, replies: Replies) -> None:
+    for reply in replies:
+        headers = Headers(**reply["headers"]) if reply["headers"] else None
+        publisher.send_message(reply["body"], headers, reply["exchange_name"], reply["routing_key"])
+
+
+class IdempotencyStore(abc.ABC):
+    """
+    Хранит ответы на уже обработанные сообщения ограниченное время (ttl)
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+            metrics.inc("idempotency.hits")
+        else:
+            self.misses += 1
+            metrics.inc("idempotency.misses")
+        metrics.set("idempotency.hit_rate", self.hits / (self.hits + self.misses))
+
+    async def get(self, key: str) -> Optional[Replies]:
+        replies = await self._get(key)
+        self._count(replies is not None)
+        return replies
+
+    async def put(self, key: str, replies: Replies) -> None:
+        await self._put(key, replies)
+
+    async def setup(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def _get(self, key: str) -> Optional[Replies]:
+        pass
+
+    @abc.abstractmethod
+    async def _put(self, key: str, replies: Replies) -> None:
+        pass
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    def __init__(self, ttl: float, max_size: int) -> None:
+        super().__init__()
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, Tuple[float, Replies]]" = OrderedDict()
+
+    async def _get(self, key: str) -> Optional[Replies]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, replies = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            return replies
+
+    async def _put(self, key: str, replies: Replies) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, replies)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+class DBIdempotencyStore(IdempotencyStore):
+    """
+    Хранилище в БД, переживает рестарты и общее для всех реплик.
+    Просроченные записи удаляются каждые purge_every вставок.
+    """
+
+    def __init__(self, conn: BasicDBConnector, table: str, ttl: float, purge_every: int = 100) -> None:
+        super().__init__()
+        self.conn = conn
+        self.table = table
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._puts = 0
+
+        self._get_sql = f"SELECT replies FROM {table} WHERE key = $1 AND expires_at > $2"
+        self._put_sql = (
+            f"INSERT INTO {table} (key, replies, expires_at) VALUES ($1, $2, $3) "
+            f"ON CONFLICT (key) DO UPDATE SET replies = excluded.replies, expires_at = excluded.expires_at"
+        )
+        self._purge_sql = f"DELETE FROM {table} WHERE expires_at <= $1"
+
+    async def setup(self) -> None:
+        await self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            f"key TEXT PRIMARY KEY, replies TEXT NOT NULL, expires_at DOUBLE PRECISION NOT NULL);"
+        )
+
+    async def _get(self, key: str) -> Optional[Replies]:
+        record = await self.conn.fetch(self._get_sql, key, time.time())
+        if record is None:
+            return None
+        return json.loads(record.get("replies"))
+
+    async def _put(self, key: str, replies: Replies) -> None:
+        now = time.time()
+        await self.conn.execute(self._put_sql, key, json.dumps(replies), now + self.ttl)
+
+        self._puts += 1
+        if self._puts % self.purge_every == 0:
+            logger.debug(f"Purging expired records from {self.table}")
+            await self.conn.execute(self._purge_sql, now)
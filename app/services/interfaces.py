@@ -1,5 +1,5 @@
 import abc
-from typing import Union, Type, Callable, Dict, Any, Optional, List
+from typing import Union, Type, Callable, Dict, Any, Optional, List, Iterable, Sequence, AsyncContextManager
 
 
 class IListener(abc.ABC):
@@ -26,10 +26,27 @@ class Notifier(abc.ABC):
 
 
 class BasicDBConnector(abc.ABC):
+    # sql dialect, lets repositories pick backend specific DDL
+    dialect: str = "postgres"
+
     @abc.abstractmethod
     async def execute(self, sql, *args, **kwargs) -> None:
         pass
 
+    @abc.abstractmethod
+    async def executemany(self, sql, args: Iterable[Sequence[Any]], **kwargs) -> Optional[int]:
+        """
+        :return: affected rows if the driver reports them, otherwise None
+        """
+        pass
+
+    @abc.abstractmethod
+    async def copy_records(self, table: str, records: Iterable[Sequence[Any]], columns: Sequence[str]) -> None:
+        """
+        Bulk insert of records into table, COPY where backend supports it
+        """
+        pass
+
     @abc.abstractmethod
     async def fetch(self, sql, *args, **kwargs) -> Dict[str, Any]:
         pass
@@ -38,6 +55,15 @@ class BasicDBConnector(abc.ABC):
     async def fetchmany(self, sql, *args, **kwargs) -> List[Dict[str, Any]]:
         pass
 
+    @abc.abstractmethod
+    def transaction(self, lock_key: Optional[int] = None) -> AsyncContextManager[Any]:
+        """
+        Async context manager, statements executed through the object it gives are
+        applied atomically. Transactions with the same lock_key don't run at the same time,
+        even in different processes
+        """
+        pass
+
     @abc.abstractmethod
     async def close(self):
         pass
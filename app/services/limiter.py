@@ -0,0 +1,312 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager, ExitStack
+from typing import Callable, Dict, List, Optional, Iterable
+
+from loguru import logger
+
+from app.consts import ADMISSION_POLL_INTERVAL
+from app.services.metrics import metrics
+
+
+class LimiterRejected(Exception):
+    """
+    No free slot or rate budget within admission timeout
+    """
+    pass
+
+
+class TokenBucket:
+    """
+    rate запросов в секунду, burst - сколько можно сделать подряд.
+    rate <= 0 значит без ограничений.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float = float("inf")) -> Optional[float]:
+        """
+        Takes one token, returns how long caller has to wait before using it,
+        or None without taking anything if the wait would be longer than max_wait
+        """
+        return reserve_all([self], max_wait)
+
+    def _refill(self, now: float) -> float:
+        # caller holds the lock, returns the wait for the next token
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+
+def reserve_all(buckets: Iterable[TokenBucket], max_wait: float = float("inf")) -> Optional[float]:
+    """
+    Takes one token from every bucket, or from none of them if any would
+    make the caller wait longer than max_wait (then returns None).
+    Returns the longest of the waits.
+    """
+    # locks are taken in a fixed order, so concurrent callers can't deadlock
+    buckets = sorted({id(bucket): bucket for bucket in buckets if bucket.rate > 0}.values(), key=id)
+    with ExitStack() as stack:
+        for bucket in buckets:
+            stack.enter_context(bucket._lock)
+
+        now = time.monotonic()
+        wait = max((bucket._refill(now) for bucket in buckets), default=0.0)
+        if wait > max_wait:
+            return None
+        for bucket in buckets:
+            bucket._tokens -= 1
+        return wait
+
+
+def pause(seconds: float) -> None:
+    """
+    Sleeps without stalling the event loop of this thread: with a running
+    loop (consumer handlers, nest_asyncio) it keeps serving heartbeats
+    and other callbacks meanwhile
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        time.sleep(seconds)
+        return
+    loop.run_until_complete(asyncio.sleep(seconds))
+
+
+class AIMDLimiter:
+    """
+    Additive increase / multiplicative decrease ограничитель одновременных поисков.
+
+    Каждый быстрый успешный запрос увеличивает лимит на increase / limit
+    (то есть примерно +increase за "окно" запросов), но только если лимит
+    был занят целиком, иначе он ничего не проверил. Медленный запрос,
+    HTTP 429, таймаут или выброс на страницу логина умножает лимит на backoff.
+    """
+
+    def __init__(
+            self,
+            initial: float,
+            min_limit: float,
+            max_limit: float,
+            latency_target: float,
+            increase: float = 1.0,
+            backoff: float = 0.5,
+    ) -> None:
+        self.limit = float(initial)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.latency_target = latency_target
+        self.increase = increase
+        self.backoff = backoff
+
+        self.inflight = 0
+        self._cond = threading.Condition()
+        self._listeners: List[Callable[[int], None]] = []
+        self._publish()
+
+    def add_listener(self, callback: Callable[[int], None]) -> None:
+        """
+        callback(limit) is called when integer part of the limit changes,
+        e.g. to adjust consumer prefetch
+        """
+        self._listeners.append(callback)
+
+    def _publish(self) -> None:
+        metrics.set("limiter.limit", self.limit)
+        metrics.set("limiter.inflight", self.inflight)
+
+    def acquire(self, timeout: float = 0.0) -> bool:
+        """
+        Blocks the thread up to timeout, 0 only tries.
+        Threads of a running event loop should poll with timeout 0 instead
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.inflight += 1
+            self._publish()
+        return True
+
+    def release(self, latency: float, overloaded: bool = False) -> None:
+        with self._cond:
+            # a success under a limit nobody reached says nothing about a higher one
+            saturated = self.inflight >= int(self.limit)
+            self.inflight -= 1
+            before = int(self.limit)
+
+            if overloaded or latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            elif saturated:
+                self.limit = min(self.max_limit, self.limit + self.increase / max(self.limit, 1.0))
+
+            after = int(self.limit)
+            self._publish()
+            self._cond.notify_all()
+
+        if before != after:
+            logger.info(f"Concurrency limit changed {before} -> {after}")
+            for callback in self._listeners:
+                callback(after)
+
+    def cancel(self) -> None:
+        """
+        Frees the slot without a sample, for calls that never reached upstream
+        """
+        with self._cond:
+            self.inflight -= 1
+            self._publish()
+            self._cond.notify_all()
+
+
+class Slot:
+    def __init__(self) -> None:
+        self.overloaded = False
+
+    def mark_overloaded(self, reason: str) -> None:
+        logger.warning(f"Upstream overload detected: {reason}")
+        metrics.inc(f"limiter.overload.{reason}")
+        self.overloaded = True
+
+
+class AdaptiveLimiter:
+    """
+    Объединяет AIMD лимит одновременных поисков с глобальным
+    и потокенным бюджетом запросов в секунду.
+
+        with limiter.admit(token) as slot:
+            ...
+            if got_429:
+                slot.mark_overloaded("429")
+    """
+
+    def __init__(
+            self,
+            concurrency: AIMDLimiter,
+            global_rate: float,
+            token_rate: float,
+            admission_timeout: float,
+            proxies=None,
+    ):
+        self.concurrency = concurrency
+        self.admission_timeout = admission_timeout
+        self.token_rate = token_rate
+        # ProxyPool, budget of the proxy paired with the token is taken as well
+        self.proxies = proxies
+
+        self._global = TokenBucket(global_rate)
+        self._tokens: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _token_bucket(self, token: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._tokens.get(token)
+            if bucket is None:
+                bucket = self._tokens[token] = TokenBucket(self.token_rate)
+            return bucket
+
+    def _reserve_budget(self, token: Optional[str]) -> float:
+        buckets = [self._global]
+        if token:
+            buckets.append(self._token_bucket(token))
+            proxy = self.proxies.for_token(token) if self.proxies is not None else None
+            if proxy is not None:
+                buckets.append(proxy.bucket)
+
+        wait = reserve_all(buckets, self.admission_timeout)
+        if wait is None:
+            metrics.inc("limiter.rejected")
+            raise LimiterRejected("Rate budget exhausted")
+        if wait > 0:
+            metrics.observe("limiter.budget_wait", wait)
+        return wait
+
+    def forget_token(self, token: str) -> None:
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def _rejected_slot(self) -> LimiterRejected:
+        metrics.inc("limiter.rejected")
+        return LimiterRejected("No free concurrency slot")
+
+    def _finish(self, slot: Slot, start: float, error: Optional[BaseException]) -> None:
+        if isinstance(error, (asyncio.TimeoutError, TimeoutError)) and not slot.overloaded:
+            slot.mark_overloaded("timeout")
+        if error is not None and not slot.overloaded:
+            # cancelled, empty search, schema error and so on, says nothing about upstream load
+            self.concurrency.cancel()
+            return
+        self.concurrency.release(time.monotonic() - start, slot.overloaded)
+
+    @contextmanager
+    def admit(self, token: Optional[str] = None):
+        # polls, blocking on the condition would stop this thread's loop and its heartbeats
+        deadline = time.monotonic() + self.admission_timeout
+        while not self.concurrency.acquire():
+            if time.monotonic() >= deadline:
+                raise self._rejected_slot()
+            pause(ADMISSION_POLL_INTERVAL)
+
+        try:
+            wait = self._reserve_budget(token)
+            if wait > 0:
+                pause(wait)
+        except BaseException:
+            self.concurrency.cancel()
+            raise
+
+        slot = Slot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except BaseException as e:
+            self._finish(slot, start, e)
+            raise
+        self._finish(slot, start, None)
+
+    @asynccontextmanager
+    async def admit_async(self, token: Optional[str] = None):
+        """
+        admit for coroutines: waits for the slot and the budget with asyncio.sleep,
+        the loop keeps running. The slot is taken synchronously, a cancelled
+        wait never holds one
+        """
+        deadline = time.monotonic() + self.admission_timeout
+        while not self.concurrency.acquire():
+            if time.monotonic() >= deadline:
+                raise self._rejected_slot()
+            await asyncio.sleep(ADMISSION_POLL_INTERVAL)
+
+        try:
+            wait = self._reserve_budget(token)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        except BaseException:
+            self.concurrency.cancel()
+            raise
+
+        slot = Slot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except BaseException as e:
+            self._finish(slot, start, e)
+            raise
+        self._finish(slot, start, None)
+
+
+@asynccontextmanager
+async def unlimited():
+    """
+    admit_async stand in when there is no limiter
+    """
+    yield None
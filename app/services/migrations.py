@@ -0,0 +1,80 @@
+import zlib
+from typing import List, NamedTuple, Sequence, Set
+
+from loguru import logger
+
+from app.services.interfaces import BasicDBConnector
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: Sequence[str]
+
+
+class Migrator:
+    """
+    Применяет миграции по порядку и запоминает примененные версии
+    в отдельной таблице, поэтому можно безопасно вызывать при каждом старте.
+
+    Каждая миграция вместе с записью о ней идет одной транзакцией под локом,
+    поэтому упавшая миграция откатывается целиком, а реплики, стартующие
+    одновременно, применяют её по очереди и только один раз.
+
+    scope разделяет миграции разных таблиц (имя таблицы токенов настраивается).
+    """
+    def __init__(self, conn: BasicDBConnector, scope: str, table: str = "schema_migrations") -> None:
+        self.conn = conn
+        self.scope = scope
+        self.table = table
+        # pg_advisory_xact_lock key, stable between processes unlike hash()
+        self.lock_key = zlib.crc32(f"{table}:{scope}".encode())
+
+    async def _ensure_table(self) -> None:
+        async with self.conn.transaction(self.lock_key) as transaction:
+            await transaction.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                f"scope TEXT NOT NULL, version INTEGER NOT NULL, name TEXT, "
+                f"applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (scope, version));"
+            )
+
+    async def applied_versions(self) -> Set[int]:
+        records = await self.conn.fetchmany(f"SELECT version FROM {self.table} WHERE scope = $1", self.scope)
+        return {record.get("version") for record in records}
+
+    async def reset(self) -> None:
+        """
+        Забывает все примененные миграции scope, нужно после удаления таблицы
+        """
+        await self._ensure_table()
+        await self.conn.execute(f"DELETE FROM {self.table} WHERE scope = $1", self.scope)
+
+    async def migrate(self, migrations: Sequence[Migration]) -> List[int]:
+        await self._ensure_table()
+        applied = await self.applied_versions()
+
+        done = []
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version in applied:
+                continue
+
+            async with self.conn.transaction(self.lock_key) as transaction:
+                # another replica could apply it while this one was waiting for the lock
+                applied_now = await transaction.fetch(
+                    f"SELECT version FROM {self.table} WHERE scope = $1 AND version = $2",
+                    self.scope, migration.version,
+                )
+                if applied_now is not None:
+                    continue
+
+                logger.info(f"Applying migration {self.scope}#{migration.version}: {migration.name}")
+                for statement in migration.statements:
+                    await transaction.execute(statement)
+
+                await transaction.execute(
+                    f"INSERT INTO {self.table} (scope, version, name) VALUES ($1, $2, $3)",
+                    self.scope, migration.version, migration.name,
+                )
+            done.append(migration.version)
+
+        return done
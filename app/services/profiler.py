@@ -0,0 +1,215 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.consts import DEFAULT_PROFILE_DIR, DEFAULT_PROFILE_INTERVAL
+
+# header of broker messages which control the process instead of being a search job
+CONTROL_HEADER = "x-control"
+MAX_STACK_DEPTH = 128
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер, включается и выключается без рестарта.
+
+    Отдельный поток раз в interval секунд снимает стеки всех потоков
+    через sys._current_frames(), к стеку спереди добавляются имя потока
+    и текущие стадии (stage), например листенер из run_listeners.
+    Результат - collapsed stacks (frame;frame;frame count), их понимают
+    flamegraph.pl и speedscope.
+
+    В режиме start(jobs=N) профайлер сам останавливается после N задач
+    и дополнительно пишет отдельный файл на каждую задачу с её длительностью
+    в имени, так проще найти медленные.
+    """
+
+    def __init__(self, output_dir: str = DEFAULT_PROFILE_DIR, interval: float = DEFAULT_PROFILE_INTERVAL) -> None:
+        self.output_dir = output_dir
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self._stacks: Counter = Counter()
+        self._stages: Dict[int, List[str]] = {}
+        self._current_jobs: Dict[int, str] = {}
+        self._job_stacks: Dict[str, Counter] = {}
+        self._job_durations: Dict[str, float] = {}
+        self._jobs_limit = 0
+        self._jobs_done = 0
+        self._job_seq = 0
+        self._samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, jobs: int = 0) -> None:
+        """
+        :param jobs: stop after this many jobs, 0 means until stop()
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stacks = Counter()
+            self._job_stacks = {}
+            self._job_durations = {}
+            self._jobs_limit = jobs
+            self._jobs_done = 0
+            self._job_seq = 0
+            self._samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+
+        logger.info(f"Profiler started, interval {self.interval}s" + (f", next {jobs} jobs" if jobs else ""))
+
+    def stop(self) -> List[str]:
+        """
+        :return: paths of written collapsed stack files
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return []
+            self._thread = None
+
+        self._stop.set()
+        thread.join()
+        return self._write()
+
+    def toggle(self) -> None:
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Помечает сэмплы текущего потока стадией name, стадии вкладываются
+        """
+        if not self.running:
+            yield
+            return
+
+        stages = self._stages.setdefault(threading.get_ident(), [])
+        stages.append(name)
+        try:
+            yield
+        finally:
+            stages.pop()
+
+    @contextmanager
+    def job(self, name: str = "job"):
+        if not self.running:
+            yield
+            return
+
+        ident = threading.get_ident()
+        with self._lock:
+            self._job_seq += 1
+            job_id = f"{self._job_seq:04d}"
+            if self._jobs_limit:
+                self._job_stacks[job_id] = Counter()
+            self._current_jobs[ident] = job_id
+
+        start = time.perf_counter()
+        try:
+            with self.stage(name):
+                yield
+        finally:
+            with self._lock:
+                self._current_jobs.pop(ident, None)
+                self._job_durations[job_id] = time.perf_counter() - start
+                self._jobs_done += 1
+                done = bool(self._jobs_limit) and self._jobs_done >= self._jobs_limit
+            if done:
+                self.stop()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+
+        while not self._stop.wait(self.interval):
+            self._samples += 1
+
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.reverse()
+
+                key = ";".join([names.get(ident, str(ident)), *self._stages.get(ident, ()), *stack])
+                self._stacks[key] += 1
+
+                job_id = self._current_jobs.get(ident)
+                if job_id is not None and job_id in self._job_stacks:
+                    self._job_stacks[job_id][key] += 1
+
+    def _dump(self, name: str, stacks: Counter) -> str:
+        path = os.path.join(self.output_dir, name)
+        with open(path, "w", encoding="utf8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    def _write(self) -> List[str]:
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+
+        paths = [self._dump(f"profile_{stamp}.collapsed", self._stacks)]
+        for job_id, stacks in self._job_stacks.items():
+            duration = int(self._job_durations.get(job_id, 0) * 1000)
+            paths.append(self._dump(f"profile_{stamp}_job{job_id}_{duration}ms.collapsed", stacks))
+
+        logger.info(f"Profiler stopped, {self._samples} samples written to {paths[0]}")
+        return paths
+
+
+def handle_control(profiler: SamplingProfiler, properties, body: bytes) -> bool:
+    """
+    Обрабатывает управляющее сообщение с заголовком x-control: profile,
+    тело {"jobs": N} - профилировать следующие N задач, пустое - переключить профайлер
+
+    :return: True if the message was a control message
+    """
+    headers = getattr(properties, "headers", None) or {}
+    command = headers.get(CONTROL_HEADER)
+    if not command:
+        return False
+
+    if command != "profile":
+        logger.warning(f"Unknown control command: {command}")
+        return True
+
+    try:
+        jobs = int(json.loads(body or b"{}").get("jobs", 0))
+    except (ValueError, AttributeError):
+        logger.warning(f"Invalid profile command body: {body[:100]!r}")
+        return True
+
+    if jobs:
+        profiler.start(jobs=jobs)
+    else:
+        profiler.toggle()
+    return True
+
+
+profiler = SamplingProfiler()
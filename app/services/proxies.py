@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Any
+from urllib.parse import urlparse
+
+import aiohttp
+from loguru import logger
+
+from app.services.limiter import TokenBucket
+from app.services.metrics import metrics
+
+
+class Proxy:
+    def __init__(self, url: str, rate: float) -> None:
+        self.url = url
+        # for logs, without credentials
+        parsed = urlparse(url)
+        self.name = f"{parsed.scheme}://{parsed.hostname}:{parsed.port}"
+        self.bucket = TokenBucket(rate)
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until <= time.monotonic()
+
+    def __repr__(self) -> str:
+        return f"Proxy({self.name!r})"
+
+
+def parse_proxies(value: str) -> List[str]:
+    return [proxy.strip() for proxy in value.split(",") if proxy.strip()]
+
+
+class ProxyPool:
+    """
+    Пул прокси для браузера и HTTP клиента.
+
+    Каждый токен закрепляется за одним прокси (sticky), что бы сессия
+    не прыгала между IP. Новые токены достаются наименее занятому прокси.
+    После max_failures ошибок подряд прокси выключается на eject_time секунд,
+    его токены переезжают на другие. Проверка check() возвращает починившиеся
+    прокси раньше срока. У каждого прокси свой бюджет запросов в секунду (rate).
+    """
+
+    def __init__(
+            self,
+            urls: Sequence[str],
+            rate: float,
+            max_failures: int,
+            eject_time: float,
+            check_url: str,
+            check_timeout: float = 10.0,
+    ) -> None:
+        self.proxies = [Proxy(url, rate) for url in urls]
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.check_url = check_url
+        self.check_timeout = check_timeout
+
+        self._pairs: Dict[str, Proxy] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, proxy: Proxy) -> int:
+        return sum(1 for paired in self._pairs.values() if paired is proxy)
+
+    def pick(self) -> Optional[Proxy]:
+        """
+        Least loaded healthy proxy, None when all of them are ejected
+        """
+        with self._lock:
+            healthy = [proxy for proxy in self.proxies if proxy.healthy]
+            if not healthy:
+                return None
+            return min(healthy, key=self._load)
+
+    def for_token(self, token: str) -> Optional[Proxy]:
+        with self._lock:
+            proxy = self._pairs.get(token)
+            if proxy is not None and proxy.healthy:
+                return proxy
+
+            healthy = [proxy for proxy in self.proxies if proxy.healthy]
+            if not healthy:
+                if self.proxies:
+                    metrics.inc("proxies.exhausted")
+                    logger.warning("All proxies are ejected, going direct")
+                self._pairs.pop(token, None)
+                return None
+
+            proxy = self._pairs[token] = min(healthy, key=self._load)
+            logger.info(f"Token paired with proxy {proxy.name}")
+            return proxy
+
+    def release(self, token: str) -> None:
+        with self._lock:
+            self._pairs.pop(token, None)
+
+    def report(self, proxy: Optional[Proxy], ok: bool) -> None:
+        if proxy is None:
+            return
+
+        with self._lock:
+            if ok:
+                proxy.failures = 0
+                return
+
+            proxy.failures += 1
+            metrics.inc("proxies.failures")
+            if proxy.failures >= self.max_failures and proxy.healthy:
+                proxy.ejected_until = time.monotonic() + self.eject_time
+                metrics.inc("proxies.ejected")
+                logger.warning(f"Proxy {proxy.name} ejected for {self.eject_time}s after {proxy.failures} failures")
+        self._publish()
+
+    async def _check_one(self, session: aiohttp.ClientSession, proxy: Proxy) -> bool:
+        try:
+            async with session.get(self.check_url, proxy=proxy.url, allow_redirects=False) as response:
+                ok = response.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug(f"Proxy {proxy.name} health check failed: {e!r}")
+            ok = False
+
+        if ok and not proxy.healthy:
+            logger.info(f"Proxy {proxy.name} is back")
+            with self._lock:
+                proxy.ejected_until = 0.0
+        self.report(proxy, ok)
+        return ok
+
+    async def check(self) -> Dict[str, bool]:
+        """
+        Проверяет все прокси одним запросом к check_url через каждый
+        """
+        timeout = aiohttp.ClientTimeout(total=self.check_timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            results = await asyncio.gather(*(self._check_one(session, proxy) for proxy in self.proxies))
+        self._publish()
+        return {proxy.name: ok for proxy, ok in zip(self.proxies, results)}
+
+    async def run_checks(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.exception(f"Proxy health check crashed: {e!r}")
+
+    def _publish(self) -> None:
+        metrics.set("proxies.healthy", sum(1 for proxy in self.proxies if proxy.healthy))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "proxy": proxy.name,
+                    "healthy": proxy.healthy,
+                    "failures": proxy.failures,
+                    "tokens": self._load(proxy),
+                }
+                for proxy in self.proxies
+            ]
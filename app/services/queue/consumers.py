@@ -2,22 +2,147 @@ import abc
 import asyncio
 import contextvars
 import functools
+import random
 import threading
 import time
 from multiprocessing.pool import ThreadPool, CLOSE
-from typing import Union, List, Callable, Any
+from typing import Union, List, Callable, Any, Optional, Dict
 
 import pika
 from pika.adapters.asyncio_connection import AsyncioConnection
-from pika.exceptions import StreamLostError
+from pika.exceptions import StreamLostError, AMQPConnectionError
 from pika.exchange_type import ExchangeType
 from loguru import logger
 
+from app.consts import DEFAULT_RECONNECT_BASE_DELAY, DEFAULT_RECONNECT_MAX_DELAY
+from app.log import hot_logger, shorten
 from app.services.interfaces import ListenerType, BasicConsumer
-from app.services.helpers import run_listeners
+from app.services.breaker import CircuitOpenError, guard
+from app.services.exceptions import RepliesNotSent
+from app.services.helpers import run_listeners, run_coroutine
+from app.services.queue.retry import RetryTopology
+from app.services.idempotency import IdempotencyStore, ReplyRecorder, get_message_key, replay
+from app.services.metrics import metrics
+from app.services.profiler import profiler, handle_control
 
 
 DEFAULT_THREADS_COUNT = 1
+DEFAULT_CLOSE_THREAD_TIMEOUT = 30
+
+# timing of jobs from the main queue, lanes record under consumer.job.{lane}
+JOB_TIMING = "consumer.job"
+
+
+def process_message(
+        data: dict,
+        listeners: List[ListenerType],
+        body: Union[bytes, str],
+        properties: Optional[pika.BasicProperties] = None,
+        store: Optional[IdempotencyStore] = None,
+        requeued: Optional[Callable[[], bool]] = None,
+        timing: str = JOB_TIMING,
+        acknowledge: Optional[Callable[[bool], None]] = None,
+        dispatch: Optional[Callable[[Callable[[], None]], None]] = None,
+) -> None:
+    """
+    Runs listeners for a single message. If the message was already processed
+    (redelivery after crash or reconnect) stored replies are sent again instead.
+
+    requeued tells if drain already gave the message back to the queue,
+    then its replies are dropped and not stored: the redelivery answers it.
+    Duration is recorded under timing, per queue.
+
+    Replies are stored and acknowledge(ok) is called only once the publisher
+    has sent them, a batching publisher does it later from its own thread,
+    dispatch brings that step back to the consumer thread.
+    ok is False if the publisher dropped the replies.
+    """
+    with metrics.timed(timing), profiler.job():
+        _process_message(data, listeners, body, properties, store, requeued, acknowledge, dispatch)
+
+
+class RequeuedGate:
+    """
+    Прокси над паблишером, не отправляет ответы на сообщение
+    которое уже вернули в очередь, иначе при повторной доставке ответ задублируется
+    """
+
+    def __init__(self, publisher, requeued: Callable[[], bool]) -> None:
+        self.publisher = publisher
+        self.requeued = requeued
+
+    def send_message(self, *args, **kwargs):
+        if self.requeued():
+            metrics.inc("consumer.dropped_replies")
+            logger.warning("Message was requeued while being handled, dropping its reply")
+            return None
+        return self.publisher.send_message(*args, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self.publisher, item)
+
+
+def _when_sent(publisher, callback: Callable[[bool], None], dispatch=None) -> None:
+    if dispatch is not None:
+        on_sent = callback
+        callback = lambda ok: dispatch(functools.partial(on_sent, ok))
+    if publisher is None:
+        callback(True)
+    else:
+        publisher.when_sent(callback)
+
+
+def _process_message(data, listeners, body, properties, store, requeued=None, acknowledge=None, dispatch=None) -> None:
+    key = get_message_key(properties) if store else None
+    publisher = data.get("publisher")
+    sender = RequeuedGate(publisher, requeued) if requeued and publisher is not None else publisher
+    db_breaker = data.get("db_breaker")
+
+    if key:
+        try:
+            with profiler.stage("idempotency"), guard(db_breaker):
+                replies = run_coroutine(store.get(key))
+        except CircuitOpenError as e:
+            # store is down, handles the message without deduplication instead of waiting on it
+            logger.warning(f"Skipping idempotency check of {key}: {e}")
+            key, replies = None, None
+        if replies is not None:
+            logger.info(f"Message {key} was already processed, replaying {len(replies)} replies")
+            replay(sender, replies)
+            if acknowledge is not None:
+                _when_sent(publisher, acknowledge, dispatch)
+            return
+
+    recorder = ReplyRecorder(sender) if key and publisher is not None else None
+    data.update(body=body, properties=properties, publisher=recorder or sender)
+    try:
+        run_listeners(data=data, listeners=listeners)
+    finally:
+        data.update(publisher=publisher)
+
+    def on_sent(ok: bool) -> None:
+        # the message counts as processed only once its replies left the process
+        if ok and recorder is not None:
+            _store_replies(store, key, recorder, requeued, db_breaker)
+        if acknowledge is not None:
+            acknowledge(ok)
+
+    _when_sent(publisher, on_sent, dispatch)
+
+
+def _store_replies(store, key, recorder, requeued, db_breaker) -> None:
+    if requeued and requeued():
+        logger.warning(f"Message {key} was requeued by drain, its replies are not stored")
+        return
+
+    try:
+        with profiler.stage("idempotency"), guard(db_breaker):
+            run_coroutine(store.put(key, recorder.replies))
+    except CircuitOpenError as e:
+        logger.warning(f"Replies of {key} are not stored: {e}")
+    except Exception as e:
+        # replies are already sent, the message is acknowledged anyway
+        logger.opt(exception=e).error(f"Replies of {key} are not stored")
 
 
 # COPY PASTE FROM https://github.com/pika/pika/blob/main/examples/asyncio_consumer_example.py
@@ -62,6 +187,39 @@ class ExampleConsumer(BasicConsumer):
         # In production, experiment with higher prefetch values
         # for higher consumer throughput
         self._prefetch_count = 1
+        self._consume_callbacks: List[Callable[[], None]] = []
+
+        # delivery tag -> time handling started
+        self._inflight: Dict[int, float] = {}
+        # in-flight tags given back to the queue by drain before the handler finished
+        self._requeued: set = set()
+        self._handling: Optional[int] = None
+        # the handler of the current message acknowledges it itself, see defer_acknowledge
+        self._ack_deferred = False
+        self._thread_id = threading.get_ident()
+        self._draining = False
+        self._drain_deadline = 0.0
+
+    def reset(self):
+        """Forget the state of the previous connection, so run() can be
+        called again on the same object. Listeners and workflow data of
+        subclasses are kept untouched.
+
+        """
+        self.should_reconnect = False
+        self.was_consuming = False
+
+        self._connection = None
+        self._channel = None
+        self._closing = False
+        self._consumer_tag = None
+        self._consuming = False
+        self._inflight.clear()
+        self._requeued.clear()
+
+    def add_consume_callback(self, callback: Callable[[], None]):
+        """Register a callback invoked every time consumption (re)starts."""
+        self._consume_callbacks.append(callback)
 
     def connect(self):
         """This method connects to RabbitMQ, returning the connection handle.
@@ -121,6 +279,8 @@ class ExampleConsumer(BasicConsumer):
 
         """
         self._channel = None
+        # nothing left to cancel, so stop() must not wait for Basic.CancelOk
+        self._consuming = False
         if self._closing:
             self._connection.ioloop.stop()
         else:
@@ -267,6 +427,25 @@ class ExampleConsumer(BasicConsumer):
         self._channel.basic_qos(
             prefetch_count=self._prefetch_count, callback=self.on_basic_qos_ok)
 
+    def set_prefetch(self, prefetch_count: int):
+        """Change the prefetch at runtime. Safe to call from any thread.
+        Only for consumers handling several messages at once, URLConsumer
+        handles one and a higher prefetch just holds messages unacked.
+
+        :param int prefetch_count: New prefetch, at least 1
+
+        """
+        self._prefetch_count = max(1, prefetch_count)
+        if not self._connection or not self._channel or not self._channel.is_open:
+            return
+
+        def _apply():
+            if self._channel and self._channel.is_open:
+                self._channel.basic_qos(prefetch_count=self._prefetch_count)
+                logger.info(f'QOS changed to: {self._prefetch_count}')
+
+        self._connection.ioloop.call_soon_threadsafe(_apply)
+
     def on_basic_qos_ok(self, _unused_frame):
         """Invoked by pika when the Basic.QoS method has completed. At this
         point we will start consuming messages by calling start_consuming
@@ -295,6 +474,9 @@ class ExampleConsumer(BasicConsumer):
         self.was_consuming = True
         self._consuming = True
 
+        for callback in self._consume_callbacks:
+            callback()
+
     def add_on_cancel_callback(self):
         """Add a callback that will be invoked if RabbitMQ cancels the consumer
         for some reason. If RabbitMQ does cancel the consumer,
@@ -330,14 +512,41 @@ class ExampleConsumer(BasicConsumer):
         :param bytes body: The message body
 
         """
-        logger.info(
-            f'Received message # {basic_deliver.delivery_tag} from {properties.app_id}: {body}',
+        hot_logger.info(
+            f'Received message # {basic_deliver.delivery_tag} from {properties.app_id}: {shorten(body)}',
         )
-        self.handle_message(body)
-        self.acknowledge_message(basic_deliver.delivery_tag)
+        if self._draining:
+            # already prefetched, give it back to another replica
+            self.reject_message(basic_deliver.delivery_tag)
+            return
+
+        self._inflight[basic_deliver.delivery_tag] = time.monotonic()
+        self._handling = basic_deliver.delivery_tag
+        self._ack_deferred = False
+        try:
+            self.handle_message(body, properties)
+        except Exception as e:
+            if self.was_requeued(basic_deliver.delivery_tag):
+                self._requeued.discard(basic_deliver.delivery_tag)
+                logger.opt(exception=e).warning(f'Message {basic_deliver.delivery_tag} failed after drain requeued it')
+                return
+            self.on_message_error(basic_deliver.delivery_tag, body, properties, e)
+            return
+        finally:
+            self._handling = None
+        if not self._ack_deferred:
+            self.acknowledge_message(basic_deliver.delivery_tag)
+
+    def on_message_error(self, delivery_tag, body, properties, exc: Exception):
+        """Invoked when handle_message raised. The message is rejected
+        without requeue, otherwise it would be redelivered in a tight loop.
+
+        """
+        logger.opt(exception=exc).error(f'Failed to handle message {delivery_tag}')
+        self.reject_message(delivery_tag, requeue=False)
 
     @abc.abstractmethod
-    def handle_message(self, body: Union[bytes, str]) -> None:
+    def handle_message(self, body: Union[bytes, str], properties: Optional[pika.BasicProperties] = None) -> None:
         pass
 
     def acknowledge_message(self, delivery_tag):
@@ -347,9 +556,133 @@ class ExampleConsumer(BasicConsumer):
         :param int delivery_tag: The delivery tag from the Basic.Deliver frame
 
         """
-        logger.info(f'Acknowledging message {delivery_tag}', )
+        if self._inflight.pop(delivery_tag, None) is None and self._draining:
+            self._requeued.discard(delivery_tag)
+            logger.warning(f'Message {delivery_tag} was already rejected by drain')
+            return
+
+        if not self._channel or not self._channel.is_open:
+            # delivery tags are bound to the channel, the broker will
+            # redeliver this message to the consumer after reconnect
+            logger.warning(f'Channel is closed, message {delivery_tag} will be redelivered')
+            return
+
+        hot_logger.info(f'Acknowledging message {delivery_tag}', )
         self._channel.basic_ack(delivery_tag)
 
+    def reject_message(self, delivery_tag, requeue: bool = True):
+        """Negatively acknowledge the delivery, by default returning it
+        to the queue so another consumer can take it.
+
+        :param int delivery_tag: The delivery tag from the Basic.Deliver frame
+        :param bool requeue: Put the message back to the queue
+
+        """
+        self._inflight.pop(delivery_tag, None)
+        if not self._channel or not self._channel.is_open:
+            return
+
+        logger.info(f'Rejecting message {delivery_tag}, requeue: {requeue}')
+        self._channel.basic_nack(delivery_tag, requeue=requeue)
+
+    def defer_acknowledge(self, body, properties) -> Callable[[bool], None]:
+        """Called by handle_message, which then acknowledges the message
+        itself once its replies are published. If they were dropped the
+        message goes to on_message_error.
+
+        :return: callback(ok) acknowledging the message being handled
+
+        """
+        self._ack_deferred = True
+        return functools.partial(self.on_replies_sent, self._channel, self._handling, body, properties)
+
+    def on_replies_sent(self, channel, delivery_tag, body, properties, ok: bool):
+        if channel is not self._channel or delivery_tag not in self._inflight:
+            # drain gave it back or the channel was reopened (tags are bound to it), the broker redelivers it
+            self._requeued.discard(delivery_tag)
+            logger.warning(f'Message {delivery_tag} is no longer in flight, it will be redelivered')
+            return
+        if ok:
+            self.acknowledge_message(delivery_tag)
+        else:
+            self.on_message_error(delivery_tag, body, properties, RepliesNotSent(f'Replies to {delivery_tag} were dropped'))
+
+    def call_soon(self, callback: Callable[[], None]):
+        """Run callback on the consumer thread, the channel isn't thread safe.
+        Runs it right away when called from that thread.
+
+        """
+        if threading.get_ident() == self._thread_id or not self._connection:
+            callback()
+        else:
+            self._connection.ioloop.call_soon_threadsafe(callback)
+
+    def was_requeued(self, delivery_tag: Optional[int]) -> bool:
+        """True if drain gave the message back to the queue while
+        it was still being handled.
+
+        """
+        return delivery_tag in self._requeued
+
+    @property
+    def inflight_count(self) -> int:
+        return len(self._inflight)
+
+    @property
+    def prefetch_count(self) -> int:
+        return self._prefetch_count
+
+    @property
+    def consuming(self) -> bool:
+        return self._consuming
+
+    @property
+    def draining(self) -> bool:
+        return self._draining
+
+    def drain(self, timeout: float):
+        """Stop taking new deliveries, wait up to timeout seconds for
+        in-flight messages and requeue the ones that didn't finish, then
+        close the connection. Unlike stop() the consumer won't be reconnected.
+
+        Calling it again shortens the deadline to now.
+
+        :param float timeout: Seconds to wait for in-flight messages
+
+        """
+        self.should_reconnect = False
+        if self._draining:
+            logger.warning('Drain requested again, requeueing in-flight messages now')
+            self._drain_deadline = time.monotonic()
+            return
+
+        self._draining = True
+        self._drain_deadline = time.monotonic() + timeout
+        logger.info(f'Draining, waiting up to {timeout} seconds for {len(self._inflight)} in-flight messages')
+
+        if self._channel and self._consuming:
+            logger.info('Sending a Basic.Cancel RPC command to RabbitMQ')
+            self._channel.basic_cancel(self._consumer_tag)
+            self._consuming = False
+
+        if self._connection:
+            self._check_drained()
+
+    def _check_drained(self):
+        if self._inflight and time.monotonic() < self._drain_deadline:
+            self._connection.ioloop.call_later(0.1, self._check_drained)
+            return
+
+        for delivery_tag in list(self._inflight):
+            # the handler may still be running (nested loop), its replies
+            # must not go out after the message is redelivered
+            self._requeued.add(delivery_tag)
+            self.reject_message(delivery_tag)
+
+        logger.info('Drain complete')
+        self._closing = True
+        self.close_connection()
+
     def stop_consuming(self):
         """Tell RabbitMQ that you would like to stop consuming by sending the
         Basic.Cancel RPC command.
@@ -390,6 +723,7 @@ class ExampleConsumer(BasicConsumer):
         starting the IOLoop to block and allow the AsyncioConnection to operate.
 
         """
+        self._thread_id = threading.get_ident()
         self._connection = self.connect()
         self._connection.ioloop.run_forever()
 
@@ -419,28 +753,21 @@ class URLConsumer(ExampleConsumer):
     """
     Не умеет работать в многопоточном режиме.
     Является простым обработчиком оберткой для UrlHandler-а
+
+    Переживает переподключения: листенеры и workflow_data (драйвер и т.д.)
+    живут в самом объекте, setup листенеров вызывается один раз,
+    close - только в shutdown().
     """
-    _saved_data: dict
 
     def __init__(self, *args, **kwargs):
-        if not hasattr(self.__class__, "_saved_data"):
-            self.__class__._saved_data = {}
-
-        saved_data = self.__class__._saved_data
-
-        self._listeners: List[ListenerType] = saved_data.get(
-            "listeners", []
-        )
-        self._error_listeners: List[Callable] = saved_data.get(
-            "error_listeners", []
-        )
-        data = kwargs.pop("workflow_data", {})
-        if saved_data:
-            self.workflow_data = saved_data["workflow_data"]
-            self.workflow_data.update(data)
-        else:
-            self.workflow_data = data
-
+        self._listeners: List[ListenerType] = []
+        self._error_listeners: List[Callable] = []
+        self._started = False
+        self._idempotency_store: Optional[IdempotencyStore] = kwargs.pop("idempotency_store", None)
+        self._retry_topology: Optional[RetryTopology] = kwargs.pop("retry_topology", None)
+        self.job_timing: str = kwargs.pop("job_timing", JOB_TIMING)
+
+        self.workflow_data = kwargs.pop("workflow_data", {})
         self.workflow_data.update(data=self.workflow_data)
 
         super().__init__(*args, **kwargs)
@@ -451,35 +778,42 @@ class URLConsumer(ExampleConsumer):
     def emit_shutdown(self, workflow: dict):
         run_listeners(workflow, self._listeners, "close")
 
-    def handle_message(self, body: Union[bytes, str]) -> None:
-
-        logger.info(f"Handling body, with body: {body}")
+    def handle_message(self, body: Union[bytes, str], properties: Optional[pika.BasicProperties] = None) -> None:
 
-        self.workflow_data.update(body=body)
+        hot_logger.debug("Handling message")
+        if handle_control(profiler, properties, body):
+            return
 
-        run_listeners(data=self.workflow_data, listeners=self._listeners)
+        requeued = functools.partial(self.was_requeued, self._handling)
+        process_message(
+            self.workflow_data, self._listeners, body, properties, self._idempotency_store, requeued, self.job_timing,
+            self.defer_acknowledge(body, properties), self.call_soon,
+        )
 
-    def close_connection(self):
-        self.emit_shutdown(self.workflow_data)
+    def on_message_error(self, delivery_tag, body, properties, exc: Exception):
+        if not self._retry_topology or not self._channel or not self._channel.is_open:
+            return super().on_message_error(delivery_tag, body, properties, exc)
 
-        super().close_connection()
+        logger.opt(exception=exc).error(f'Failed to handle message {delivery_tag}')
+        self._retry_topology.republish(self._channel, body, properties, exc)
+        self.acknowledge_message(delivery_tag)
 
     def run(self):
-        self.emit_startup(self.workflow_data)
+        if not self._started:
+            self.emit_startup(self.workflow_data)
+            self._started = True
 
         super().run()
 
+    def shutdown(self):
+        """Final cleanup of listeners, call once the consumer won't be run again"""
+        if self._started:
+            self.emit_shutdown(self.workflow_data)
+            self._started = False
+
     def add_listener(self, listener: ListenerType):
         self._listeners.append(listener)
 
-    def reconnect(self):
-        self.__class__._saved_data = {
-            "listeners": self._listeners,
-            "error_listeners": self._error_listeners,
-            "workflow_data": self.workflow_data,
-        }
-        super().reconnect()
-
 
 class MultiThreadedConsumer(URLConsumer):
     """
@@ -562,11 +896,22 @@ class MultiThreadedConsumer(URLConsumer):
                 return
             logger.info("closing all threads")
 
-            # then it will apply to all threads, in hope they will accept it
-            # naive approach, but I wasn't able to find better solution.
-            self.submit_to_all_threads(self._close_thread, self._local)
+            # every worker blocks on the barrier until all of them took a task,
+            # so each thread gets exactly one _close_thread call
+            barrier = threading.Barrier(self._threads_count, timeout=DEFAULT_CLOSE_THREAD_TIMEOUT)
+            close = functools.partial(self._close_thread_after_barrier, barrier)
+            try:
+                self.submit_to_all_threads(close, self._local, chunk_size=1)
+            except threading.BrokenBarrierError:
+                logger.warning("Not every thread was closed in time")
 
             self._thread_pool_save.close()
+            self._thread_pool_save.join()
+
+    @classmethod
+    def _close_thread_after_barrier(cls, barrier: threading.Barrier, local):
+        barrier.wait()
+        cls._close_thread(local)
 
     @staticmethod
     def _close_thread(local):
@@ -576,67 +921,141 @@ class MultiThreadedConsumer(URLConsumer):
         run_listeners(data, listeners, "close")
 
     @staticmethod
-    def handle_message_in_thread(local, body):
+    def handle_message_in_thread(
+            local, body, properties=None, store=None, timing=JOB_TIMING, acknowledge=None, dispatch=None,
+    ):
         logger.info(f"Handling in {threading.get_ident()} Thread")
 
         data = local.workflow_data.get()
 
-        data.update(body=body)
-        run_listeners(data, local.listeners)
+        process_message(
+            data, local.listeners, body, properties, store, timing=timing, acknowledge=acknowledge, dispatch=dispatch,
+        )
+
+    def handle_message(self, body: Union[bytes, str], properties: Optional[pika.BasicProperties] = None) -> None:
+        if handle_control(profiler, properties, body):
+            return
 
-    def handle_message(self, body: Union[bytes, str]) -> None:
         self._thread_pool_save.apply(
             self.handle_message_in_thread,
-            (self._local, body),
+            (
+                self._local, body, properties, self._idempotency_store, self.job_timing,
+                self.defer_acknowledge(body, properties), self.call_soon,
+            ),
         )
 
 
 class ReconnectingURLConsumer:
-    """This is an example consumer that will reconnect if the nested
-    ExampleConsumer indicates that a reconnect is necessary.
+    """Supervisor which keeps the nested consumer alive.
+
+    When the consumer stops and indicates that a reconnect is necessary,
+    the same consumer object is reset and started again after an exponential
+    backoff with full jitter, so listeners and warm drivers survive broker
+    blips. Messages that weren't acked before the connection was lost are
+    redelivered by the broker to the resumed consumer.
 
     """
 
-    def __init__(self, amqp_url: str, consumer: ExampleConsumer, **kwargs):
-        self._reconnect_delay = 0
-        self._amqp_url = amqp_url
+    def __init__(
+            self,
+            consumer: URLConsumer,
+            base_delay: float = DEFAULT_RECONNECT_BASE_DELAY,
+            max_delay: float = DEFAULT_RECONNECT_MAX_DELAY,
+            max_tries: int = 0,
+    ):
+        """
+        :param consumer: consumer to supervise
+        :param base_delay: delay of the first retry, seconds
+        :param max_delay: upper bound of a single delay, seconds
+        :param max_tries: consecutive failed attempts before giving up, 0 is unlimited
+        """
         self._consumer = consumer
-        self._kwargs = kwargs
-        self._consumer_type = type(consumer)
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self.max_tries = max_tries
         self.tries = 0
-        self.max_tries = 2
 
-    def run(self):
-        while True:
-            try:
-                self._consumer.run()
-            except StreamLostError:
-                logger.error("Stream lost error, trying to reconnect!")
+        self.reconnects = 0
+        self.total_downtime = 0.0
+        self._down_since: Optional[float] = None
+        self._draining = False
+
+        consumer.add_consume_callback(self._on_consuming)
 
-                if self.tries > self.max_tries:
+    @property
+    def consumer(self) -> URLConsumer:
+        return self._consumer
+
+    def stats(self) -> dict:
+        current = time.monotonic() - self._down_since if self._down_since else 0.0
+        return {
+            "reconnects": self.reconnects,
+            "total_downtime": self.total_downtime + current,
+            "current_downtime": current,
+            "connected": self._down_since is None,
+        }
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    self._consumer.run()
+                except (StreamLostError, AMQPConnectionError) as e:
+                    logger.error(f"Connection to broker lost: {e!r}")
+                    self._consumer.should_reconnect = True
+                except KeyboardInterrupt:
                     self._consumer.stop()
                     break
 
-                self._maybe_reconnect()
+                if not self._consumer.should_reconnect or self._draining:
+                    break
 
-                self.tries += 1
-            finally:
-                self._consumer.stop()
-                break
+                if not self._maybe_reconnect():
+                    break
+        finally:
+            self._consumer.shutdown()
+
+    def drain(self, timeout: float):
+        """Gracefully stop: no more reconnects, in-flight messages are
+        finished or requeued within timeout, see ExampleConsumer.drain"""
+        self._draining = True
+        self._consumer.drain(timeout)
+
+    def _on_consuming(self):
+        if self._down_since is not None:
+            downtime = time.monotonic() - self._down_since
+            self.total_downtime += downtime
+            self._down_since = None
 
-    def _maybe_reconnect(self):
-        if self._consumer.should_reconnect:
-            self._consumer.stop()
-            reconnect_delay = self._get_reconnect_delay()
-            logger.info(f'Reconnecting after {reconnect_delay} seconds')
-            time.sleep(reconnect_delay)
-            self._consumer = self._consumer_type(self._amqp_url, **self._kwargs)
+            metrics.observe("amqp.downtime", downtime)
+            logger.info(f"Consumption resumed after {downtime:.1f} seconds")
+
+        metrics.set("amqp.connected", 1)
+
+    def _maybe_reconnect(self) -> bool:
+        if self._down_since is None:
+            self._down_since = time.monotonic()
+        metrics.set("amqp.connected", 0)
 
-    def _get_reconnect_delay(self):
         if self._consumer.was_consuming:
-            self._reconnect_delay = 1
-        else:
-            self._reconnect_delay += 1
-        if self._reconnect_delay > 30:
-            self._reconnect_delay = 30
-        return self._reconnect_delay
+            # connection was healthy before, start backoff from scratch
+            self.tries = 0
+        self.tries += 1
+
+        if self.max_tries and self.tries > self.max_tries:
+            raise AMQPConnectionError(f"Gave up reconnecting after {self.max_tries} tries")
+
+        reconnect_delay = self._get_reconnect_delay()
+        logger.info(f'Reconnecting after {reconnect_delay:.1f} seconds, try #{self.tries}')
+        time.sleep(reconnect_delay)
+        if self._draining:
+            return False
+
+        self.reconnects += 1
+        metrics.inc("amqp.reconnects")
+        self._consumer.reset()
+        return True
+
+    def _get_reconnect_delay(self) -> float:
+        ceiling = min(self._max_delay, self._base_delay * 2 ** (self.tries - 1))
+        return random.uniform(0, ceiling)
@@ -2,16 +2,21 @@ import asyncio
 import functools
 import json
 import ssl
+import threading
 import time
 from enum import Enum
-from typing import Dict
-from typing import Optional
+from typing import Dict, List, Callable, Union
+from typing import Optional, Tuple
 
 from loguru import logger
 from pydantic import BaseModel, validator
 
 import pika
-from pika.exceptions import AMQPConnectionError
+from pika.exceptions import AMQPConnectionError, AMQPError
+
+from app.consts import DEFAULT_REPLY_PUBLISH_TRIES
+from app.log import hot_logger, shorten
+from app.services.metrics import metrics
 
 
 def sync(f):
@@ -82,8 +87,13 @@ class BasicPikaClient:
             ssl_context.set_ciphers("ECDHE+AESGCM:!ECDSA")
             self.parameters._ssl_options = pika.SSLOptions(context=ssl_context)
 
+    def is_connected(self) -> bool:
+        connection = getattr(self, "connection", None)
+        channel = getattr(self, "channel", None)
+        return bool(connection and connection.is_open and channel and channel.is_open)
+
     def check_connection(self):
-        if not self.connection or self.connection.is_closed:
+        if not self.is_connected():
             self.connect()
 
     def close(self):
@@ -95,7 +105,7 @@ class BasicPikaClient:
         logger.info("Sender connection closed")
 
     def declare_queue(
-        self, queue_name, exclusive: bool = False, max_priority: int = 10
+        self, queue_name, exclusive: bool = False, max_priority: int = 10, arguments: Optional[Dict] = None
     ):
         self.check_connection()
         logger.debug(f"Trying to declare queue({queue_name})...")
@@ -105,7 +115,7 @@ class BasicPikaClient:
             durable=True,
             auto_delete=False,
             passive=False,
-            arguments={"x-max-priority": max_priority},
+            arguments={"x-max-priority": max_priority, **(arguments or {})},
         )
 
     def declare_exchange(self, exchange_name: str, exchange_type: str = "direct"):
@@ -131,6 +141,12 @@ class BasicPikaClient:
 
 
 class BasicMessageSender(BasicPikaClient):
+    def flush(self):
+        """Pushes buffered frames to the broker, call before close on shutdown"""
+        connection = getattr(self, "connection", None)
+        if connection and connection.is_open:
+            connection.process_data_events(time_limit=0)
+
     def send_message(
         self,
         body: Dict,
@@ -142,22 +158,262 @@ class BasicMessageSender(BasicPikaClient):
             exchange_name = self.exchange
         if not routing_key:
             routing_key = self.routing
-        body = bytes(json.dumps(body), 'utf8')
+        self.publish(bytes(json.dumps(body), 'utf8'), headers, exchange_name, routing_key)
+
+    def when_sent(self, callback: Callable[[bool], None]):
+        """callback(True) once the replies sent so far are published, right away here"""
+        callback(True)
+
+    def publish(self, body: bytes, headers: Optional[Headers], exchange_name: str, routing_key: str):
+        if not self.channel.is_open or self.connection.is_closed:
+            logger.error("RETURN CHANNEL UNEXPECTEDLY CLOSED BY PEER, TRY TO INCREASE HEARTBEAT")
+            # reconnects and publishes anyway, so reply isn't lost
+            self.check_connection()
+
         if self.channel.is_open:
-            self.channel.basic_publish(
-                exchange=exchange_name,
-                routing_key=routing_key,
-                body=body,
-                properties=pika.BasicProperties(
-                    delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
-                    priority=headers.priority.value if headers else None,
-                    headers=headers.dict() if headers else None,
-                    content_type="application/json",
-                ),
-            )
-            logger.info(
-                f"Sent message. Exchange: {exchange_name}, Routing Key: {routing_key}, Body: {body[:128]}"
-            )
+            self._basic_publish(body, headers, exchange_name, routing_key)
         else:
+            logger.error(f"Message to {exchange_name} wasn't sent, channel is closed")
+
+    def _basic_publish(self, body: bytes, headers: Optional[Headers], exchange_name: str, routing_key: str):
+        self.channel.basic_publish(
+            exchange=exchange_name,
+            routing_key=routing_key,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+                priority=headers.priority.value if headers else None,
+                headers=headers.dict() if headers else None,
+                content_type="application/json",
+            ),
+        )
+        hot_logger.info(
+            f"Sent message. Exchange: {exchange_name}, Routing Key: {routing_key}, Body: {shorten(body, 128)}"
+        )
+
+
+class _Reply:
+    __slots__ = ("queued_at", "body", "headers", "exchange_name", "routing_key", "tries", "sent")
+
+    def __init__(self, body: bytes, headers: Optional[Headers], exchange_name: str, routing_key: str) -> None:
+        self.queued_at = time.monotonic()
+        self.body = body
+        self.headers = headers
+        self.exchange_name = exchange_name
+        self.routing_key = routing_key
+        self.tries = 0
+        self.sent = False
+
+
+class _Barrier:
+    """Callback of when_sent, fired once every reply queued before it is published"""
+    __slots__ = ("callback",)
+
+    def __init__(self, callback: Callable[[bool], None]) -> None:
+        self.callback = callback
+
+
+class BatchingMessageSender(BasicMessageSender):
+    """
+    Копит ответы до batch_size штук или batch_window секунд и публикует
+    их одной пачкой, обработчик на горячем пути только кладет ответ в буфер.
+    Роутинг и Headers у каждого сообщения свои, порядок сохраняется.
+
+    Канал blocking соединения не потокобезопасен, поэтому все обращения
+    к нему (пачка по таймеру, по размеру, flush, close) идут под одним локом.
+
+    С confirms=True пачка публикуется одной транзакцией: tx_commit ждет брокера
+    один раз на пачку (confirm_delivery у blocking канала ждал бы каждое сообщение),
+    при ошибке пачка целиком уходит в следующее окно. Пачка, которую не удалось
+    опубликовать max_tries раз, выбрасывается, when_sent получает False.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        queue: str,
+        exchange: str,
+        routing: str,
+        batch_window: float,
+        batch_size: int,
+        confirms: bool = False,
+        max_tries: int = DEFAULT_REPLY_PUBLISH_TRIES,
+    ):
+        super().__init__(url, queue, exchange, routing)
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.confirms = confirms
+        self.max_tries = max_tries
+
+        self._buffer: List[Union[_Reply, _Barrier]] = []
+        self._buffered_replies = 0
+        # a batch was taken from the buffer and isn't published yet
+        self._publishing = False
+        self._buffer_lock = threading.Lock()
+        self._channel_lock = threading.RLock()
+        self._timer: Optional[threading.Timer] = None
+
+    def setup(self):
+        super().setup()
+        if self.confirms:
+            self.channel.tx_select()
+
+    def check_connection(self):
+        with self._channel_lock:
+            super().check_connection()
+
+    def send_message(
+        self,
+        body: Dict,
+        headers: Optional[Headers] = None,
+        exchange_name: str = None,
+        routing_key: str = None,
+    ):
+        reply = _Reply(
+            bytes(json.dumps(body), 'utf8'),
+            headers,
+            exchange_name or self.exchange,
+            routing_key or self.routing,
+        )
+        with self._buffer_lock:
+            self._buffer.append(reply)
+            self._buffered_replies += 1
+            full = self._buffered_replies >= self.batch_size
+            if not full:
+                self._schedule()
+
+        if full:
+            self._publish_batch()
+
+    def when_sent(self, callback: Callable[[bool], None]):
+        """
+        callback(True) once every reply sent so far is published (and committed with confirms),
+        callback(False) if they were dropped. Called from the thread that published the batch.
+        """
+        with self._buffer_lock:
+            waiting = bool(self._buffer) or self._publishing
+            if waiting:
+                self._buffer.append(_Barrier(callback))
+                self._schedule()
+        if not waiting:
+            callback(True)
+
+    def _schedule(self):
+        # under _buffer_lock
+        if self._timer is None:
+            self._timer = threading.Timer(self.batch_window, self._publish_batch)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _publish_batch(self):
+        with self._channel_lock:
+            with self._buffer_lock:
+                batch, self._buffer = self._buffer, []
+                self._buffered_replies = 0
+                self._publishing = bool(batch)
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not batch:
+                return
+
+            replies = [item for item in batch if isinstance(item, _Reply)]
+            try:
+                self._publish_all(replies)
+            except AMQPError as e:
+                done = self._retry(batch, e)
+            else:
+                done = [(item, True) for item in batch if isinstance(item, _Barrier)]
+            finally:
+                with self._buffer_lock:
+                    self._publishing = False
+
+        for barrier, ok in done:
+            barrier.callback(ok)
+
+    def _publish_all(self, replies: List[_Reply]):
+        if not replies:
+            return
+
+        metrics.observe("replies.batch.wait", time.monotonic() - replies[0].queued_at)
+        with metrics.timed("replies.batch.publish"):
             self.check_connection()
-            logger.error("RETURN CHANNEL UNEXPECTEDLY CLOSED BY PEER, TRY TO INCREASE HEARTBEAT")
+            for reply in replies:
+                reply.tries += 1
+                self._basic_publish(reply.body, reply.headers, reply.exchange_name, reply.routing_key)
+                # without a transaction every publish is final
+                reply.sent = not self.confirms
+            if self.confirms:
+                self.channel.tx_commit()
+                for reply in replies:
+                    reply.sent = True
+            BasicMessageSender.flush(self)
+
+        metrics.inc("replies.batches")
+        metrics.inc("replies.batched", len(replies))
+        metrics.set("replies.batch.size", len(replies))
+
+    def _retry(self, batch, error: AMQPError) -> List[Tuple[_Barrier, bool]]:
+        """
+        Puts back what wasn't published in front of newer replies, barriers included, for the next window.
+        After max_tries the batch is dropped, its barriers are returned to be failed.
+        """
+        pending = [item for item in batch if not getattr(item, "sent", False)]
+        replies = [item for item in pending if isinstance(item, _Reply)]
+        if self.confirms and self.is_connected():
+            # the channel survived, uncommitted publishes must not go out with the next batch
+            try:
+                self.channel.tx_rollback()
+            except AMQPError:
+                pass
+
+        if any(reply.tries >= self.max_tries for reply in replies):
+            logger.error(f"Dropping {len(replies)} replies after {self.max_tries} failed publishes: {error!r}")
+            for reply in replies:
+                logger.error(f"Dropped reply to {reply.routing_key}: {shorten(reply.body, 128)}")
+            metrics.inc("replies.dropped", len(replies))
+            return [(item, False) for item in pending if isinstance(item, _Barrier)]
+
+        logger.error(f"Reply batch publish failed, {len(replies)} replies are retried: {error!r}")
+        with self._buffer_lock:
+            self._buffer[:0] = pending
+            self._buffered_replies += len(replies)
+            self._schedule()
+        return []
+
+    def flush(self):
+        self._publish_batch()
+        with self._channel_lock:
+            super().flush()
+
+    def close(self):
+        self._publish_batch()
+        with self._buffer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        with self._channel_lock:
+            super().close()
+
+
+class QueueInspector(BasicPikaClient):
+    """
+    Читает длину очереди passive queue_declare, сам ничего не объявляет:
+    повторный declare с другими аргументами брокер отклоняет
+    """
+
+    def setup(self):
+        pass
+
+    def queue_depth(self, queue_name: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        """
+        :return: (ready messages, consumers) or None when the broker is unreachable
+        """
+        try:
+            self.check_connection()
+            frame = self.channel.queue_declare(queue=queue_name or self.queue, passive=True)
+        except AMQPError as e:
+            # channel is closed by the broker on error, check_connection reopens it next time
+            logger.warning(f"Can't read depth of {queue_name or self.queue}: {e!r}")
+            return None
+        return frame.method.message_count, frame.method.consumer_count
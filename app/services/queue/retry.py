@@ -0,0 +1,113 @@
+from typing import Sequence, Optional, List
+
+import pika
+from loguru import logger
+
+from app.services.exceptions import PoisonMessageException
+from app.services.metrics import metrics
+from app.services.queue.publisher import BasicPikaClient
+
+
+class RetryTopology(BasicPikaClient):
+    """
+    Очереди для отложенных повторов и dead letter очередь.
+
+    Для каждой попытки своя очередь {queue}.retry.{n} с x-message-ttl,
+    по истечении ttl брокер возвращает сообщение в основной exchange
+    (x-dead-letter-exchange), добавляя запись в заголовок x-death.
+    По x-death считается сколько попыток уже было, после последней
+    сообщение паркуется в {queue}.dlq.
+
+        main queue --fail--> retry.0 (5s) --ttl--> main queue --fail--> retry.1 (30s) ... --> dlq
+    """
+
+    def __init__(self, url: str, queue: str, exchange: str, routing: str, delays: Sequence[float]):
+        super().__init__(url, queue=queue, exchange=exchange, routing=routing)
+
+        self.delays = list(delays)
+        self.retry_exchange = f"{exchange}.retry"
+        self.dead_letter_queue = f"{queue}.dlq"
+
+    def retry_queue(self, attempt: int) -> str:
+        return f"{self.queue}.retry.{attempt}"
+
+    def setup(self):
+        logger.info(f"Declaring retry topology for {self.queue}, delays: {self.delays}")
+
+        self.declare_exchange(self.retry_exchange)
+
+        for attempt, delay in enumerate(self.delays):
+            queue_name = self.retry_queue(attempt)
+            self.declare_queue(queue_name, arguments={
+                "x-message-ttl": int(delay * 1000),
+                "x-dead-letter-exchange": self.exchange,
+                "x-dead-letter-routing-key": self.routing,
+            })
+            self.bind_queue(self.retry_exchange, queue_name, queue_name)
+
+        self.declare_queue(self.dead_letter_queue)
+        self.bind_queue(self.retry_exchange, self.dead_letter_queue, self.dead_letter_queue)
+
+    def attempts(self, properties: Optional[pika.BasicProperties]) -> int:
+        """
+        Сколько раз сообщение уже прошло через очереди повторов, по x-death
+        """
+        headers = (properties.headers if properties else None) or {}
+        retry_queues = {self.retry_queue(attempt) for attempt in range(len(self.delays))}
+
+        attempts = 0
+        for death in headers.get("x-death") or []:
+            if death.get("queue") in retry_queues:
+                attempts += int(death.get("count", 1))
+        # own counter is a fallback for brokers which drop client supplied x-death
+        return max(attempts, int(headers.get("x-retry-count", 0)))
+
+    def route_failure(self, properties: Optional[pika.BasicProperties], exc: BaseException) -> str:
+        """
+        Routing key in retry exchange for the failed message
+        """
+        if isinstance(exc, PoisonMessageException):
+            return self.dead_letter_queue
+
+        attempt = self.attempts(properties)
+        if attempt >= len(self.delays):
+            return self.dead_letter_queue
+        return self.retry_queue(attempt)
+
+    def republish(self, channel, body: bytes, properties: Optional[pika.BasicProperties], exc: BaseException) -> str:
+        """
+        Публикует упавшее сообщение в очередь повтора или в DLQ через канал консьюмера,
+        после этого оригинал можно подтверждать.
+
+        :return: name of the queue message was sent to
+        """
+        routing_key = self.route_failure(properties, exc)
+
+        properties = properties or pika.BasicProperties()
+        headers = dict(properties.headers or {})
+        headers.update({
+            "x-last-error": f"{exc.__class__.__name__}: {exc}"[:512],
+            "x-retry-count": self.attempts(properties) + 1,
+        })
+        properties.headers = headers
+        properties.delivery_mode = pika.spec.PERSISTENT_DELIVERY_MODE
+
+        channel.basic_publish(
+            exchange=self.retry_exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=properties,
+        )
+
+        if routing_key == self.dead_letter_queue:
+            metrics.inc("queue.dead_lettered")
+            logger.error(f"Message parked in {routing_key}: {exc!r}")
+        else:
+            metrics.inc("queue.retried")
+            logger.warning(f"Message sent to {routing_key} for retry: {exc!r}")
+
+        return routing_key
+
+
+def parse_delays(value: str) -> List[float]:
+    return [float(delay) for delay in value.split(",") if delay.strip()]
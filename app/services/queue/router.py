@@ -0,0 +1,129 @@
+import asyncio
+import threading
+from typing import Dict, List, Tuple, Callable, Awaitable, Optional
+
+from loguru import logger
+
+from app.services.queue.consumers import ReconnectingURLConsumer
+
+# builds a lane worker inside its own thread and event loop,
+# returns the consumer and a coroutine function which releases its resources
+WorkerFactory = Callable[[], Awaitable[Tuple[ReconnectingURLConsumer, Callable[[], Awaitable[None]]]]]
+
+DEFAULT_JOIN_TIMEOUT = 5.0
+
+
+def parse_lanes(value: str) -> Dict[str, int]:
+    """
+    "auth,gamepass:2" -> {"auth": 1, "gamepass": 2}, число - количество воркеров
+    """
+    lanes = {}
+    for item in value.split(","):
+        name, _, workers = item.strip().partition(":")
+        if name:
+            lanes[name] = int(workers) if workers else 1
+    return lanes
+
+
+def lane_queue(queue: str, lane: str) -> str:
+    return f"{queue}.{lane}"
+
+
+class LaneRouter:
+    """
+    Несколько очередей (lanes) в одном процессе.
+
+    Основная очередь поиска работает в главном потоке как раньше.
+    Каждый воркер остальных lanes - отдельный поток со своим event loop,
+    своим соединением к брокеру, своей цепочкой листенеров, БД и publisher-ом,
+    так что медленные задачи одной очереди не держат поиск. Количество
+    воркеров lane - её бюджет одновременных задач.
+    """
+
+    def __init__(self, main: ReconnectingURLConsumer, drain_timeout: float) -> None:
+        self.main = main
+        self.drain_timeout = drain_timeout
+
+        self._lanes: List[Tuple[str, int, WorkerFactory]] = []
+        self._workers: List[Tuple[str, asyncio.AbstractEventLoop, ReconnectingURLConsumer]] = []
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._drain: Optional[float] = None
+
+    def add_lane(self, name: str, factory: WorkerFactory, workers: int = 1) -> None:
+        self._lanes.append((name, workers, factory))
+
+    def _run_worker(self, name: str, factory: WorkerFactory) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            consumer, cleanup = loop.run_until_complete(factory())
+        except Exception as e:
+            logger.exception(f"Failed to start {name} lane worker: {e!r}")
+            loop.close()
+            return
+
+        with self._lock:
+            self._workers.append((name, loop, consumer))
+            stopped = self._drain is not None
+
+        try:
+            if not stopped:
+                consumer.run()
+        except Exception as e:
+            logger.exception(f"Lane {name} worker crashed: {e!r}")
+        finally:
+            loop.run_until_complete(cleanup())
+            loop.close()
+            logger.info(f"Lane {name} worker stopped")
+
+    def drain(self, timeout: float) -> None:
+        """
+        Drain всех lanes, консьюмеры других потоков дергаются через их event loop
+        """
+        self.main.drain(timeout)
+        self._drain_workers(timeout)
+
+    def _drain_workers(self, timeout: float) -> None:
+        with self._lock:
+            self._drain = timeout
+            workers = list(self._workers)
+
+        for name, loop, consumer in workers:
+            try:
+                loop.call_soon_threadsafe(consumer.drain, timeout)
+            except RuntimeError:
+                # worker has already stopped and closed its loop
+                pass
+
+    def run(self) -> None:
+        for name, workers, factory in self._lanes:
+            for number in range(workers):
+                thread = threading.Thread(
+                    target=self._run_worker,
+                    args=(name, factory),
+                    name=f"lane-{name}-{number}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Lane {name} started with {workers} workers")
+
+        try:
+            self.main.run()
+        finally:
+            if self._drain is None:
+                self._drain_workers(self.drain_timeout)
+            for thread in self._threads:
+                thread.join(self.drain_timeout + DEFAULT_JOIN_TIMEOUT)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            workers = list(self._workers)
+
+        stats = {"main": self.main.stats()}
+        numbers: Dict[str, int] = {}
+        for name, _, consumer in workers:
+            number = numbers[name] = numbers.get(name, -1) + 1
+            stats[f"{name}.{number}"] = consumer.stats()
+        return stats
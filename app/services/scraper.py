@@ -0,0 +1,52 @@
+from typing import List
+
+import pydantic
+from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from app.consts import ROBLOX_SEARCH_LOGIN_SELECTOR, ROBLOX_SEARCH_NICKNAME_SELECTOR
+from app.errors import ScrapeSchemaError
+from app.schemas import SearchResponse
+
+# pairs logins and nicknames the same way zip() over two find_elements did,
+# innerText matches WebElement.text for visible elements
+SEARCH_RESULTS_SCRIPT = """
+const logins = document.querySelectorAll(arguments[0]);
+const nicknames = document.querySelectorAll(arguments[1]);
+const size = Math.min(logins.length, nicknames.length);
+const result = [];
+for (let i = 0; i < size; i++) {
+    result.push({login: logins[i].innerText.trim(), nickname: nicknames[i].innerText.trim()});
+}
+return result;
+"""
+
+
+def scrape_search_results(driver: WebDriver) -> List[SearchResponse]:
+    """
+    Собирает все карточки результатов поиска одним execute_script,
+    вместо двух find_elements и запроса .text на каждый элемент
+
+    :raises ScrapeSchemaError: when the page returned something unexpected
+    """
+    raw = driver.execute_script(SEARCH_RESULTS_SCRIPT, ROBLOX_SEARCH_LOGIN_SELECTOR, ROBLOX_SEARCH_NICKNAME_SELECTOR)
+    if not isinstance(raw, list):
+        raise ScrapeSchemaError(f"Expected list of cards, got {type(raw).__name__}")
+
+    try:
+        return [SearchResponse(**card) for card in raw]
+    except (TypeError, pydantic.ValidationError) as e:
+        raise ScrapeSchemaError(f"Unexpected card format: {e}") from e
+
+
+def scrape_search_results_by_elements(driver: WebDriver) -> List[SearchResponse]:
+    """
+    Старый способ, по запросу к драйверу на каждый элемент. Оставлен для бенчмарка
+    """
+    logins = driver.find_elements(by=By.CSS_SELECTOR, value=ROBLOX_SEARCH_LOGIN_SELECTOR)
+    nicknames = driver.find_elements(by=By.CSS_SELECTOR, value=ROBLOX_SEARCH_NICKNAME_SELECTOR)
+
+    return [
+        SearchResponse(login=login.text, nickname=nickname.text)
+        for login, nickname in zip(logins, nicknames)
+    ]
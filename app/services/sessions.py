@@ -0,0 +1,202 @@
+import asyncio
+import os
+from hashlib import sha256
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+import aiohttp
+import pydantic
+from cryptography.fernet import Fernet, InvalidToken
+from loguru import logger
+
+from app.consts import ROBLOX_AUTHENTICATED_URL, ROBLOX_TOKEN_KEY, TOKEN_FAILURE_COOLDOWN
+from app.errors import LoginFailed
+from app.repos import TokenRepository
+from app.services.breaker import CircuitBreaker, guard
+from app.services.driver import convert_browser_cookies_to_aiohttp
+from app.services.proxies import ProxyPool
+
+
+class SessionSnapshot(pydantic.BaseModel):
+    token: str
+    cookies: List[Dict[str, Any]]
+    csrf_token: Optional[str] = None
+
+
+class SessionStore:
+    """
+    Снимки авторизованной сессии (cookies браузера и CSRF токен) на диске,
+    по файлу на токен, зашифрованы Fernet ключом.
+    Снимки старше ttl секунд не расшифровываются и удаляются.
+    """
+
+    def __init__(self, directory: str, key: str, ttl: float) -> None:
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self._fernet = Fernet(key)
+
+    def _path(self, token: str) -> Path:
+        # file name must not leak the token itself
+        return self.directory / f"{sha256(token.encode()).hexdigest()[:32]}.session"
+
+    def save(self, snapshot: SessionSnapshot) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        path = self._path(snapshot.token)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(self._fernet.encrypt(snapshot.json().encode()))
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, path)
+
+        logger.debug(f"Session snapshot saved to {path.name}")
+
+    def _read(self, path: Path) -> Optional[SessionSnapshot]:
+        try:
+            raw = self._fernet.decrypt(path.read_bytes(), ttl=int(self.ttl))
+            return SessionSnapshot.parse_raw(raw)
+        except (OSError, InvalidToken, pydantic.ValidationError) as e:
+            # expired, written with another key or broken
+            logger.info(f"Dropping unusable session snapshot {path.name}: {e!r}")
+            path.unlink(missing_ok=True)
+            return None
+
+    def load(self, token: str) -> Optional[SessionSnapshot]:
+        path = self._path(token)
+        if not path.exists():
+            return None
+        return self._read(path)
+
+    def latest(self) -> Optional[SessionSnapshot]:
+        """
+        Самый свежий читаемый снимок, None если таких нет
+        """
+        if not self.directory.is_dir():
+            return None
+
+        paths = sorted(self.directory.glob("*.session"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in paths:
+            snapshot = self._read(path)
+            if snapshot is not None:
+                return snapshot
+        return None
+
+    def delete(self, token: str) -> None:
+        self._path(token).unlink(missing_ok=True)
+
+
+def save_csrf_token(store: SessionStore, csrf) -> None:
+    """
+    Дописывает последний CSRF токен в самый свежий снимок, что бы после рестарта
+    первый POST не получал 403
+    """
+    snapshot = store.latest()
+    if snapshot is None:
+        return
+    csrf_token = csrf.get(snapshot.token)
+    if csrf_token and csrf_token != snapshot.csrf_token:
+        store.save(snapshot.copy(update={"csrf_token": csrf_token}))
+
+
+async def probe_session(cookies: List[Dict[str, Any]], timeout: float = 5.0, proxy: Optional[str] = None) -> bool:
+    """
+    Дешевая проверка что cookies еще авторизованы, один HTTP запрос без браузера
+    """
+    jar = convert_browser_cookies_to_aiohttp(cookies)
+    try:
+        async with aiohttp.ClientSession(cookies=jar, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            async with session.get(ROBLOX_AUTHENTICATED_URL, proxy=proxy, allow_redirects=False) as response:
+                return response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"Session probe failed: {e!r}")
+        return False
+
+
+async def restore_session(
+        token_service: TokenRepository,
+        session_store: SessionStore,
+        proxies: Optional[ProxyPool] = None,
+        db_breaker: Optional[CircuitBreaker] = None,
+) -> Optional[SessionSnapshot]:
+    """
+    Последний снимок, если его токен еще активен и cookies проходят проверку,
+    иначе None, негодный снимок удаляется
+    """
+    snapshot = session_store.latest()
+    if snapshot is None:
+        logger.info("No session snapshot found")
+        return None
+
+    proxy = proxies.for_token(snapshot.token) if proxies is not None else None
+    proxy_url = proxy.url if proxy else None
+
+    with guard(db_breaker):
+        active = await token_service.is_active(snapshot.token)
+    if not active or not await probe_session(snapshot.cookies, proxy=proxy_url):
+        logger.info("Session snapshot is no longer valid")
+        session_store.delete(snapshot.token)
+        if proxies is not None:
+            proxies.release(snapshot.token)
+        return None
+
+    return snapshot
+
+
+async def login_with_tokens(
+        token_service: TokenRepository,
+        login: Callable[[str], Awaitable[bool]],
+        depth: int = 5,
+        proxies: Optional[ProxyPool] = None,
+        db_breaker: Optional[CircuitBreaker] = None,
+) -> str:
+    """
+    Берет токены по очереди пока login(token) не вернет True, всего depth + 1 попыток.
+    Не подошедший токен откладывается на TOKEN_FAILURE_COOLDOWN, на последней
+    попытке выключается. LoginFailed если попытки кончились.
+    Запросы к БД идут под db_breaker, при упавшей БД - сразу CircuitOpenError
+    """
+    for attempt in range(depth, -1, -1):
+        with guard(db_breaker):
+            token = await token_service.fetch_token()
+        if not token:
+            raise ValueError("Tokens are unavailable")
+
+        if await login(token):
+            with guard(db_breaker):
+                await token_service.mark_as_used(token)
+            logger.info("Login complete")
+            return token
+
+        with guard(db_breaker):
+            if attempt == 0:
+                await token_service.mark_as_inactive(token)
+            else:
+                # puts token aside, so next fetch_token returns another one
+                await token_service.register_failure(token, TOKEN_FAILURE_COOLDOWN)
+        if proxies is not None:
+            proxies.release(token)
+
+        logger.warning("Login failed, trying another token!")
+
+    raise LoginFailed(f"No token could log in after {depth + 1} tries")
+
+
+def token_cookies(token: str) -> List[Dict[str, Any]]:
+    return [{"name": ROBLOX_TOKEN_KEY, "value": token}]
+
+
+async def auth_session(
+        token_service: TokenRepository,
+        depth: int = 5,
+        proxies: Optional[ProxyPool] = None,
+        db_breaker: Optional[CircuitBreaker] = None,
+) -> SessionSnapshot:
+    """
+    Логин без браузера для http режима поиска: токен проверяется тем же запросом что и снимки
+    """
+
+    async def login(token: str) -> bool:
+        proxy = proxies.for_token(token) if proxies is not None else None
+        return await probe_session(token_cookies(token), proxy=proxy.url if proxy else None)
+
+    token = await login_with_tokens(token_service, login, depth, proxies, db_breaker)
+    return SessionSnapshot(token=token, cookies=token_cookies(token))
@@ -0,0 +1,112 @@
+import json
+import re
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, Tuple, Any, Optional
+
+from loguru import logger
+
+from app.services.metrics import metrics
+
+# handler returns http status, content type and body
+Route = Callable[[], Tuple[int, str, str]]
+
+_METRIC_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def metric_name(name: str) -> str:
+    return _METRIC_NAME_RE.sub("_", name)
+
+
+def render_prometheus(snapshot: Dict[str, Any]) -> str:
+    """
+    snapshot() метрик в текстовом формате Prometheus,
+    тайминги отдаются как _count, _sum и _max
+    """
+    lines = []
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"{metric_name(name)}_total {value}")
+    for name, value in sorted(snapshot["gauges"].items()):
+        lines.append(f"{metric_name(name)} {value}")
+    for name, timing in sorted(snapshot["timings"].items()):
+        for key in ("count", "sum", "max"):
+            lines.append(f"{metric_name(name)}_seconds_{key} {timing[key]}")
+    return "\n".join(lines) + "\n"
+
+
+def check_route(check: Callable[[], Tuple[bool, Any]]) -> Route:
+    """
+    Route for a health check, 200 when it passes and 503 otherwise, details as json
+    """
+    def _route():
+        ok, details = check()
+        return 200 if ok else 503, "application/json", json.dumps({"ok": ok, **details})
+
+    return _route
+
+
+class StatusServer:
+    """
+    Локальный HTTP сервер в отдельном потоке, отвечает даже когда
+    event loop занят обработкой сообщения. /metrics есть всегда,
+    остальные пути добавляются через add_route().
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.routes: Dict[str, Route] = {
+            "/metrics": lambda: (200, "text/plain; version=0.0.4", render_prometheus(metrics.snapshot())),
+        }
+
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def add_route(self, path: str, route: Route) -> None:
+        self.routes[path] = route
+
+    def _handler(self):
+        routes = self.routes
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                route = routes.get(self.path.split("?", 1)[0])
+                if route is None:
+                    status, content_type, body = 404, "text/plain", "not found\n"
+                else:
+                    try:
+                        status, content_type, body = route()
+                    except Exception as e:
+                        logger.exception(f"Status route {self.path} failed: {e!r}")
+                        status, content_type, body = 500, "text/plain", "internal error\n"
+
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                # scraped every few seconds, access log would only be noise
+                pass
+
+        return _Handler
+
+    def start(self) -> None:
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        # port 0 picks a free one
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="status-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Status server listening on {self.host}:{self.port}")
+
+    def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
@@ -1,19 +1,43 @@
 import re
+from typing import NamedTuple, Optional, Iterable, List, Tuple
 
 
 url_validator_re = re.compile(r"https?:\/\/(www)?\.roblox\.com\/game-pass\/(\d*)/(\w*)?")
 
 
-def validate_game_pass_url(url: str) -> bool:
-    match = url_validator_re.search(url)
+class GamePassRef(NamedTuple):
+    id: int
+    name: str
+    url: str
 
+
+def parse_game_pass_url(url: str) -> Optional[GamePassRef]:
+    """
+    ID и имя геймпасса из ссылки, None если ссылка не на геймпасс
+    """
+    match = url_validator_re.search(url)
     if not match:
-        return False
+        return None
 
-    groups = match.groups()
+    _, game_pass_id, name = match.groups()
+    if not game_pass_id or not name:
+        return None
+    return GamePassRef(id=int(game_pass_id), name=name, url=url)
 
-    if len(groups) != 3:
-        return False
-    if not groups[2]:
-        return False
-    return True
+
+def parse_game_pass_urls(urls: Iterable[str]) -> Tuple[List[GamePassRef], List[str]]:
+    """
+    :return: parsed references and urls which are not game pass links
+    """
+    parsed, invalid = [], []
+    for url in urls:
+        ref = parse_game_pass_url(url)
+        if ref is None:
+            invalid.append(url)
+        else:
+            parsed.append(ref)
+    return parsed, invalid
+
+
+def validate_game_pass_url(url: str) -> bool:
+    return parse_game_pass_url(url) is not None
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from app.repos import TokenRepository
+from app.services.db import SQLiteDBConnector
+
+
+@pytest.fixture
+def loop():
+    """Current loop of a sync test, for code calling run_coroutine"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / "tokens.db")
+
+
+@pytest.fixture
+async def sqlite_conn(sqlite_path):
+    conn = SQLiteDBConnector(sqlite_path)
+    yield conn
+    await conn.close()
+
+
+@pytest.fixture
+async def token_repo(sqlite_conn):
+    repo = TokenRepository(sqlite_conn, "tokens")
+    await repo.migrate()
+    return repo
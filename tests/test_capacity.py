@@ -0,0 +1,105 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app.providers import get_capacity_reporter
+from app.services import capacity
+from app.services.capacity import CapacityReporter
+from app.services.metrics import metrics
+from app.services.queue.consumers import JOB_TIMING
+
+
+class StubInspector:
+    """
+    QueueInspector без брокера: отдает глубины очереди по одной на каждый sample
+    """
+
+    queue = "queue"
+
+    def __init__(self, *depths) -> None:
+        self.depths = list(depths)
+
+    def queue_depth(self):
+        return self.depths.pop(0)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(capacity.time, "monotonic", clock)
+    return clock
+
+
+def make_reporter(inspector, status_path: str = "") -> CapacityReporter:
+    consumer = SimpleNamespace(inflight_count=1, prefetch_count=1)
+    return CapacityReporter(
+        inspector, consumer, interval=15, window=300, target_drain_time=60,
+        min_replicas=1, max_replicas=10, status_path=status_path,
+    )
+
+
+def work(clock: Clock, seconds: float, jobs: int) -> None:
+    """jobs задач по секунде подряд за seconds секунд"""
+    for _ in range(jobs):
+        metrics.observe(JOB_TIMING, 1.0)
+    clock.now += seconds
+
+
+def test_draining_queue_reports_eta_and_replicas(clock, tmp_path):
+    path = tmp_path / "capacity" / "status.json"
+    # two consumers take 2 jobs/s out, the queue shrinks by 2/s
+    reporter = make_reporter(StubInspector((100, 2), (80, 2)), status_path=str(path))
+    reporter.sample()
+    work(clock, 10, jobs=10)
+
+    status = reporter.sample()
+
+    assert status["service_rate"] == 1.0 and status["utilization"] == 1.0 and status["job_seconds"] == 1.0
+    # nothing new arrives
+    assert status["arrival_rate"] == 0.0
+    assert status["drain_eta_seconds"] == 40.0
+    # 80 jobs in 60 seconds at a job per second
+    assert status["recommended_replicas"] == 2
+    assert json.loads(path.read_text()) == status
+    assert metrics.snapshot()["gauges"]["capacity.drain_eta_seconds"] == 40.0
+
+
+def test_growing_queue_has_no_eta_and_clamps_replicas(clock):
+    reporter = make_reporter(StubInspector((100, 2), (200, 2)))
+    reporter.sample()
+    work(clock, 10, jobs=10)
+
+    status = reporter.sample()
+
+    # 2 jobs/s processed and the queue still grew by 10/s
+    assert status["arrival_rate"] == 12.0
+    assert status["drain_eta_seconds"] is None
+    # 12 + 200 / 60 replicas are needed, max_replicas is 10
+    assert status["recommended_replicas"] == 10
+
+
+def test_no_broker_keeps_current_replicas(clock):
+    reporter = make_reporter(StubInspector(None, None))
+    reporter.sample()
+    work(clock, 10, jobs=10)
+
+    status = reporter.sample()
+
+    assert status["queue_depth"] is None and status["arrival_rate"] is None
+    assert status["drain_eta_seconds"] is None
+    assert status["recommended_replicas"] == 1
+
+
+def test_reporter_without_readers_is_not_started():
+    settings = SimpleNamespace(capacity_interval=15, status_port=0, capacity_status_path="")
+
+    assert get_capacity_reporter(settings, consumer=None) is None
@@ -0,0 +1,25 @@
+import io
+
+from app.cli import import_tokens, iter_tokens
+
+
+async def test_import_skips_duplicates_in_a_chunk_and_in_the_table(token_repo):
+    await token_repo.add_tokens(["old"])
+    # chunks of 3: ["a", "a", "old"], ["b", "a", "c"]
+    tokens = ["a", "a", "old", "b", "a", "c"]
+
+    read, inserted = await import_tokens(token_repo, tokens, chunk_size=3)
+
+    assert (read, inserted) == (6, 3)
+    assert await token_repo.count_tokens() == {"active": 4, "inactive": 0, "total": 4}
+
+    # the same file again inserts nothing
+    assert await import_tokens(token_repo, tokens, chunk_size=3) == (6, 0)
+
+
+async def test_count_tokens_splits_active_and_inactive(token_repo):
+    read, inserted = await import_tokens(token_repo, iter_tokens([io.StringIO("# tokens\na\n\n b \nc\n")]), 100)
+    await token_repo.mark_as_inactive("b")
+
+    assert (read, inserted) == (3, 3)
+    assert await token_repo.count_tokens() == {"active": 2, "inactive": 1, "total": 3}
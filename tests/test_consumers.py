@@ -0,0 +1,173 @@
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from app.fixtures.publisher import RecordingPublisher
+from app.services.exceptions import PoisonMessageException
+from app.services.idempotency import MemoryIdempotencyStore
+from app.services.metrics import metrics
+from app.services.queue.consumers import URLConsumer, JOB_TIMING
+from app.services.queue.retry import RetryTopology
+
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.is_open = True
+        self.acked = []
+        self.nacked = []
+        self.published = []
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.nacked.append((delivery_tag, requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((exchange, routing_key, body, properties))
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.is_closing = False
+        self.is_closed = False
+        self.ioloop = SimpleNamespace(stop=lambda: None, call_later=lambda *args: None)
+
+    def close(self):
+        self.is_closing = True
+
+
+class SlowReply:
+    """
+    Листенер, во время работы которого проходит дедлайн drain
+    """
+
+    def __init__(self, consumer: URLConsumer = None) -> None:
+        self.consumer = consumer
+
+    def __call__(self, publisher, body):
+        if self.consumer is not None:
+            self.consumer.drain(0.0)
+        publisher.send_message({"reply": body.decode()})
+
+
+def make_consumer(store, publisher) -> URLConsumer:
+    consumer = URLConsumer(
+        "amqp://stub", exchange="exchange", queue="queue", routing="routing",
+        idempotency_store=store, workflow_data={"publisher": publisher},
+    )
+    consumer._connection = FakeConnection()
+    consumer._channel = FakeChannel()
+    return consumer
+
+
+def deliver(consumer: URLConsumer, tag: int, body: bytes) -> None:
+    properties = pika.BasicProperties(app_id="test", message_id="job-1")
+    consumer.on_message(consumer._channel, SimpleNamespace(delivery_tag=tag), properties, body)
+
+
+def test_drain_deadline_drops_reply_of_requeued_message(loop):
+    store = MemoryIdempotencyStore(ttl=60, max_size=10)
+    publisher = RecordingPublisher()
+    consumer = make_consumer(store, publisher)
+    consumer.add_listener(SlowReply(consumer))
+
+    deliver(consumer, 1, b"search")
+
+    assert consumer._channel.nacked == [(1, True)]
+    assert consumer._channel.acked == []
+    assert publisher.messages == []
+    assert loop.run_until_complete(store.get("job-1")) is None
+
+    # the redelivery answers the message exactly once
+    replica = make_consumer(store, publisher)
+    replica.add_listener(SlowReply())
+    deliver(replica, 1, b"search")
+
+    assert publisher.messages == [{"reply": "search"}]
+    assert replica._channel.acked == [1]
+
+
+def test_reply_is_sent_and_stored_without_drain(loop):
+    store = MemoryIdempotencyStore(ttl=60, max_size=10)
+    publisher = RecordingPublisher()
+    consumer = make_consumer(store, publisher)
+    consumer.add_listener(SlowReply())
+
+    deliver(consumer, 1, b"search")
+    deliver(consumer, 2, b"search")
+
+    # second delivery is replayed from the store
+    assert publisher.messages == [{"reply": "search"}, {"reply": "search"}]
+    assert len(loop.run_until_complete(store.get("job-1"))) == 1
+    assert consumer._channel.acked == [1, 2]
+
+
+def test_lane_jobs_are_timed_apart_from_main_queue(loop):
+    store = MemoryIdempotencyStore(ttl=60, max_size=10)
+    lane = make_consumer(store, RecordingPublisher())
+    lane.job_timing = "consumer.job.test"
+    lane.add_listener(SlowReply())
+    before = metrics.snapshot()["timings"].get(JOB_TIMING, {}).get("count", 0)
+
+    deliver(lane, 1, b"check")
+
+    timings = metrics.snapshot()["timings"]
+    assert timings["consumer.job.test"]["count"] == 1
+    assert timings.get(JOB_TIMING, {}).get("count", 0) == before
+
+
+class Failing:
+    def __init__(self, exc: Exception) -> None:
+        self.exc = exc
+
+    def __call__(self, body):
+        raise self.exc
+
+
+def make_topology() -> RetryTopology:
+    return RetryTopology("amqp://stub", queue="queue", exchange="exchange", routing="queue", delays=[5, 30])
+
+
+def died(*deaths) -> pika.BasicProperties:
+    return pika.BasicProperties(headers={"x-death": [{"queue": queue, "count": count} for queue, count in deaths]})
+
+
+def test_attempts_are_counted_over_all_retry_queues():
+    topology = make_topology()
+
+    assert topology.attempts(None) == 0
+    # deaths in other queues aren't retries
+    assert topology.attempts(died(("queue.retry.0", 1), ("queue.retry.1", 2), ("other", 5))) == 3
+    # brokers dropping x-death fall back to the own counter
+    assert topology.attempts(pika.BasicProperties(headers={"x-retry-count": 2})) == 2
+
+
+@pytest.mark.parametrize("properties, exc, queue", [
+    (None, RuntimeError("boom"), "queue.retry.0"),
+    (died(("queue.retry.0", 1)), RuntimeError("boom"), "queue.retry.1"),
+    (died(("queue.retry.0", 1), ("queue.retry.1", 1)), RuntimeError("boom"), "queue.dlq"),
+    (None, PoisonMessageException("never"), "queue.dlq"),
+])
+def test_failure_is_routed_to_retry_or_dead_letter_queue(properties, exc, queue):
+    assert make_topology().route_failure(properties, exc) == queue
+
+
+def test_failed_message_is_republished_and_acked(loop):
+    consumer = URLConsumer(
+        "amqp://stub", exchange="exchange", queue="queue", routing="queue",
+        retry_topology=make_topology(), workflow_data={"publisher": RecordingPublisher()},
+    )
+    consumer._connection = FakeConnection()
+    consumer._channel = FakeChannel()
+    consumer.add_listener(Failing(RuntimeError("boom")))
+
+    properties = pika.BasicProperties(headers={"x-retry-count": 1})
+    consumer.on_message(consumer._channel, SimpleNamespace(delivery_tag=1), properties, b"search")
+
+    [(exchange, routing_key, body, sent)] = consumer._channel.published
+    assert (exchange, routing_key, body) == ("exchange.retry", "queue.retry.1", b"search")
+    assert sent.headers["x-retry-count"] == 2
+    assert sent.headers["x-last-error"] == "RuntimeError: boom"
+    assert consumer._channel.acked == [1] and consumer._channel.nacked == []
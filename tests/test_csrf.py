@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from aiohttp import web, ClientSession
+from aiohttp.test_utils import TestServer
+
+from app.consts import ROBLOX_CSRF_HEADER
+from app.services.csrf import CSRFTokenManager
+from app.services.metrics import metrics
+
+
+class RotatingStub:
+    """
+    Заглушка roblox: POST /logout без токена отвечает 403 с текущим токеном,
+    POST /api пропускает только текущий токен, rotate() меняет его
+    """
+
+    def __init__(self) -> None:
+        self.version = 1
+        self.logouts = 0
+        self.requests = 0
+
+    @property
+    def token(self) -> str:
+        return f"csrf-{self.version}"
+
+    def rotate(self) -> None:
+        self.version += 1
+
+    async def logout(self, request: web.Request) -> web.Response:
+        self.logouts += 1
+        await asyncio.sleep(0.01)
+        return web.Response(status=403, headers={ROBLOX_CSRF_HEADER: self.token})
+
+    async def api(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(0.01)
+        if request.headers.get("X-CSRF-TOKEN") != self.token:
+            return web.Response(status=403, headers={ROBLOX_CSRF_HEADER: self.token})
+        return web.json_response({"ok": True})
+
+    async def forbidden(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.Response(status=403, headers={ROBLOX_CSRF_HEADER: self.token})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/logout", self.logout)
+        app.router.add_post("/api", self.api)
+        app.router.add_post("/forbidden", self.forbidden)
+        return app
+
+
+@pytest.fixture
+async def stub():
+    stub = RotatingStub()
+    server = TestServer(stub.app())
+    await server.start_server()
+    stub.url = str(server.make_url(""))
+    yield stub
+    await server.close()
+
+
+def refreshes() -> float:
+    return metrics.snapshot()["counters"].get("csrf.refreshes", 0)
+
+
+async def post_all(csrf: CSRFTokenManager, session: ClientSession, url: str, count: int):
+    async def post():
+        response = await csrf.request(session, "POST", url, "roblosecurity")
+        async with response:
+            return response.status
+
+    return await asyncio.gather(*(post() for _ in range(count)))
+
+
+async def test_first_token_is_fetched_once(stub):
+    csrf = CSRFTokenManager(refresh_url=f"{stub.url}/logout")
+    before = refreshes()
+
+    async with ClientSession() as session:
+        statuses = await post_all(csrf, session, f"{stub.url}/api", 10)
+
+    assert statuses == [200] * 10
+    assert stub.logouts == 1
+    assert refreshes() - before == 1
+    assert csrf.get("roblosecurity") == "csrf-1"
+
+
+async def test_rotated_token_is_refreshed_once_under_concurrent_403(stub):
+    csrf = CSRFTokenManager(refresh_url=f"{stub.url}/logout")
+
+    async with ClientSession() as session:
+        await post_all(csrf, session, f"{stub.url}/api", 1)
+        stub.rotate()
+        before, requests = refreshes(), stub.requests
+
+        statuses = await post_all(csrf, session, f"{stub.url}/api", 10)
+
+    assert statuses == [200] * 10
+    # every request was rejected once and retried once with the shared token
+    assert stub.requests - requests == 20
+    assert refreshes() - before == 1
+    assert stub.logouts == 1
+    assert csrf.get("roblosecurity") == "csrf-2"
+
+
+async def test_forbidden_with_current_token_is_not_retried(stub):
+    csrf = CSRFTokenManager(refresh_url=f"{stub.url}/logout")
+    csrf.set("roblosecurity", stub.token)
+    before = refreshes()
+
+    async with ClientSession() as session:
+        response = await csrf.request(session, "POST", f"{stub.url}/forbidden", "roblosecurity")
+        async with response:
+            assert response.status == 403
+
+    assert stub.requests == 1
+    assert refreshes() == before
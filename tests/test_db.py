@@ -0,0 +1,94 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from loguru import logger
+
+from app.services.db import AsyncpgDBConnector
+from app.services.metrics import metrics
+
+
+class StubConnection:
+    """
+    Соединение asyncpg: каждый вызов занимает delay секунд и записывается в calls
+    """
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.calls = []
+
+    async def _call(self, *args):
+        self.calls.append(args)
+        await asyncio.sleep(self.delay)
+
+    async def executemany(self, sql, args, **kwargs):
+        await self._call("executemany", sql, list(args))
+
+    async def copy_records_to_table(self, table, records, columns):
+        await self._call("copy", table, list(records), columns)
+
+    async def fetch(self, sql, *args, **kwargs):
+        await self._call("fetch", sql, *args)
+        raise ConnectionError("server closed the connection")
+
+
+class StubPool:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.connection = StubConnection(delay)
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.connection
+
+
+@pytest.fixture
+def warnings():
+    records = []
+    sink = logger.add(records.append, level="WARNING", format="{message}")
+    yield records
+    logger.remove(sink)
+
+
+def timing(name: str) -> dict:
+    return metrics.snapshot()["timings"].get(name, {"count": 0, "sum": 0.0})
+
+
+async def test_bulk_operations_are_timed_without_slow_warnings(warnings):
+    pool = StubPool()
+    conn = AsyncpgDBConnector(pool, slow_query_ms=1000)
+    executemany, copy = timing("db.executemany")["count"], timing("db.copy")["count"]
+
+    await conn.executemany("INSERT INTO tokens (token) VALUES ($1)", ((token,) for token in "ab"))
+    await conn.copy_records("tokens", ((token,) for token in "cd"), columns=("token",))
+
+    assert pool.connection.calls == [
+        ("executemany", "INSERT INTO tokens (token) VALUES ($1)", [("a",), ("b",)]),
+        ("copy", "tokens", [("c",), ("d",)], ["token"]),
+    ]
+    assert timing("db.executemany")["count"] - executemany == 1
+    assert timing("db.copy")["count"] - copy == 1
+    assert warnings == []
+
+
+async def test_query_over_threshold_is_logged(warnings):
+    conn = AsyncpgDBConnector(StubPool(delay=0.02), slow_query_ms=10)
+    before = timing("db.copy")
+
+    await conn.copy_records("tokens", [("a",)], columns=("token",))
+
+    after = timing("db.copy")
+    assert after["count"] - before["count"] == 1
+    assert after["sum"] - before["sum"] >= 0.02
+    [record] = warnings
+    assert record.startswith("Slow query (copy, ") and record.rstrip().endswith("ms): COPY tokens (token)")
+
+
+async def test_failed_query_is_still_timed(warnings):
+    conn = AsyncpgDBConnector(StubPool(delay=0.02), slow_query_ms=10)
+    before = timing("db.fetchmany")["count"]
+
+    with pytest.raises(ConnectionError):
+        await conn.fetchmany("SELECT token FROM tokens")
+
+    assert timing("db.fetchmany")["count"] - before == 1
+    assert len(warnings) == 1 and warnings[0].rstrip().endswith("SELECT token FROM tokens")
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from app.services.gamepass import GamePassResolver
+from app.services.validators import GamePassRef
+
+REF = GamePassRef(id=42, name="vip", url="https://www.roblox.com/game-pass/42/vip")
+
+
+class StubResponse:
+    def __init__(self, body: str) -> None:
+        self.status = 200
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self):
+        return json.loads(self.body)
+
+
+class StubHttp:
+    """
+    http воркера: отвечает body только после release, считает запросы
+    """
+
+    def __init__(self, body: str = '{"Name": "vip", "PriceInRobux": 10, "IsForSale": true}') -> None:
+        self.body = body
+        self.requests = 0
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    async def request(self, method, url, **kwargs):
+        self.requests += 1
+        self.started.set()
+        while not self.released.is_set():
+            await asyncio.sleep(0.001)
+        return StubResponse(self.body)
+
+
+def make_resolver() -> GamePassResolver:
+    return GamePassResolver(ttl=60, max_size=10, concurrency=4)
+
+
+def resolve_in_thread(resolver: GamePassResolver, http: StubHttp, results: list) -> threading.Thread:
+    """
+    Другой воркер lane: свой поток и свой loop
+    """
+    def run():
+        try:
+            results.append(asyncio.run(resolver.resolve(http, REF)))
+        except BaseException as e:
+            results.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+async def wait_for_waiter(resolver: GamePassResolver, thread: threading.Thread) -> None:
+    while not resolver._pending[REF.id]._done_callbacks and thread.is_alive():
+        await asyncio.sleep(0.001)
+
+
+async def test_workers_share_one_request():
+    resolver = make_resolver()
+    owner, other = StubHttp(), StubHttp()
+    task = asyncio.ensure_future(resolver.resolve(owner, REF))
+    while not owner.started.is_set():
+        await asyncio.sleep(0.001)
+
+    results = []
+    thread = resolve_in_thread(resolver, other, results)
+    await wait_for_waiter(resolver, thread)
+    owner.released.set()
+    game_pass = await task
+    thread.join(timeout=5)
+
+    assert game_pass.price == 10 and game_pass.is_for_sale
+    assert results == [game_pass]
+    assert owner.requests == 1 and other.requests == 0
+    # the next lookup is served from the cache
+    assert await resolver.resolve(other, REF) == game_pass
+    assert other.requests == 0
+
+
+@pytest.mark.parametrize("cancel", [False, True])
+async def test_waiters_get_any_failure_of_the_request(cancel):
+    resolver = make_resolver()
+    owner, other = StubHttp(body="not json"), StubHttp()
+    task = asyncio.ensure_future(resolver.resolve(owner, REF))
+    while not owner.started.is_set():
+        await asyncio.sleep(0.001)
+
+    results = []
+    thread = resolve_in_thread(resolver, other, results)
+    await wait_for_waiter(resolver, thread)
+    if cancel:
+        task.cancel()
+    else:
+        owner.released.set()
+
+    with pytest.raises(asyncio.CancelledError if cancel else json.JSONDecodeError):
+        await task
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert isinstance(results[0], asyncio.CancelledError if cancel else json.JSONDecodeError)
+    assert REF.id not in resolver._pending
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.health import HealthState, channel_probe, consumer_probe
+from app.services.status import StatusServer, check_route
+
+
+class StubTokens:
+    def __init__(self, active: int = 1, error: Exception = None) -> None:
+        self.active = active
+        self.error = error
+
+    async def count_tokens(self):
+        if self.error is not None:
+            raise self.error
+        return {"active": self.active}
+
+
+@pytest.fixture
+def health():
+    return HealthState(liveness_timeout=30)
+
+
+@pytest.fixture
+def server(health):
+    server = StatusServer("127.0.0.1", 0)
+    server.add_route("/healthz", check_route(health.liveness))
+    server.add_route("/readyz", check_route(health.readiness))
+    server.start()
+    yield server
+    server.stop()
+
+
+def get(server: StatusServer, path: str):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}{path}", timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+async def check_once(health: HealthState, tokens: StubTokens) -> None:
+    task = asyncio.ensure_future(health.run_checks(tokens, interval=60))
+    await asyncio.sleep(0)
+    task.cancel()
+
+
+def make_ready(health: HealthState, consumer) -> None:
+    health.report("browser", True)
+    health.add_probe("amqp_consumer", consumer_probe(consumer))
+    health.add_probe("amqp_publisher", channel_probe(SimpleNamespace(is_connected=lambda: True)))
+
+
+async def test_ready_when_every_check_passes(health, server):
+    # nothing reported yet
+    assert get(server, "/readyz")[0] == 503
+
+    make_ready(health, SimpleNamespace(consuming=True, draining=False))
+    await check_once(health, StubTokens(active=3))
+
+    status, body = get(server, "/readyz")
+    assert status == 200
+    assert body["tokens"] == {"ok": True, "detail": "3 active"}
+    assert get(server, "/healthz")[0] == 200
+
+
+@pytest.mark.parametrize("consumer, tokens, failing", [
+    (SimpleNamespace(consuming=True, draining=True), StubTokens(), "amqp_consumer"),
+    (SimpleNamespace(consuming=False, draining=False), StubTokens(), "amqp_consumer"),
+    (SimpleNamespace(consuming=True, draining=False), StubTokens(active=0), "tokens"),
+    (SimpleNamespace(consuming=True, draining=False), StubTokens(error=ConnectionError("db down")), "db"),
+])
+async def test_not_ready_when_a_check_fails(health, server, consumer, tokens, failing):
+    make_ready(health, consumer)
+    await check_once(health, tokens)
+
+    status, body = get(server, "/readyz")
+
+    assert status == 503 and not body["ok"]
+    assert not body[failing]["ok"]
+    # readiness doesn't restart the process
+    assert get(server, "/healthz")[0] == 200
+
+
+async def test_raising_probe_is_a_failed_check(health, server):
+    def probe():
+        raise RuntimeError("channel gone")
+
+    make_ready(health, SimpleNamespace(consuming=True, draining=False))
+    health.add_probe("amqp_publisher", probe)
+    await check_once(health, StubTokens())
+
+    status, body = get(server, "/readyz")
+
+    assert status == 503
+    assert body["amqp_publisher"] == {"ok": False, "detail": "RuntimeError('channel gone')"}
+
+
+def test_not_alive_when_loop_heartbeat_stalls(health, server):
+    assert get(server, "/healthz")[0] == 200
+
+    health.heartbeat = time.monotonic() - 60
+
+    status, body = get(server, "/healthz")
+    assert status == 503
+    assert body["loop_stalled_seconds"] >= 60
@@ -0,0 +1,94 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from yarl import URL
+
+from app.consts import ROBLOX_TOKEN_KEY
+from app.services.http import HTTPClientPool
+from app.services.metrics import metrics
+
+ROBLOX_URL = URL("https://users.roblox.com/v1/users/search")
+
+
+class EchoStub:
+    """
+    Заглушка: GET /echo отвечает cookies запроса, считает запросы
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+
+    async def echo(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.json_response(dict(request.cookies))
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/echo", self.echo)
+        return app
+
+
+@pytest.fixture
+async def stub():
+    stub = EchoStub()
+    server = TestServer(stub.app())
+    await server.start_server()
+    stub.url = str(server.make_url("/echo"))
+    yield stub
+    await server.close()
+
+
+@pytest.fixture
+async def pool():
+    pool = HTTPClientPool(limit=10, limit_per_host=4, dns_ttl=60, keepalive_timeout=30, timeout=5)
+    yield pool
+    await pool.close()
+
+
+def cookies(pool: HTTPClientPool, token: str) -> dict:
+    return {name: morsel.value for name, morsel in pool.session(token).cookie_jar.filter_cookies(ROBLOX_URL).items()}
+
+
+async def test_every_token_has_its_own_cookie_jar(pool):
+    pool.set_active("first", {"RBXEventTrackerV2": "browser"})
+    pool.set_active("second")
+
+    assert cookies(pool, "first") == {ROBLOX_TOKEN_KEY: "first", "RBXEventTrackerV2": "browser"}
+    assert cookies(pool, "second") == {ROBLOX_TOKEN_KEY: "second"}
+    assert pool.active_token == "second"
+    assert pool.session() is pool.session("second")
+    # roblox cookies never leave roblox.com
+    assert not pool.session("first").cookie_jar.filter_cookies(URL("https://example.com/"))
+
+
+async def test_sessions_share_one_connector(pool, stub):
+    pool.set_active("first")
+    before = metrics.snapshot()["counters"].get("http.connections.reused", 0)
+
+    for token in ("first", "second", None):
+        async with await pool.request("GET", stub.url, token=token) as response:
+            assert response.status == 200
+
+    assert pool.session("first").connector is pool.session("second").connector is pool.connector
+    assert stub.requests == 3
+    # one keep-alive connection served all three sessions
+    assert metrics.snapshot()["counters"]["http.connections.reused"] - before == 2
+    assert pool.stats() == {
+        "sessions": 2, "connections_idle": 1, "connections_acquired": 0, "limit": 10, "limit_per_host": 4,
+    }
+    assert metrics.snapshot()["gauges"]["http.pool.sessions"] == 2
+
+
+async def test_forgotten_token_falls_back_to_anonymous(pool, stub):
+    pool.set_active("spent")
+    session = pool.session()
+
+    await pool.forget("spent")
+
+    assert session.closed
+    assert pool.active_token is None
+    async with await pool.request("GET", stub.url) as response:
+        assert await response.json() == {}
+    assert pool.stats()["sessions"] == 1
+    # the shared connector outlives the closed session
+    assert not pool.connector.closed
@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.limiter import AIMDLimiter, AdaptiveLimiter, LimiterRejected, TokenBucket, reserve_all, pause
+
+
+def make_limiter(global_rate: float = 0, token_rate: float = 0, initial: float = 2.0) -> AdaptiveLimiter:
+    concurrency = AIMDLimiter(initial=initial, min_limit=1, max_limit=10, latency_target=5.0)
+    return AdaptiveLimiter(concurrency, global_rate=global_rate, token_rate=token_rate, admission_timeout=0.05)
+
+
+def test_budget_rejection_does_not_raise_limit():
+    limiter = make_limiter(global_rate=0.001)
+    with limiter.admit("token"):
+        pass
+    limit = limiter.concurrency.limit
+
+    for _ in range(4):
+        with pytest.raises(LimiterRejected):
+            with limiter.admit("token"):
+                pass
+
+    assert limiter.concurrency.limit == limit
+    assert limiter.concurrency.inflight == 0
+
+
+def test_only_timeouts_count_as_overload():
+    limiter = make_limiter(initial=4.0)
+
+    # an empty search or a schema error says nothing about upstream load
+    with pytest.raises(RuntimeError):
+        with limiter.admit("token"):
+            raise RuntimeError("no results")
+    assert limiter.concurrency.limit == 4.0
+
+    with pytest.raises(asyncio.TimeoutError):
+        with limiter.admit("token"):
+            raise asyncio.TimeoutError()
+
+    assert limiter.concurrency.limit == 2.0
+    assert limiter.concurrency.inflight == 0
+
+
+def test_limit_grows_only_when_it_was_reached():
+    limiter = make_limiter(initial=2.0)
+
+    for _ in range(10):
+        with limiter.admit("token"):
+            pass
+    # one search at a time never tried a limit of 2
+    assert limiter.concurrency.limit == 2.0
+
+    with limiter.admit("token"):
+        with limiter.admit("token"):
+            pass
+    assert limiter.concurrency.limit == 2.5
+
+
+def test_rejecting_bucket_leaves_others_untouched():
+    shared, exhausted = TokenBucket(rate=1.0, burst=1.0), TokenBucket(rate=0.001, burst=1.0)
+    assert reserve_all([exhausted]) == 0.0
+
+    assert reserve_all([shared, exhausted], max_wait=0.05) is None
+    # the shared token wasn't consumed by the rejected reservation
+    assert reserve_all([shared], max_wait=0.0) == 0.0
+
+
+def test_token_rejection_keeps_global_budget():
+    limiter = make_limiter(global_rate=1.0, token_rate=0.001)
+    with limiter.admit("busy"):
+        pass
+    limiter._global = TokenBucket(rate=1.0, burst=2.0)
+
+    with pytest.raises(LimiterRejected):
+        with limiter.admit("busy"):
+            pass
+    with limiter.admit("idle"):
+        pass
+    with limiter.admit("other"):
+        pass
+
+
+async def test_budget_wait_does_not_block_loop():
+    limiter = make_limiter(global_rate=5.0)
+    limiter.admission_timeout = 1.0
+    limiter._global = TokenBucket(rate=5.0, burst=1.0)
+
+    ticks = []
+
+    async def heartbeat():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.02)
+
+    async def search():
+        for _ in range(2):
+            async with limiter.admit_async("token"):
+                pass
+
+    started = time.monotonic()
+    await asyncio.gather(heartbeat(), search())
+
+    assert time.monotonic() - started >= 0.15
+    assert len(ticks) == 5 and ticks[-1] - started < 0.15
+
+
+async def test_pause_keeps_loop_running():
+    import nest_asyncio
+    nest_asyncio.apply()
+
+    ticks = []
+
+    async def heartbeat():
+        for _ in range(3):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    task = asyncio.ensure_future(heartbeat())
+    pause(0.1)
+
+    assert len(ticks) == 3
+    await task
+
+
+async def test_slot_wait_does_not_block_loop():
+    import nest_asyncio
+    nest_asyncio.apply()
+
+    limiter = make_limiter(initial=1.0)
+    limiter.admission_timeout = 1.0
+    assert limiter.concurrency.acquire()
+    # only a running loop can give the slot back
+    asyncio.get_running_loop().call_later(0.1, limiter.concurrency.cancel)
+
+    started = time.monotonic()
+    with limiter.admit("token"):
+        assert time.monotonic() - started >= 0.1
+    assert limiter.concurrency.inflight == 0
+
+
+async def test_cancelled_admission_holds_no_slot():
+    limiter = make_limiter(initial=1.0)
+    limiter.admission_timeout = 10.0
+    assert limiter.concurrency.acquire()
+
+    async def search():
+        async with limiter.admit_async("token"):
+            pass
+
+    task = asyncio.ensure_future(search())
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    limiter.concurrency.cancel()
+    assert limiter.concurrency.inflight == 0
+    async with limiter.admit_async("token"):
+        assert limiter.concurrency.inflight == 1
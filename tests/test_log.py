@@ -0,0 +1,48 @@
+import glob
+import json
+import logging
+import sys
+import threading
+
+import pytest
+from loguru import logger
+
+from app.log import configure_logging, hot_logger
+
+
+@pytest.fixture
+def restore_logger():
+    yield
+    logger.configure(handlers=[dict(sink=sys.stderr)], patcher=lambda record: None)
+    logging.getLogger().handlers = []
+
+
+def test_sinks_keep_the_same_sampled_records(tmp_path, capsys, restore_logger):
+    configure_logging([], profile="production", sample_every=3, log_dir=str(tmp_path))
+    # switch threads as often as possible, so records of different threads
+    # interleave between the sinks
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def work(worker: int):
+        for number in range(900):
+            hot_logger.info(f"hot {worker}-{number}")
+        logger.info(f"cold {worker}")
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sys.setswitchinterval(interval)
+    logger.remove()
+
+    stderr = [line.rsplit(" - ", 1)[1] for line in capsys.readouterr().err.splitlines()]
+    [path] = glob.glob(str(tmp_path / "log_*.log"))
+    with open(path, encoding="utf8") as file:
+        saved = [json.loads(line)["message"] for line in file]
+
+    # writers may interleave threads differently, the kept records must match
+    assert sorted(stderr) == sorted(saved)
+    assert len([message for message in saved if message.startswith("hot")]) == 1200
+    assert len([message for message in saved if message.startswith("cold")]) == 4
@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.cli import find_seq_scans
+from app.repos import TokenRepository
+from app.services.db import SQLiteDBConnector
+from app.services.migrations import Migration, Migrator
+
+
+async def test_hot_queries_use_indexes(sqlite_conn):
+    repo = TokenRepository(sqlite_conn, "tokens")
+    await repo.migrate()
+
+    plans = await repo.explain_hot_queries()
+
+    for name, plan in plans.items():
+        assert not find_seq_scans("tokens", plan), (name, plan)
+    assert any("tokens_active_idx" in line for line in plans["fetch_active_tokens"])
+    assert any("tokens_token_uidx" in line for line in plans["mark_as_inactive"])
+    assert any("tokens_token_uidx" in line for line in plans["mark_as_used"])
+
+
+async def test_migrate_applies_every_version_once(sqlite_conn):
+    repo = TokenRepository(sqlite_conn, "tokens")
+
+    assert await repo.migrate() == [1, 2, 3, 4]
+    assert await repo.migrate() == []
+
+
+async def test_migration_keeps_active_duplicate(sqlite_conn):
+    repo = TokenRepository(sqlite_conn, "tokens")
+    await repo.create_tokens_table()
+    await sqlite_conn.executemany(
+        "INSERT INTO tokens (token, is_active) VALUES ($1, $2)",
+        [("a", False), ("a", True), ("b", True), ("b", True)],
+    )
+
+    await repo.migrate()
+
+    rows = await sqlite_conn.fetchmany("SELECT id, token, is_active FROM tokens ORDER BY id")
+    assert rows == [{"id": 2, "token": "a", "is_active": 1}, {"id": 3, "token": "b", "is_active": 1}]
+
+
+async def test_failed_migration_is_rolled_back(sqlite_conn):
+    migrator = Migrator(sqlite_conn, scope="things")
+    broken = Migration(1, "things", [
+        "CREATE TABLE things (id INTEGER)",
+        "ALTER TABLE things ADD COLUMN amount INTEGER",
+        "ALTER TABLE missing ADD COLUMN amount INTEGER",
+    ])
+
+    with pytest.raises(sqlite3.OperationalError):
+        await migrator.migrate([broken])
+
+    assert await migrator.applied_versions() == set()
+    assert await sqlite_conn.fetch("SELECT name FROM sqlite_master WHERE name = 'things'") is None
+
+    fixed = Migration(1, "things", list(broken.statements[:2]))
+    assert await migrator.migrate([fixed]) == [1]
+    await sqlite_conn.execute("INSERT INTO things (id, amount) VALUES (1, 2)")
+
+
+async def test_concurrent_replicas_apply_migrations_once(sqlite_path):
+    first, second = SQLiteDBConnector(sqlite_path), SQLiteDBConnector(sqlite_path)
+    try:
+        done = await asyncio.gather(
+            TokenRepository(first, "tokens").migrate(),
+            TokenRepository(second, "tokens").migrate(),
+        )
+    finally:
+        await first.close()
+        await second.close()
+
+    assert sorted(done[0] + done[1]) == [1, 2, 3, 4]
@@ -0,0 +1,71 @@
+import os
+import re
+import time
+
+import pika
+
+from app.services.profiler import SamplingProfiler, CONTROL_HEADER, handle_control
+
+
+def control(body: bytes, command: str = "profile"):
+    return pika.BasicProperties(headers={CONTROL_HEADER: command}), body
+
+
+def slow_search(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def read(path) -> dict:
+    stacks = {}
+    for line in path.read_text().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        stacks[stack] = int(count)
+    return stacks
+
+
+def test_profile_next_jobs_stops_by_itself_and_writes_a_file_per_job(tmp_path):
+    profiler = SamplingProfiler(output_dir=str(tmp_path), interval=0.001)
+
+    assert handle_control(profiler, *control(b'{"jobs": 2}'))
+    assert profiler.running
+
+    for _ in range(2):
+        with profiler.job(), profiler.stage("search"):
+            slow_search(0.1)
+
+    assert not profiler.running
+    names = sorted(os.listdir(tmp_path))
+    [total] = [name for name in names if "_job" not in name]
+    jobs = [name for name in names if "_job" in name]
+    durations = [re.search(r"_job(\d+)_(\d+)ms\.collapsed$", name).groups() for name in jobs]
+    assert [job_id for job_id, _ in durations] == ["0001", "0002"]
+    assert all(int(ms) >= 100 for _, ms in durations)
+
+    for name in jobs:
+        searched = [stack for stack in read(tmp_path / name) if "slow_search" in stack]
+        # thread name, then the stages, then the frames
+        assert searched and all(stack.startswith("MainThread;job;search;") for stack in searched)
+    total_stacks = read(tmp_path / total)
+    assert sum(count for stack, count in total_stacks.items() if "slow_search" in stack) >= 10
+
+
+def test_control_message_parsing(tmp_path):
+    profiler = SamplingProfiler(output_dir=str(tmp_path), interval=0.001)
+
+    # a search job, not a command
+    assert not handle_control(profiler, pika.BasicProperties(headers={"x-retry-count": 1}), b"user")
+    assert not handle_control(profiler, None, b"user")
+    # commands are consumed even when they are wrong
+    assert handle_control(profiler, *control(b"", command="restart"))
+    assert handle_control(profiler, *control(b"not json"))
+    assert handle_control(profiler, *control(b"[1]"))
+    assert not profiler.running
+
+    # empty body toggles
+    assert handle_control(profiler, *control(b""))
+    assert profiler.running
+    assert handle_control(profiler, *control(b""))
+    assert not profiler.running
+    assert len(os.listdir(tmp_path)) == 1
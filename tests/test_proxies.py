@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from app.services.limiter import AIMDLimiter, AdaptiveLimiter, LimiterRejected
+from app.services.proxies import ProxyPool
+
+
+class StubProxy:
+    """
+    Прокси-заглушка: отвечает на любой запрос сам, 200 или 502 если сломан
+    """
+
+    def __init__(self) -> None:
+        self.broken = False
+        self.requests = 0
+        self.server = None
+
+    async def handle(self, request: web.BaseRequest) -> web.Response:
+        self.requests += 1
+        return web.Response(status=502 if self.broken else 200)
+
+    async def start(self) -> str:
+        self.server = web.ServerRunner(web.Server(self.handle))
+        await self.server.setup()
+        site = web.TCPSite(self.server, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.server.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+
+@pytest.fixture
+async def stub_proxies():
+    proxies = [StubProxy(), StubProxy()]
+    urls = [await proxy.start() for proxy in proxies]
+    yield proxies, urls
+    for proxy in proxies:
+        await proxy.server.cleanup()
+
+
+def make_pool(urls, rate: float = 0, max_failures: int = 3) -> ProxyPool:
+    return ProxyPool(urls, rate=rate, max_failures=max_failures, eject_time=60, check_url="http://check.local/")
+
+
+def test_tokens_stick_to_least_loaded_proxy():
+    pool = make_pool(["http://10.0.0.1:3128", "http://10.0.0.2:3128", "http://10.0.0.3:3128"])
+
+    first, second, third = (pool.for_token(token) for token in ("a", "b", "c"))
+    assert len({first, second, third}) == 3
+    assert pool.for_token("a") is first
+
+    pool.for_token("d")
+    pool.release("b")
+    # b's proxy is the only one with no tokens left
+    assert pool.for_token("e") is second
+    assert [item["tokens"] for item in pool.stats()] == [2, 1, 1]
+
+
+def test_proxy_is_ejected_after_max_failures():
+    pool = make_pool(["http://10.0.0.1:3128", "http://10.0.0.2:3128"])
+    proxy = pool.for_token("a")
+
+    for _ in range(2):
+        pool.report(proxy, ok=False)
+    assert proxy.healthy
+
+    pool.report(proxy, ok=True)
+    for _ in range(2):
+        pool.report(proxy, ok=False)
+    # success resets the streak
+    assert proxy.healthy
+
+    pool.report(proxy, ok=False)
+    assert not proxy.healthy
+    moved = pool.for_token("a")
+    assert moved is not proxy and moved.healthy
+
+    for _ in range(3):
+        pool.report(moved, ok=False)
+    assert pool.for_token("a") is None
+    assert pool.pick() is None
+
+
+async def test_run_checks_reinstates_recovered_proxy(stub_proxies):
+    stubs, urls = stub_proxies
+    pool = make_pool(urls, max_failures=1)
+    proxy = pool.proxies[0]
+    stubs[0].broken = True
+    pool.report(proxy, ok=False)
+    assert not proxy.healthy
+
+    checks = asyncio.ensure_future(pool.run_checks(0.01))
+    try:
+        while stubs[0].requests < 2:
+            await asyncio.sleep(0.01)
+        # still answering 502, stays ejected
+        assert not proxy.healthy
+
+        stubs[0].broken = False
+        for _ in range(200):
+            if proxy.healthy:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        checks.cancel()
+
+    assert proxy.healthy
+    assert proxy.failures == 0
+    assert stubs[1].requests >= 2
+    assert all(item["healthy"] for item in pool.stats())
+
+
+def test_proxy_budget_is_shared_by_its_tokens():
+    pool = make_pool(["http://10.0.0.1:3128", "http://10.0.0.2:3128"], rate=0.001)
+    concurrency = AIMDLimiter(initial=4, min_limit=1, max_limit=10, latency_target=5.0)
+    limiter = AdaptiveLimiter(concurrency, global_rate=0, token_rate=0, admission_timeout=0.05, proxies=pool)
+
+    assert pool.for_token("a") is not pool.for_token("b")
+    assert pool.for_token("c") is pool.for_token("a")
+
+    with limiter.admit("a"):
+        pass
+    # c shares a's proxy, its budget is spent
+    with pytest.raises(LimiterRejected):
+        with limiter.admit("c"):
+            pass
+    # the other proxy has its own budget
+    with limiter.admit("b"):
+        pass
@@ -0,0 +1,144 @@
+import time
+
+from pika.exceptions import NackError
+
+from app.services.idempotency import MemoryIdempotencyStore
+from app.services.metrics import metrics
+from app.services.queue.publisher import BatchingMessageSender
+from tests.test_consumers import SlowReply, make_consumer, deliver
+
+
+class FakeBlockingChannel:
+    """
+    Канал blocking соединения: tx_commit занимает rtt секунд,
+    опубликованное видно в committed только после коммита
+    """
+
+    def __init__(self, rtt: float = 0.0, failures: int = 0) -> None:
+        self.is_open = True
+        self.rtt = rtt
+        self.failures = failures
+        self.transaction = []
+        self.committed = []
+        self.commits = 0
+
+    def tx_select(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.transaction.append(body)
+
+    def tx_commit(self):
+        time.sleep(self.rtt)
+        if self.failures:
+            self.failures -= 1
+            self.transaction = []
+            raise NackError([])
+        now = time.monotonic()
+        self.committed.extend((now, body) for body in self.transaction)
+        self.transaction = []
+        self.commits += 1
+
+    def tx_rollback(self):
+        self.transaction = []
+
+
+class FakeBlockingConnection:
+    is_open = True
+    is_closed = False
+
+    def process_data_events(self, time_limit=None):
+        pass
+
+
+def make_sender(channel, batch_window: float = 60, batch_size: int = 50, max_tries: int = 3):
+    sender = BatchingMessageSender(
+        "amqp://stub", queue="replies", exchange="replies", routing="replies",
+        batch_window=batch_window, batch_size=batch_size, confirms=True, max_tries=max_tries,
+    )
+    sender.connection = FakeBlockingConnection()
+    sender.channel = channel
+    return sender
+
+
+def test_message_is_acked_and_stored_once_its_batch_is_committed(loop):
+    channel = FakeBlockingChannel()
+    sender = make_sender(channel)
+    store = MemoryIdempotencyStore(ttl=60, max_size=10)
+    consumer = make_consumer(store, sender)
+    consumer.add_listener(SlowReply())
+
+    deliver(consumer, 1, b"search")
+
+    # a crash now loses nothing: the message isn't acked nor recorded as processed
+    assert consumer._channel.acked == []
+    assert loop.run_until_complete(store.get("job-1")) is None
+
+    sender.flush()
+
+    assert channel.commits == 1
+    assert [body for _, body in channel.committed] == [b'{"reply": "search"}']
+    assert consumer._channel.acked == [1]
+    assert len(loop.run_until_complete(store.get("job-1"))) == 1
+
+
+def test_batch_rejected_by_the_broker_is_retried_then_dead_lettered(loop):
+    before = metrics.snapshot()["counters"].get("replies.dropped", 0)
+    channel = FakeBlockingChannel(failures=2)
+    sender = make_sender(channel, max_tries=2)
+    store = MemoryIdempotencyStore(ttl=60, max_size=10)
+    consumer = make_consumer(store, sender)
+    consumer.add_listener(SlowReply())
+
+    deliver(consumer, 1, b"search")
+    sender.flush()
+    # first failure keeps the reply for the next window
+    assert consumer._channel.acked == [] and consumer._channel.nacked == []
+
+    sender.flush()
+
+    assert channel.committed == []
+    assert metrics.snapshot()["counters"]["replies.dropped"] - before == 1
+    # the message goes to on_message_error, without a retry topology it is rejected to the DLX
+    assert consumer._channel.nacked == [(1, False)]
+    assert loop.run_until_complete(store.get("job-1")) is None
+
+    # nothing is left to retry forever
+    sender.flush()
+    assert channel.commits == 0
+
+
+def measure(batch_window: float, batch_size: int, replies: int = 200, rtt: float = 0.002):
+    """
+    Шлет replies ответов из обработчика, коммит пачки стоит rtt.
+    :return: (replies per second of the handler, worst added latency of a reply, commits)
+    """
+    channel = FakeBlockingChannel(rtt=rtt)
+    sender = make_sender(channel, batch_window=batch_window, batch_size=batch_size)
+    sent = {}
+
+    start = time.monotonic()
+    for number in range(replies):
+        sent[f'{{"n": {number}}}'.encode()] = time.monotonic()
+        sender.send_message({"n": number})
+    elapsed = time.monotonic() - start
+    while len(channel.committed) < replies:
+        time.sleep(batch_window or 0.001)
+
+    latency = max(committed - sent[body] for committed, body in channel.committed)
+    return replies / elapsed, latency, channel.commits
+
+
+def test_batching_trades_bounded_latency_for_throughput():
+    window, rtt = 0.05, 0.002
+    single_rate, single_latency, single_commits = measure(batch_window=window, batch_size=1, rtt=rtt)
+    batch_rate, batch_latency, batch_commits = measure(batch_window=window, batch_size=1000, rtt=rtt)
+
+    assert single_commits == 200
+    # one commit per window instead of one per reply
+    assert batch_commits <= 10
+    # the handler no longer waits for the broker on every reply
+    assert batch_rate > single_rate * 5
+    # a reply waits at most a window and one commit
+    assert single_latency < rtt * 10
+    assert batch_latency < window + rtt + 0.1
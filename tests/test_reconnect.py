@@ -0,0 +1,201 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pika
+import pytest
+from pika.exceptions import AMQPConnectionError, StreamLostError
+
+from app.services.queue import consumers
+from app.services.queue.consumers import URLConsumer, ReconnectingURLConsumer
+
+REFUSE = "refuse"
+
+
+class FakeChannel:
+    def __init__(self, connection: "FakeConnection", deliveries: list, then: str) -> None:
+        self.connection = connection
+        self.deliveries = deliveries
+        self.then = then
+        self.is_open = True
+        self.acked = []
+
+    def _soon(self, callback, *args):
+        self.connection.ioloop.call_soon(callback, *args)
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def add_on_cancel_callback(self, callback):
+        pass
+
+    def exchange_declare(self, exchange, exchange_type, callback, **kwargs):
+        self._soon(callback, None)
+
+    def queue_declare(self, queue, callback, **kwargs):
+        self._soon(callback, None)
+
+    def queue_bind(self, queue, exchange, routing_key, callback):
+        self._soon(callback, None)
+
+    def basic_qos(self, prefetch_count, callback=None):
+        if callback:
+            self._soon(callback, None)
+
+    def basic_consume(self, queue, on_message):
+        for tag, body in enumerate(self.deliveries, start=1):
+            deliver = SimpleNamespace(delivery_tag=tag)
+            self._soon(on_message, self, deliver, pika.BasicProperties(app_id="test"), body)
+        self._soon(self.connection.broker.after_deliveries, self.connection, self.then)
+        return "ctag"
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+        self.connection.broker.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        pass
+
+    def basic_cancel(self, consumer_tag, callback=None):
+        if callback:
+            self._soon(callback, None)
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeConnection:
+    def __init__(self, broker: "StubBroker", consumer: URLConsumer, ioloop) -> None:
+        self.broker = broker
+        self.consumer = consumer
+        self.ioloop = ioloop
+        self.is_closing = False
+        self.is_closed = False
+        self.channel_obj = None
+
+    def channel(self, on_open_callback):
+        self.channel_obj = FakeChannel(self, *self.broker.session)
+        self.ioloop.call_soon(on_open_callback, self.channel_obj)
+
+    def close(self):
+        self.is_closing = True
+        self.ioloop.call_soon(self.lost, None)
+
+    def lost(self, reason):
+        self.is_closed = True
+        if self.channel_obj:
+            self.channel_obj.is_open = False
+        self.consumer.on_connection_closed(self, reason)
+
+
+class StubBroker:
+    """
+    Брокер-заглушка: каждое подключение берет следующую сессию из сценария,
+    REFUSE - отказ в подключении, (сообщения, "drop"|"drain") - доставляет
+    сообщения и рвет соединение или останавливает потребителя
+    """
+
+    def __init__(self, sessions: list) -> None:
+        self.sessions = list(sessions)
+        self.session = None
+        self.connections = 0
+        self.acked = []
+        self.supervisor = None
+        self.ioloop = asyncio.new_event_loop()
+
+    def connect(self, consumer: URLConsumer) -> FakeConnection:
+        self.connections += 1
+        self.session = self.sessions.pop(0)
+        connection = FakeConnection(self, consumer, self.ioloop)
+        if self.session == REFUSE:
+            error = AMQPConnectionError("connection refused")
+            self.ioloop.call_soon(consumer.on_connection_open_error, connection, error)
+        else:
+            self.ioloop.call_soon(consumer.on_connection_open, connection)
+        return connection
+
+    def after_deliveries(self, connection: FakeConnection, then: str) -> None:
+        if then == "drop":
+            connection.lost(StreamLostError("Transport indicated EOF"))
+        else:
+            self.supervisor.drain(0.0)
+
+
+class StubConsumer(URLConsumer):
+    def __init__(self, broker: StubBroker) -> None:
+        super().__init__("amqp://stub", exchange="exchange", queue="queue", routing="routing")
+        self.broker = broker
+        self.handled = []
+
+    def connect(self):
+        return self.broker.connect(self)
+
+    def handle_message(self, body, properties=None) -> None:
+        self.handled.append(body)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(consumers.time, "sleep", delays.append)
+    return delays
+
+
+def test_resumes_consumption_after_dropped_connection(sleeps):
+    broker = StubBroker([REFUSE, REFUSE, ([b"first"], "drop"), REFUSE, ([b"second", b"third"], "drain")])
+    consumer = StubConsumer(broker)
+    supervisor = ReconnectingURLConsumer(consumer, base_delay=1.0, max_delay=30.0)
+    broker.supervisor = supervisor
+
+    tries = []
+    delay = supervisor._get_reconnect_delay
+    supervisor._get_reconnect_delay = lambda: tries.append(supervisor.tries) or delay()
+
+    try:
+        supervisor.run()
+    finally:
+        broker.ioloop.close()
+
+    assert consumer.handled == [b"first", b"second", b"third"]
+    assert broker.acked == [1, 1, 2]
+    assert broker.connections == 5
+    # backoff grows while the broker refuses and restarts after a healthy session
+    assert tries == [1, 2, 1, 2]
+    assert all(0 <= slept <= 1.0 * 2 ** (attempt - 1) for attempt, slept in zip(tries, sleeps))
+
+    stats = supervisor.stats()
+    assert stats["reconnects"] == 4
+    assert stats["connected"]
+
+
+def test_gives_up_after_max_tries(sleeps):
+    broker = StubBroker([REFUSE] * 3)
+    consumer = StubConsumer(broker)
+    supervisor = ReconnectingURLConsumer(consumer, base_delay=1.0, max_delay=30.0, max_tries=2)
+
+    try:
+        with pytest.raises(AMQPConnectionError):
+            supervisor.run()
+    finally:
+        broker.ioloop.close()
+
+    assert broker.connections == 3
+    assert len(sleeps) == 2
+    assert not supervisor.stats()["connected"]
+
+
+def test_reconnect_delay_grows_up_to_max_with_full_jitter(monkeypatch):
+    consumer = URLConsumer("amqp://stub", exchange="exchange", queue="queue", routing="routing")
+    supervisor = ReconnectingURLConsumer(consumer, base_delay=0.5, max_delay=5.0)
+
+    monkeypatch.setattr(random, "uniform", lambda low, high: high)
+    ceilings = []
+    for supervisor.tries in range(1, 8):
+        ceilings.append(supervisor._get_reconnect_delay())
+    assert ceilings == [0.5, 1.0, 2.0, 4.0, 5.0, 5.0, 5.0]
+
+    monkeypatch.undo()
+    supervisor.tries = 3
+    delays = [supervisor._get_reconnect_delay() for _ in range(200)]
+    assert all(0 <= delay <= 2.0 for delay in delays)
+    assert max(delays) - min(delays) > 0.5
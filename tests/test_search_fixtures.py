@@ -0,0 +1,178 @@
+from types import SimpleNamespace
+
+import pytest
+from selenium.common import StaleElementReferenceException, TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.wait import WebDriverWait
+
+from app import browser, handlers
+from app.browser import auth, auth_browser, is_authed
+from app.consts import ROBLOX_HOME_URL, ROBLOX_SEARCH_LOGIN_SELECTOR, ROBLOX_TOKEN_KEY
+from app.errors import SessionExpired
+from app.fixtures.publisher import RecordingPublisher
+from app.fixtures.server import FixtureServer, LOGGED_OUT, PAGE
+from app.fixtures.webdriver import FakeWebDriver
+from app.handlers import UrlHandler, press_agreement_button
+from app.schemas import SearchData, StatusCodes
+from app.services.breaker import CircuitBreaker, CircuitOpenError
+from app.services.limiter import AIMDLimiter, AdaptiveLimiter
+from app.services.metrics import metrics
+
+
+class BannedTokensServer(FixtureServer):
+    """
+    FixtureServer, который выбрасывает на логин сессии с токенами из banned
+    """
+
+    def __init__(self, banned=(), **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.banned = set(banned)
+
+    def render(self, path, query, token):
+        if token in self.banned:
+            return 200, PAGE.format(title="Login", body=LOGGED_OUT)
+        return super().render(path, query, token)
+
+
+@pytest.fixture(autouse=True)
+def fast_waits(monkeypatch):
+    """Timeouts of the handlers' waits are seconds, fixture pages are ready right away"""
+    def wait(driver, timeout, *args, **kwargs):
+        return WebDriverWait(driver, min(timeout, 0.3), poll_frequency=0.01)
+
+    monkeypatch.setattr(browser, "WebDriverWait", wait)
+    monkeypatch.setattr(handlers, "WebDriverWait", wait)
+
+
+@pytest.fixture
+def server():
+    with BannedTokensServer(results=25, page_size=10) as server:
+        yield server
+
+
+@pytest.fixture
+def driver(server):
+    driver = FakeWebDriver(server.url)
+    auth(driver, "fixture-token")
+    yield driver
+    driver.quit()
+
+
+def make_limiter() -> AdaptiveLimiter:
+    concurrency = AIMDLimiter(initial=2, min_limit=1, max_limit=4, latency_target=5.0)
+    return AdaptiveLimiter(concurrency, global_rate=0, token_rate=0, admission_timeout=1.0)
+
+
+async def search(driver, limit: int, limiter=None) -> dict:
+    handler = UrlHandler()
+    await handler.setup(token_service=None)
+    publisher = RecordingPublisher()
+    settings = SimpleNamespace(debug=False)
+    await handler(driver, SearchData(name="user", limit=limit), settings, publisher, {}, limiter=limiter)
+    [message] = publisher.messages
+    return message
+
+
+def test_is_authed_only_with_a_live_session(server):
+    driver = FakeWebDriver(server.url)
+    driver.get(ROBLOX_HOME_URL)
+    assert not is_authed(driver)
+
+    auth(driver, "fixture-token")
+    assert is_authed(driver)
+
+    server.banned.add("fixture-token")
+    driver.refresh()
+    assert not is_authed(driver)
+
+
+def test_agreement_modal_is_dismissed():
+    with FixtureServer(agreement_rate=1.0) as server:
+        driver = FakeWebDriver(server.url)
+        auth(driver, "fixture-token")
+        assert driver.find_elements(By.CSS_SELECTOR, ".modal-window")
+
+        press_agreement_button(driver)
+
+        assert not driver.find_elements(By.CSS_SELECTOR, ".modal-window")
+        assert is_authed(driver)
+        # no modal, nothing to press
+        press_agreement_button(driver)
+
+
+async def test_auth_browser_skips_logged_out_tokens(server, token_repo):
+    await token_repo.add_tokens(["bad", "good"])
+    server.banned.add("bad")
+    driver = FakeWebDriver(server.url)
+
+    assert await auth_browser(driver, token_repo, depth=3) == "good"
+    assert is_authed(driver)
+    assert driver.get_cookie(ROBLOX_TOKEN_KEY)["value"] == "good"
+    # the logged out token is only put aside
+    assert await token_repo.is_active("bad")
+
+
+@pytest.mark.parametrize("limit, expected", [(0, 10), (12, 12), (25, 25), (100, 25)])
+async def test_search_collects_pages_up_to_limit(driver, limit, expected):
+    message = await search(driver, limit)
+
+    assert message["status_code"] == StatusCodes.success
+    logins = [item["login"] for item in message["data"]]
+    assert logins == [f"@user_{n}" for n in range(expected)]
+
+
+async def test_next_page_waits_for_the_old_results_to_go_stale(driver):
+    handler = UrlHandler()
+    driver.get(handler.form_url("user"))
+    first_card = driver.find_element(By.CSS_SELECTOR, ROBLOX_SEARCH_LOGIN_SELECTOR)
+
+    assert handler.next_page(driver, None)
+
+    with pytest.raises(StaleElementReferenceException):
+        first_card.text
+    assert driver.find_element(By.CSS_SELECTOR, ROBLOX_SEARCH_LOGIN_SELECTOR).text == "@user_10"
+    assert handler.next_page(driver, None)
+    # the last page has a disabled button
+    assert not handler.next_page(driver, None)
+
+
+async def test_login_page_during_search_is_session_expired(server, driver):
+    server.banned.add("fixture-token")
+    before = metrics.snapshot()["counters"].get("limiter.overload.login_page", 0)
+    limiter = make_limiter()
+
+    with pytest.raises(SessionExpired):
+        await search(driver, 10, limiter=limiter)
+
+    assert metrics.snapshot()["counters"]["limiter.overload.login_page"] - before == 1
+
+
+async def test_throttled_search_is_reported_to_the_limiter(driver):
+    counters = metrics.snapshot()["counters"]
+    before = counters.get("limiter.overload.http_429", 0), counters.get("limiter.overload.login_page", 0)
+    limiter = make_limiter()
+    with FixtureServer(failure_rate=1.0) as throttling:
+        driver.base_url = throttling.url
+
+        # throttling is not a logout, the session stays
+        with pytest.raises(TimeoutException):
+            await search(driver, 10, limiter=limiter)
+
+    counters = metrics.snapshot()["counters"]
+    assert counters["limiter.overload.http_429"] - before[0] == 1
+    assert counters.get("limiter.overload.login_page", 0) == before[1]
+
+
+async def test_token_change_skips_the_database_while_its_circuit_is_open(driver, token_repo):
+    await token_repo.add_tokens(["fixture-token", "next"])
+    breaker = CircuitBreaker("db", failure_threshold=1, reset_timeout=60)
+    breaker.failure()
+    handler = UrlHandler()
+    await handler.setup(token_service=token_repo, db_breaker=breaker)
+
+    with pytest.raises(CircuitOpenError):
+        await handler.change_token(driver)
+
+    # neither marked as spent nor swapped
+    assert await token_repo.is_active("fixture-token")
+    assert driver.get_cookie(ROBLOX_TOKEN_KEY)["value"] == "fixture-token"
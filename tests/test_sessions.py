@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from app.errors import LoginFailed
+from app.services.breaker import CircuitBreaker, CircuitOpenError
+from app.services.sessions import login_with_tokens
+
+
+async def test_login_stops_when_tries_are_exhausted(token_repo):
+    await token_repo.add_tokens([f"token-{n}" for n in range(10)])
+    tried = []
+
+    async def login(token: str) -> bool:
+        tried.append(token)
+        return False
+
+    with pytest.raises(LoginFailed):
+        await login_with_tokens(token_repo, login, depth=2)
+
+    assert len(tried) == 3 and len(set(tried)) == 3
+    # the earlier ones are only put aside, the last one is switched off
+    assert [await token_repo.is_active(token) for token in tried] == [True, True, False]
+
+
+async def test_login_returns_first_working_token(token_repo):
+    await token_repo.add_tokens(["bad", "good"])
+
+    async def login(token: str) -> bool:
+        return token == "good"
+
+    assert await login_with_tokens(token_repo, login, depth=5) == "good"
+    assert await token_repo.is_active("bad")
+
+
+async def test_login_without_tokens(token_repo):
+    async def login(token: str) -> bool:
+        return True
+
+    with pytest.raises(ValueError):
+        await login_with_tokens(token_repo, login)
+
+
+class DownRepository:
+    """
+    БД, которая не отвечает: каждый запрос ждет таймаут
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def fetch_token(self):
+        self.calls += 1
+        raise asyncio.TimeoutError()
+
+
+async def test_login_fails_fast_once_db_circuit_is_open():
+    repo = DownRepository()
+    breaker = CircuitBreaker("db", failure_threshold=2, reset_timeout=60)
+
+    async def login(token: str) -> bool:
+        return True
+
+    for _ in range(2):
+        with pytest.raises(asyncio.TimeoutError):
+            await login_with_tokens(repo, login, db_breaker=breaker)
+    with pytest.raises(CircuitOpenError):
+        await login_with_tokens(repo, login, db_breaker=breaker)
+
+    # the open circuit doesn't touch the database
+    assert repo.calls == 2
@@ -0,0 +1,58 @@
+import aiohttp
+import pika
+import pytest
+
+from app.fixtures.publisher import RecordingPublisher
+from app.listeners import HttpSearchHandler
+from app.schemas import SearchData, SearchResponse, StatusCodes
+
+
+def results(count: int, start: int = 0):
+    return [SearchResponse(login=f"@user_{n}", nickname=f"user{n}") for n in range(start, start + count)]
+
+
+class FlakyPages(HttpSearchHandler):
+    """
+    Отдает страницы, после fail_after страниц падает как упавший запрос
+    """
+
+    def __init__(self, pages: int, fail_after: int = None) -> None:
+        super().__init__()
+        self.pages = pages
+        self.fail_after = fail_after
+
+    async def iter_pages(self, http, search_data, limiter=None):
+        for number in range(self.pages):
+            if number == self.fail_after:
+                raise aiohttp.ClientConnectionError("connection reset")
+            yield results(3, start=number * 3)
+
+
+async def test_every_chunk_carries_job_id():
+    publisher = RecordingPublisher()
+    properties = pika.BasicProperties(message_id="job-7")
+    search_data = SearchData(name="user", limit=6, stream=True, chunk_size=2)
+
+    await FlakyPages(pages=2)(None, search_data, publisher, properties=properties)
+
+    # pages of 3 in chunks of 2, then the terminator
+    assert [message["job_id"] for message in publisher.messages] == ["job-7"] * 5
+    assert [message["seq"] for message in publisher.messages] == [0, 1, 2, 3, 4]
+    assert [message["final"] for message in publisher.messages] == [False, False, False, False, True]
+    assert publisher.messages[-1]["status_code"] == StatusCodes.success
+
+
+async def test_failed_stream_is_terminated():
+    publisher = RecordingPublisher()
+    properties = pika.BasicProperties(headers={"job_id": "job-8"})
+    search_data = SearchData(name="user", limit=6, stream=True, chunk_size=3)
+
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await FlakyPages(pages=2, fail_after=1)(None, search_data, publisher, properties=properties)
+
+    last = publisher.messages[-1]
+    assert len(publisher.messages) == 2
+    assert last["job_id"] == "job-8"
+    assert last["final"] and last["seq"] == 1
+    assert last["status_code"] == StatusCodes.fail
+    assert last["errors"][0]["name"] == "ClientConnectionError"